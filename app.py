@@ -1,17 +1,27 @@
 import streamlit as st
 import openai
-import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import tempfile
 import os
 from scipy.io.wavfile import write as write_wav
 import time
+import uuid
 import requests
 from io import BytesIO
 
+import config
+import mic_capture
+import speculative_tts
+import transcription_cache
+import voice_pipeline
+from voice_pipeline import transcribe_audio
+
+# Providers, voices and secrets (from the environment) are configured in config.py
+settings = config.get_settings()
+
 # Configure OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+openai.api_key = settings.provider("openai").api_key
 
 # Initialize session state
 if 'messages' not in st.session_state:
@@ -21,13 +31,18 @@ if 'voice_id' not in st.session_state:
 if 'voice_name' not in st.session_state:
     st.session_state.voice_name = None
 if 'elevenlabs_api_key' not in st.session_state:
-    st.session_state.elevenlabs_api_key = "sk_70e497669c4fc9c9db47626a33be33be13cc3999aca6abbc"
+    st.session_state.elevenlabs_api_key = settings.provider("elevenlabs").api_key or ""
+if 'session_token' not in st.session_state:
+    # Speculative synthesis of this browser session's turns
+    st.session_state.session_token = uuid.uuid4().hex
+
+# Shared speculative synthesizer (stock phrases, sentences of streamed replies)
+speculator = speculative_tts.get_speculator()
 
 def record_audio(duration=5, sample_rate=44100):
     """Record audio from microphone"""
-    recording = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=1)
-    sd.wait()
-    return recording
+    # Callback capture into a ring buffer; stops early once the speaker goes quiet
+    return mic_capture.record(duration, sample_rate)
 
 def save_audio(recording, sample_rate=44100):
     """Save recorded audio to a temporary file"""
@@ -35,66 +50,32 @@ def save_audio(recording, sample_rate=44100):
         write_wav(temp_file.name, sample_rate, recording)
         return temp_file.name
 
-def transcribe_audio(audio_file):
-    """Transcribe audio using OpenAI Whisper"""
-    with open(audio_file, 'rb') as file:
-        transcript = openai.audio.transcriptions.create(
-            model="whisper-1",
-            file=file
-        )
-    return transcript.text
-
 def get_available_voices():
     """Get list of available ElevenLabs voices"""
     try:
-        headers = {
-            "xi-api-key": st.session_state.elevenlabs_api_key,
-            "Accept": "application/json"
-        }
-        response = requests.get(
-            "https://api.elevenlabs.io/v1/voices",
-            headers=headers
-        )
-        if response.status_code == 200:
-            voices_data = response.json()
-            return {voice["name"]: voice["voice_id"] for voice in voices_data["voices"]}
-        else:
-            st.error(f"Error fetching voices: {response.status_code} - {response.text}")
-            return {}
+        return voice_pipeline.elevenlabs_voices(st.session_state.elevenlabs_api_key)
     except Exception as e:
         st.error(f"Error fetching voices: {str(e)}")
         return {}
 
 def text_to_speech_with_voice(text, voice_id):
-    """Convert text to speech using ElevenLabs API"""
+    """Convert text to speech using ElevenLabs API, returns (audio, format)"""
     try:
-        headers = {
-            "xi-api-key": st.session_state.elevenlabs_api_key,
-            "Content-Type": "application/json",
-            "Accept": "audio/mpeg"
-        }
-        data = {
-            "text": text,
-            "model_id": "eleven_monolingual_v1",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.75
-            }
-        }
-        response = requests.post(
-            f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}",
-            headers=headers,
-            json=data
-        )
-        
-        if response.status_code == 200:
-            return response.content
-        else:
-            st.error(f"Error generating speech: {response.status_code} - {response.text}")
-            return None
+        # Reuses speculative audio for stock phrases and already-synthesized sentences
+        return speculator.speak(text, "elevenlabs", voice_id, st.session_state.elevenlabs_api_key)
     except Exception as e:
         st.error(f"Error generating speech: {str(e)}")
-        return None
+        return None, None
+
+def stream_reply(messages):
+    """Stream the chat reply, synthesizing finished sentences while the rest is generated"""
+    speculator.new_turn(st.session_state.session_token)
+    chunks = voice_pipeline.chat_reply_stream(messages)
+    if st.session_state.voice_id and st.session_state.elevenlabs_api_key:
+        chunks = speculator.speculate_stream(chunks, "elevenlabs", st.session_state.voice_id,
+                                             st.session_state.elevenlabs_api_key,
+                                             token=st.session_state.session_token)
+    return st.write_stream(chunks)
 
 # Streamlit UI
 st.title("Voice-Enabled AI Chatbot with ElevenLabs Voices")
@@ -103,7 +84,11 @@ st.write("Chat with AI using text or voice!")
 # Sidebar for settings
 with st.sidebar:
     st.header("Settings")
-    recording_duration = st.slider("Recording Duration (seconds)", 1, 10, 5)
+    recording_duration = st.slider("Max Recording Duration (seconds)", 1, 10, 5)
+
+    # Transcription cache hit rate for this server process
+    stt_cache = transcription_cache.stats()
+    st.caption(f"Transcription cache: {stt_cache['hit_rate']:.0%} hit rate, {stt_cache['entries']} entries")
     
     st.header("ElevenLabs Configuration")
     elevenlabs_key = st.text_input("Enter ElevenLabs API Key", value=st.session_state.elevenlabs_api_key, type="password")
@@ -122,6 +107,9 @@ with st.sidebar:
             if selected_voice:
                 st.session_state.voice_id = available_voices[selected_voice]
                 st.session_state.voice_name = selected_voice
+                # Precompute stock phrases for this voice (no-op once cached)
+                speculator.warm(provider="elevenlabs", voice_id=st.session_state.voice_id,
+                                api_key=st.session_state.elevenlabs_api_key)
         else:
             st.warning("Please enter a valid ElevenLabs API key to see available voices")
 
@@ -137,19 +125,14 @@ if prompt := st.chat_input("Type your message here..."):
         st.write(prompt)
 
     with st.chat_message("assistant"):
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-        )
-        response_text = response.choices[0].message.content
-        st.write(response_text)
+        response_text = stream_reply(st.session_state.messages)
         st.session_state.messages.append({"role": "assistant", "content": response_text})
         
         # Generate speech with selected voice if available
         if st.session_state.voice_id and st.session_state.elevenlabs_api_key:
-            audio = text_to_speech_with_voice(response_text, st.session_state.voice_id)
+            audio, audio_format = text_to_speech_with_voice(response_text, st.session_state.voice_id)
             if audio:
-                st.audio(audio, format="audio/mp3")
+                st.audio(audio, format=f"audio/{audio_format}")
 
 # Voice input button
 if st.button("🎤 Record Voice Input"):
@@ -166,19 +149,14 @@ if st.button("🎤 Record Voice Input"):
         
         # Get AI response
         with st.chat_message("assistant"):
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-            )
-            response_text = response.choices[0].message.content
-            st.write(response_text)
+            response_text = stream_reply(st.session_state.messages)
             st.session_state.messages.append({"role": "assistant", "content": response_text})
             
             # Generate speech with selected voice if available
             if st.session_state.voice_id and st.session_state.elevenlabs_api_key:
-                audio = text_to_speech_with_voice(response_text, st.session_state.voice_id)
+                audio, audio_format = text_to_speech_with_voice(response_text, st.session_state.voice_id)
                 if audio:
-                    st.audio(audio, format="audio/mp3")
+                    st.audio(audio, format=f"audio/{audio_format}")
         
         # Clean up temporary files
         os.unlink(audio_file)
@@ -186,4 +164,4 @@ if st.button("🎤 Record Voice Input"):
 # Clear chat button
 if st.button("Clear Chat"):
     st.session_state.messages = []
-    st.experimental_rerun() 
\ No newline at end of file
+    st.rerun() 
\ No newline at end of file
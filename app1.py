@@ -1,6 +1,5 @@
 import streamlit as st
 import openai
-import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import tempfile
@@ -9,23 +8,32 @@ import requests
 from io import BytesIO
 from dotenv import load_dotenv
 
+import audio_encode
+import config
+import mic_capture
+import transcription_cache
+import voice_pipeline
+from voice_pipeline import transcribe_audio
+
 # Load environment variables
 load_dotenv()
 
+# Providers, voices and secrets (from the environment) are configured in config.py
+settings = config.get_settings()
+
 # Configure OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+openai.api_key = settings.provider("openai").api_key
 
 # Initialize session state for messages and Speechify API key
 if "messages" not in st.session_state:
     st.session_state.messages = []
 if "speechify_api_key" not in st.session_state:
-    st.session_state.speechify_api_key = ""
+    st.session_state.speechify_api_key = settings.provider("speechify").api_key or ""
 
 # Function to record audio
 def record_audio(duration=5, sample_rate=44100):
-    recording = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=1)
-    sd.wait()
-    return recording
+    # Callback capture into a ring buffer; stops early once the speaker goes quiet
+    return mic_capture.record(duration, sample_rate)
 
 # Function to save audio to a temporary file
 def save_audio(recording, sample_rate=44100):
@@ -33,20 +41,11 @@ def save_audio(recording, sample_rate=44100):
     sf.write(temp_file.name, recording, sample_rate)
     return temp_file.name
 
-# Function to transcribe audio using OpenAI Whisper
-def transcribe_audio(audio_file):
-    with open(audio_file, 'rb') as file:
-        transcript = openai.audio.transcriptions.create(
-            model="whisper-1",
-            file=file
-        )
-    return transcript.text
-
 # Function to convert text to speech using Speechify
 def text_to_speech_with_speechify(text, voice="en-US-Neural2-F"):
     try:
         # Speechify API endpoint
-        url = "https://api.speechify.ai/v2/tts"
+        url = settings.provider("speechify").url("legacy_tts")
         
         # Headers for the API request
         headers = {
@@ -77,10 +76,25 @@ def text_to_speech_with_speechify(text, voice="en-US-Neural2-F"):
         st.error(f"Error in text-to-speech conversion: {str(e)}")
         return None
 
+# Function to get the browser's request headers (User-Agent, Client Hints)
+def get_client_headers():
+    return st.context.headers
+
+# Function to compress a reply clip for this browser, returns (path, mime)
+def compress_audio(audio_file):
+    target_format, bitrate = audio_encode.choose_format_from_headers(get_client_headers())
+    try:
+        path = audio_encode.encode_cached(audio_file, target_format, bitrate)
+        mime = audio_encode.FORMATS[target_format]["mime"]
+    except Exception:
+        path, mime = audio_file, "audio/mpeg"
+    audio_encode.record_turn(os.path.getsize(path))
+    return path, mime
+
 # Function to get available voices from Speechify
 def get_available_voices():
     try:
-        url = "https://api.speechify.ai/v2/voices"
+        url = settings.provider("speechify").url("legacy_voices")
         headers = {
             "Authorization": f"Bearer {st.session_state.speechify_api_key}",
             "Accept": "application/json"
@@ -106,7 +120,11 @@ with st.sidebar:
     st.header("Settings")
     
     # Recording duration control
-    recording_duration = st.slider("Recording Duration (seconds)", 1, 10, 5)
+    recording_duration = st.slider("Max Recording Duration (seconds)", 1, 10, 5)
+
+    # Transcription cache hit rate for this server process
+    stt_cache = transcription_cache.stats()
+    st.caption(f"Transcription cache: {stt_cache['hit_rate']:.0%} hit rate, {stt_cache['entries']} entries")
     
     # Speechify API key input
     speechify_api_key = st.text_input(
@@ -133,7 +151,7 @@ for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.write(message["content"])
         if "audio" in message:
-            st.audio(message["audio"])
+            st.audio(message["audio"], format=message.get("audio_mime", "audio/mpeg"))
 
 # Chat input
 if prompt := st.chat_input("Type your message here..."):
@@ -146,22 +164,20 @@ if prompt := st.chat_input("Type your message here..."):
     
     # Get AI response
     with st.chat_message("assistant"):
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-        )
-        response_text = response.choices[0].message.content
+        response_text = voice_pipeline.chat_reply(st.session_state.messages)
         st.write(response_text)
         
         # Convert response to speech
         if st.session_state.speechify_api_key and voices:
             audio_file = text_to_speech_with_speechify(response_text, voices[selected_voice])
             if audio_file:
-                st.audio(audio_file)
+                audio_path, audio_mime = compress_audio(audio_file)
+                st.audio(audio_path, format=audio_mime)
                 st.session_state.messages.append({
                     "role": "assistant",
                     "content": response_text,
-                    "audio": audio_file
+                    "audio": audio_path,
+                    "audio_mime": audio_mime
                 })
         else:
             st.session_state.messages.append({
@@ -184,22 +200,20 @@ if st.button("🎤 Record Voice Input"):
         
         # Get AI response for voice input
         with st.chat_message("assistant"):
-            response = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-            )
-            response_text = response.choices[0].message.content
+            response_text = voice_pipeline.chat_reply(st.session_state.messages)
             st.write(response_text)
             
             # Convert response to speech
             if st.session_state.speechify_api_key and voices:
                 audio_file = text_to_speech_with_speechify(response_text, voices[selected_voice])
                 if audio_file:
-                    st.audio(audio_file)
+                    audio_path, audio_mime = compress_audio(audio_file)
+                    st.audio(audio_path, format=audio_mime)
                     st.session_state.messages.append({
                         "role": "assistant",
                         "content": response_text,
-                        "audio": audio_file
+                        "audio": audio_path,
+                        "audio_mime": audio_mime
                     })
             else:
                 st.session_state.messages.append({
@@ -213,4 +227,4 @@ if st.button("🎤 Record Voice Input"):
 # Clear chat button
 if st.button("Clear Chat"):
     st.session_state.messages = []
-    st.experimental_rerun()
+    st.rerun()
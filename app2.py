@@ -1,33 +1,72 @@
 import streamlit as st
 import openai
-import sounddevice as sd
 import soundfile as sf
 import numpy as np
 import tempfile
 import os
+import time
+import uuid
 import requests
 import base64
 import shutil
 from io import BytesIO
 from dotenv import load_dotenv
 
+import audio_archive
+import audio_encode
+import browser_capture
+import chat_router
+import config
+import mic_capture
+import profiling
+import semantic_cache
+import speculative_tts
+import transcription_cache
+import turn_runner
+import voice_pipeline
+from voice_pipeline import transcribe_audio
+
 # Load environment variables
 load_dotenv()
 if not os.path.exists("media/audio"):
     os.makedirs("media/audio", exist_ok=True)
 
+# Reply clips are served by URL from Streamlit's static folder (see .streamlit/config.toml)
+AUDIO_DIR = os.path.join("static", "audio")
+AUDIO_URL = "app/static/audio"
+os.makedirs(AUDIO_DIR, exist_ok=True)
+
+# Providers, voices and secrets (from the environment) are configured in config.py
+settings = config.get_settings()
+
 # Configure OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
+openai.api_key = settings.provider("openai").api_key
 
 # Initialize session state for messages
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "conversation_id" not in st.session_state:
+    st.session_state.conversation_id = uuid.uuid4().hex
+if "session_token" not in st.session_state:
+    # Speculative synthesis of this browser session's turns
+    st.session_state.session_token = uuid.uuid4().hex
+
+# Chat history (text and reply audio) is persisted in a memory-mapped archive
+archive = audio_archive.get_archive()
+
+# A running session profile samples whichever thread serves this rerun
+if "profile" in st.session_state:
+    st.session_state.profile.attach()
+
+# Shared speculative synthesizer (stock phrases, sentences of streamed replies)
+speculator = speculative_tts.get_speculator()
+# Answers to earlier questions, with their audio, shared by all sessions of this process
+answers = semantic_cache.get_cache()
 
 # Function to record audio
 def record_audio(duration=5, sample_rate=44100):
-    recording = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=1)
-    sd.wait()
-    return recording
+    # Callback capture into a ring buffer; stops early once the speaker goes quiet
+    return mic_capture.record(duration, sample_rate)
 
 # Function to save audio to a temporary file
 def save_audio(recording, sample_rate=44100):
@@ -35,70 +74,85 @@ def save_audio(recording, sample_rate=44100):
     sf.write(temp_file.name, recording, sample_rate)
     return temp_file.name
 
-# Function to transcribe audio using OpenAI Whisper
-def transcribe_audio(audio_file):
-    with open(audio_file, 'rb') as file:
-        transcript = openai.audio.transcriptions.create(
-            model="whisper-1",
-            file=file
-        )
-    return transcript.text
-
 # Function to convert text to speech using Speechify
-def text_to_speech_with_speechify(text, voice_id="dc1f0dc1-ff98-4086-8687-40c0bb495965"):
+def text_to_speech_with_speechify(text, voice_id=voice_pipeline.DEFAULT_VOICE_ID, normalize=True):
     try:
-        # Speechify API endpoint
-        url = "https://api.sws.speechify.com/v1/audio/speech"
-        
-        # Get API key from environment variable
-        api_key = os.getenv("SPEECHIFY_API_KEY")
-        if not api_key:
-            st.error("SPEECHIFY_API_KEY environment variable not set")
-            return None, None
-            
-        # Headers for the API request
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-        
-        # Request body
-        data = {
-            "input": text,
-            "voice_id": voice_id
-        }
-        
-        # Make the API request
-        response = requests.post(url, json=data, headers=headers)
-        
-        if response.status_code == 200:
-            # Parse the JSON response
-            response_data = response.json()
-            
-            # Check if audio_data is in the response
-            if "audio_data" in response_data:
-                # Get the audio data directly
-                audio_binary = base64.b64decode(response_data["audio_data"])
-                audio_format = response_data.get("audio_format", "wav")
-                return audio_binary, audio_format
-            else:
-                st.error(f"No audio data in response: {response_data}")
-                return None, None
+        # Reuses speculative audio for stock phrases and already-synthesized sentences
+        return speculator.speak(text, "speechify", voice_id, postprocess=normalize)
+    except voice_pipeline.ProviderError as e:
+        if e.status_code == 429:
+            st.warning("Speechify rate limit reached, please try again in a moment.")
         else:
-            st.error(f"Error generating speech: {response.status_code} - {response.text}")
-            return None, None
+            st.error(f"Error generating speech: {e.status_code} - {e.message}")
+        return None, None
     except Exception as e:
         st.error(f"Error in text-to-speech conversion: {str(e)}")
-        import traceback
-        st.error(traceback.format_exc())
         return None, None
 
+# Function to answer the last message from the semantic cache or the chat model, returns (text, slot, hit)
+def get_reply(voice_id, normalize, budget):
+    scope = semantic_cache.scope_for(st.session_state.conversation_id)
+    hit = answers.lookup(st.session_state.messages, scope)
+    if hit:
+        # Same question asked before (in other words): no chat round trip
+        st.write(hit.text)
+        return hit.text, hit.slot, hit
+    # Stream the reply; finished sentences are synthesized while the rest is generated
+    start = time.perf_counter()
+    speculator.new_turn(st.session_state.session_token)
+    response_text = st.write_stream(speculator.speculate_stream(
+        voice_pipeline.chat_reply_stream(st.session_state.messages, budget=budget),
+        "speechify", voice_id, postprocess=normalize, token=st.session_state.session_token
+    ))
+    slot = answers.store(st.session_state.messages, response_text, scope, time.perf_counter() - start)
+    return response_text, slot, None
+
+# Function to get the reply audio, reusing the audio stored with a cached answer
+def speak_reply(text, slot, hit, voice_id, normalize):
+    voice = ("speechify", voice_id, normalize)
+    if hit:
+        audio_data, audio_format = answers.audio(hit, voice)
+        if audio_data is not None:
+            return audio_data, audio_format
+    start = time.perf_counter()
+    audio_data, audio_format = text_to_speech_with_speechify(text, voice_id, normalize)
+    answers.attach_audio(slot, voice, audio_data, audio_format, time.perf_counter() - start)
+    return audio_data, audio_format
+
+# Function to get the browser's request headers (User-Agent, Client Hints)
+def get_client_headers():
+    return st.context.headers
+
+# Function to store a reply clip and transcode it for this browser, returns (url, mime)
+def deliver_audio(audio_data, audio_format):
+    source = audio_encode.store_clip(audio_data, audio_format, AUDIO_DIR)
+    target_format, bitrate = audio_encode.choose_format_from_headers(get_client_headers())
+    try:
+        path = audio_encode.encode_cached(source, target_format, bitrate)
+        mime = audio_encode.FORMATS[target_format]["mime"]
+    except Exception as e:
+        st.warning(f"Could not compress audio, sending original: {str(e)}")
+        path, mime = source, f"audio/{audio_format}"
+    audio_encode.record_turn(os.path.getsize(path))
+    return f"{AUDIO_URL}/{os.path.basename(path)}", mime
+
+# Function to keep a delivered clip from being pruned while it is in the chat history
+def clip_available(audio_url):
+    return audio_encode.touch_clip(os.path.join(AUDIO_DIR, os.path.basename(audio_url)))
+
+# Function to add a message to the chat and the history archive
+def add_message(role, content, audio_data=None, audio_format=None, audio_url=None, audio_mime=None):
+    clip_id = archive.append(st.session_state.conversation_id, role, content, audio_data, audio_format)
+    message = {"role": role, "content": content, "clip_id": clip_id if audio_data else None}
+    if audio_url:
+        message.update(audio_url=audio_url, audio_mime=audio_mime)
+    st.session_state.messages.append(message)
+
 # Function to create auto-playing audio HTML
-def create_auto_play_audio(audio_data, audio_format):
-    audio_base64 = base64.b64encode(audio_data).decode('utf-8')
+def create_auto_play_audio(audio_url, audio_mime):
     audio_html = f"""
         <audio autoplay controls style="display: none;">
-            <source src="data:audio/{audio_format};base64,{audio_base64}" type="audio/{audio_format}">
+            <source src="{audio_url}" type="{audio_mime}">
         </audio>
     """
     return audio_html
@@ -112,13 +166,21 @@ with st.sidebar:
     st.header("Settings")
     
     # Recording duration control
-    recording_duration = st.slider("Recording Duration (seconds)", 1, 10, 5)
+    recording_duration = st.slider("Max Recording Duration (seconds)", 1, 10, 5)
+
+    # "Browser" records on the user's device and streams to the voice server (server.py) while
+    # they speak; "Server" records from the microphone of the machine running this app
+    mic_source = st.radio("Microphone", ["Server", "Browser"], horizontal=True)
+
+    # Transcription cache hit rate for this server process
+    stt_cache = transcription_cache.stats()
+    st.caption(f"Transcription cache: {stt_cache['hit_rate']:.0%} hit rate, {stt_cache['entries']} entries")
+    answer_cache = answers.stats()
+    st.caption(f"Answer cache: {answer_cache['hit_rate']:.0%} hit rate, {answer_cache['seconds_saved']:.1f}s saved")
     
     # Voice selection
-    voice_options = {
-        "Default Voice": "dc1f0dc1-ff98-4086-8687-40c0bb495965"
-        # Add more voices here if you know their IDs
-    }
+    # Voices are listed in config.py / voice_config.json
+    voice_options = {voice.name: voice.id for voice in settings.voices_for("speechify")}
     
     selected_voice = st.selectbox(
         "Select Voice",
@@ -126,17 +188,104 @@ with st.sidebar:
     )
     voice_id = voice_options[selected_voice]
 
+    # Seconds until the first sentence of a reply; longer prompts or tighter budgets move to faster models
+    reply_budget = st.slider("Reply latency budget (seconds)", 0.5, 5.0, float(settings.chat_budget_seconds), 0.1)
+    last_route = chat_router.get_router().last
+    if last_route:
+        st.caption(f"Last reply: {last_route['backend']}, first token {last_route['first_token_seconds']:.2f}s "
+                   f"(predicted {last_route['predicted_seconds']:.2f}s)")
+
+    # Trim silence, resample and loudness-normalize replies before playback
+    normalize_audio = st.checkbox("Normalize voice loudness", value=True)
+
+    # Precompute stock phrases for this voice (no-op once cached)
+    speculator.warm(voice_id=voice_id, postprocess=normalize_audio)
+
+    # Where the time went in the last voice turn
+    if st.session_state.get("last_turn"):
+        last_turn = st.session_state.last_turn
+        st.caption(
+            f"Last voice turn: {last_turn['wall_seconds']:.1f}s, critical path "
+            + " → ".join(last_turn["critical_path"])
+        )
+
+    # Sample where this session's time (and optionally memory) goes; written as collapsed stacks
+    st.header("Profiling")
+    profile_turns = st.checkbox("Profile voice turns", value=False)
+    profile_memory = st.checkbox("Trace allocations (slow)", value=False)
+    if "profile" not in st.session_state:
+        if st.button("Start profiling this session"):
+            name = f"session-{st.session_state.conversation_id[:8]}"
+            st.session_state.profile = profiling.Profile(name, memory=profile_memory).start()
+            st.rerun()
+    elif st.button("Stop and save profile"):
+        profile = st.session_state.pop("profile")
+        st.session_state.last_profile = {"paths": profile.stop(), "top": profile.top(5)}
+    if st.session_state.get("last_profile"):
+        last_profile = st.session_state.last_profile
+        st.caption("Saved " + ", ".join(last_profile["paths"].values()))
+        for function, share in last_profile["top"]:
+            st.caption(f"{share:.0%} {function}")
+
+    # Past conversations from the history archive
+    st.header("History")
+    past = {f"{(title or 'Untitled')[:40]} ({time.strftime('%b %d %H:%M', time.localtime(last))})": conversation
+            for conversation, title, last in archive.conversations()}
+    if past:
+        chosen = st.selectbox("Past conversations", options=list(past.keys()))
+        if st.button("Load conversation"):
+            st.session_state.conversation_id = past[chosen]
+            st.session_state.messages = archive.messages(past[chosen])
+            st.rerun()
+        if st.button("Export conversation"):
+            export_path = os.path.join(tempfile.gettempdir(), f"{past[chosen]}.zip")
+            with open(archive.export(past[chosen], export_path), "rb") as f:
+                st.download_button(
+                    "Download export",
+                    data=f.read(),
+                    file_name=f"conversation-{past[chosen][:8]}.zip",
+                    mime="application/zip"
+                )
+
+    # Audio delivery stats for this server process
+    delivery = audio_encode.stats()
+    if delivery["turns"]:
+        st.caption(
+            f"Audio per turn: {delivery['avg_bytes_per_turn'] / 1024:.1f} KB, "
+            f"transcode CPU: {delivery['cpu_ms_per_transcode']:.0f} ms"
+        )
+
 # Main chat interface
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.write(message["content"])
-        if "audio_data" in message and message["audio_data"] is not None:
-            st.markdown(create_auto_play_audio(message["audio_data"], message["audio_format"]), unsafe_allow_html=True)
+        # A clip pruned from static/audio is played from the archive instead
+        if message.get("audio_url") and clip_available(message["audio_url"]):
+            st.markdown(create_auto_play_audio(message["audio_url"], message["audio_mime"]), unsafe_allow_html=True)
+        elif message.get("clip_id"):
+            # Replayed from the archive: only the clip being played is copied out of the mapped file
+            if st.session_state.get("playing_clip") == message["clip_id"]:
+                audio, audio_format = archive.read(message["clip_id"])
+                if audio is not None:
+                    # The archive keeps the provider's format, not the one delivered to this browser
+                    st.audio(bytes(audio), format=audio_archive.MIME_TYPES.get(audio_format, f"audio/{audio_format}"))
+            elif st.button("Play", key=f"play-{message['clip_id']}"):
+                st.session_state.playing_clip = message["clip_id"]
+                st.rerun()
+
+# Browser microphone: the transcript arrives once per utterance (and again on later reruns)
+spoken = None
+if mic_source == "Browser":
+    captured = browser_capture.recorder(settings.capture_url, settings.capture_format, recording_duration,
+                                        key="browser_recorder")
+    if captured and captured["id"] != st.session_state.get("last_capture_id"):
+        st.session_state.last_capture_id = captured["id"]
+        spoken = captured["text"].strip() or None
 
 # Chat input
-if prompt := st.chat_input("Type your message here..."):
+if prompt := (st.chat_input("Type your message here...") or spoken):
     # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    add_message("user", prompt)
     
     # Display user message
     with st.chat_message("user"):
@@ -144,73 +293,74 @@ if prompt := st.chat_input("Type your message here..."):
     
     # Get AI response
     with st.chat_message("assistant"):
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-        )
-        response_text = response.choices[0].message.content
-        st.write(response_text)
+        response_text, slot, hit = get_reply(voice_id, normalize_audio, reply_budget)
         
         # Convert response to speech
-        audio_data, audio_format = text_to_speech_with_speechify(response_text, voice_id)
+        audio_data, audio_format = speak_reply(response_text, slot, hit, voice_id, normalize_audio)
         if audio_data:
-            st.markdown(create_auto_play_audio(audio_data, audio_format), unsafe_allow_html=True)
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response_text,
-                "audio_data": audio_data,
-                "audio_format": audio_format
-            })
+            audio_url, audio_mime = deliver_audio(audio_data, audio_format)
+            st.markdown(create_auto_play_audio(audio_url, audio_mime), unsafe_allow_html=True)
+            add_message("assistant", response_text, audio_data, audio_format, audio_url, audio_mime)
         else:
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": response_text
-            })
+            add_message("assistant", response_text)
 
 # Voice input button
-if st.button("🎤 Record Voice Input"):
-    with st.spinner("Recording..."):
-        recording = record_audio(duration=recording_duration)
-        audio_file = save_audio(recording)
+if mic_source == "Server" and st.button("🎤 Record Voice Input"):
+    # Stages run on the shared turn pool, so a turn profile samples every thread (VOICE_PROFILE
+    # switches this on for all sessions)
+    turn_mode = ("cpu,memory" if profile_memory else "cpu") if profile_turns else None
+    turn_profile = profiling.maybe_profile("voice-turn", turn_mode, threads="all")
+    with st.spinner("Recording..."), turn_runner.Turn("voice") as turn, turn_profile:
+        # Open the Whisper and Speechify connections while the user is speaking (never waited on)
+        turn.submit("warm_stt", voice_pipeline.warm_connections, "openai")
+        turn.submit("warm_tts", voice_pipeline.warm_connections, "speechify")
+        recording = turn.call("record", record_audio, duration=recording_duration)
+        audio_file = turn.call("save_wav", save_audio, recording)
         
         try:
             # Transcribe the audio
-            transcript = transcribe_audio(audio_file)
+            transcript = turn.call("transcribe", transcribe_audio, audio_file)
+            # The temp file is no longer needed; delete it off the critical path
+            turn.submit("cleanup", os.unlink, audio_file)
+            if not transcript.strip():
+                # Nothing heard: answer with the precomputed stock phrase
+                audio_data, audio_format = text_to_speech_with_speechify(speculative_tts.SORRY_PHRASE, voice_id, normalize_audio)
+                st.write(speculative_tts.SORRY_PHRASE)
+                if audio_data:
+                    audio_url, audio_mime = deliver_audio(audio_data, audio_format)
+                    st.markdown(create_auto_play_audio(audio_url, audio_mime), unsafe_allow_html=True)
+                st.stop()
             st.write(f"🎤 {transcript}")
             
             # Add transcribed text to chat
-            st.session_state.messages.append({"role": "user", "content": transcript})
+            add_message("user", transcript)
             
             # Get AI response for voice input
             with st.chat_message("assistant"):
-                response = openai.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": m["role"], "content": m["content"]} for m in st.session_state.messages]
-                )
-                response_text = response.choices[0].message.content
-                st.write(response_text)
+                response_text, slot, hit = turn.call("chat", get_reply, voice_id, normalize_audio, reply_budget)
                 
                 # Convert response to speech
-                audio_data, audio_format = text_to_speech_with_speechify(response_text, voice_id)
+                audio_data, audio_format = turn.call("tts", speak_reply, response_text, slot, hit, voice_id, normalize_audio)
                 if audio_data:
-                    st.markdown(create_auto_play_audio(audio_data, audio_format), unsafe_allow_html=True)
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": response_text,
-                        "audio_data": audio_data,
-                        "audio_format": audio_format
-                    })
+                    audio_url, audio_mime = turn.call("deliver", deliver_audio, audio_data, audio_format)
+                    st.markdown(create_auto_play_audio(audio_url, audio_mime), unsafe_allow_html=True)
+                    add_message("assistant", response_text, audio_data, audio_format, audio_url, audio_mime)
                 else:
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": response_text
-                    })
+                    add_message("assistant", response_text)
         finally:
-            # Clean up temporary file
-            if os.path.exists(audio_file):
+            # Clean up temporary file if the turn stopped before the cleanup stage
+            if "cleanup" not in turn.stages and os.path.exists(audio_file):
                 os.unlink(audio_file)
+    st.session_state.last_turn = turn.report()
+    if turn_profile.paths:
+        st.session_state.last_profile = {"paths": turn_profile.paths, "top": turn_profile.top(5)}
 
 # Clear chat button
 if st.button("Clear Chat"):
     st.session_state.messages = []
-    st.experimental_rerun()
\ No newline at end of file
+    scope = semantic_cache.scope_for(st.session_state.conversation_id)
+    if scope is not None:
+        # Forget this conversation's cached answers (shared ones stay for other sessions)
+        answers.clear(scope)
+    st.session_state.conversation_id = uuid.uuid4().hex
+    st.rerun()
\ No newline at end of file
@@ -0,0 +1,252 @@
+import json
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zipfile
+
+DEFAULT_DIR = os.path.join("media", "archive")
+SEGMENT_BYTES = 64 * 1024 * 1024
+MIME_TYPES = {"wav": "audio/wav", "mp3": "audio/mpeg", "ogg": "audio/ogg", "m4a": "audio/mp4"}
+
+
+class AudioArchive:
+    """Append-only store for chat history audio, split into memory-mapped segment files.
+
+    Clips are appended to the current segment and located through an SQLite offset
+    index (segment, offset, length). Reads return memoryview slices of the mapped
+    segment, so replaying history pages in only the clips that are played instead of
+    holding whole conversations in memory. Deleted clips are reclaimed by compact().
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._maps = {}  # segment -> mmap
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS clips ("
+            "id INTEGER PRIMARY KEY, conversation TEXT, role TEXT, content TEXT, format TEXT, "
+            "segment INTEGER, offset INTEGER, length INTEGER, created REAL, deleted INTEGER DEFAULT 0)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS clips_conversation ON clips (conversation, id)")
+        row = self._db.execute("SELECT MAX(segment) FROM clips").fetchone()
+        self._segment = row[0] or 1
+        self._writer = None
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"seg-{segment:05d}.dat")
+
+    def _open_writer(self):
+        if self._writer is None:
+            self._writer = open(self._segment_path(self._segment), "ab")
+        if self._writer.tell() >= self.segment_bytes:
+            self._writer.close()
+            self._segment += 1
+            self._writer = open(self._segment_path(self._segment), "ab")
+        return self._writer
+
+    def append(self, conversation, role, content, audio=None, audio_format=None):
+        """Store one message (and its audio, if any), returns its clip id"""
+        with self._lock:
+            segment = offset = length = None
+            if audio:
+                writer = self._open_writer()
+                segment, offset, length = self._segment, writer.tell(), len(audio)
+                writer.write(audio)
+                writer.flush()
+            cursor = self._db.execute(
+                "INSERT INTO clips (conversation, role, content, format, segment, offset, length, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (conversation, role, content, audio_format, segment, offset, length, time.time()),
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def _map(self, segment, needed):
+        """mmap of a segment covering at least `needed` bytes (remapped if the segment has grown)"""
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < needed:
+            # Old maps are not closed here: memoryviews handed out by read() keep them alive until released
+            with open(self._segment_path(segment), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mapped, "madvise"):
+                # Replay jumps between clips; don't read ahead past the clip being played
+                mapped.madvise(mmap.MADV_RANDOM)
+            self._maps[segment] = mapped
+        return mapped
+
+    def read(self, clip_id):
+        """(memoryview of the audio bytes, format) for a clip, without copying"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT segment, offset, length, format FROM clips WHERE id = ? AND deleted = 0", (clip_id,)
+            ).fetchone()
+            if row is None or row[0] is None:
+                return None, None
+            segment, offset, length, audio_format = row
+            return memoryview(self._map(segment, offset + length))[offset:offset + length], audio_format
+
+    def messages(self, conversation):
+        """Messages of a conversation in order, with clip ids instead of audio"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, role, content, format, length FROM clips "
+                "WHERE conversation = ? AND deleted = 0 ORDER BY id", (conversation,)
+            ).fetchall()
+        return [{"role": role, "content": content, "clip_id": clip_id if length else None,
+                 "audio_mime": MIME_TYPES.get(audio_format, f"audio/{audio_format}") if length else None}
+                for clip_id, role, content, audio_format, length in rows]
+
+    def conversations(self, limit=50):
+        """Most recent conversations as (id, first user message, last activity)"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT conversation, "
+                "(SELECT content FROM clips c2 WHERE c2.conversation = c.conversation AND role = 'user' "
+                "AND deleted = 0 ORDER BY id LIMIT 1), MAX(created) "
+                "FROM clips c WHERE deleted = 0 GROUP BY conversation ORDER BY MAX(created) DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def delete_conversation(self, conversation):
+        """Hide a conversation; its audio is reclaimed by the next compact()"""
+        with self._lock:
+            self._db.execute("UPDATE clips SET deleted = 1 WHERE conversation = ?", (conversation,))
+            self._db.commit()
+
+    def export(self, conversation, path):
+        """Write one conversation as a zip of messages.json plus its audio files"""
+        messages = self.messages(conversation)
+        with zipfile.ZipFile(path, "w") as archive:
+            for i, message in enumerate(messages):
+                if message["clip_id"]:
+                    audio, audio_format = self.read(message["clip_id"])
+                    name = f"{i:04d}-{message['role']}.{audio_format}"
+                    archive.writestr(name, bytes(audio), compress_type=zipfile.ZIP_STORED)
+                    message["audio"] = name
+                message.pop("clip_id")
+            archive.writestr("messages.json", json.dumps(messages, indent=2))
+        return path
+
+    def _close_maps(self):
+        # Unmapped once the last outstanding memoryview is released
+        self._maps.clear()
+
+    def compact(self):
+        """Copy live clips into fresh segments and delete the old ones, returns bytes reclaimed"""
+        with self._lock:
+            before = self.disk_bytes()
+            rows = self._db.execute(
+                "SELECT id, segment, offset, length FROM clips WHERE deleted = 0 AND length IS NOT NULL ORDER BY id"
+            ).fetchall()
+            old_segments = [row[0] for row in self._db.execute(
+                "SELECT DISTINCT segment FROM clips WHERE segment IS NOT NULL")]
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            first_new = self._segment + 1
+            self._segment = first_new
+            updates = []
+            for clip_id, segment, offset, length in rows:
+                writer = self._open_writer()
+                updates.append((self._segment, writer.tell(), clip_id))
+                writer.write(self._map(segment, offset + length)[offset:offset + length])
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._db.executemany("UPDATE clips SET segment = ?, offset = ? WHERE id = ?", updates)
+            self._db.execute("DELETE FROM clips WHERE deleted = 1")
+            self._db.commit()
+            self._close_maps()
+            for segment in old_segments:
+                if segment < first_new and os.path.exists(self._segment_path(segment)):
+                    os.unlink(self._segment_path(segment))
+            return before - self.disk_bytes()
+
+    def disk_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.directory, name))
+                   for name in os.listdir(self.directory) if name.endswith(".dat"))
+
+    def close(self):
+        with self._lock:
+            self._close_maps()
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            self._db.close()
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Process-wide archive shared by all sessions"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = AudioArchive(os.getenv("AUDIO_ARCHIVE_DIR", DEFAULT_DIR))
+        return _archive
+
+
+def rss_mb():
+    """(anonymous, file-backed) resident memory in MB; mapped archive pages are file-backed and reclaimable"""
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                name, value, _ = line.split()
+                fields[name] = int(value) / 1024
+    return fields.get("RssAnon:", 0.0), fields.get("RssFile:", 0.0)
+
+
+# RSS and replay latency for thousands of archived clips vs keeping bytes in session state
+if __name__ == "__main__":
+    import argparse
+    import random
+    import tempfile
+
+    import fake_providers
+
+    parser = argparse.ArgumentParser(description="Benchmark the audio archive")
+    parser.add_argument("--clips", type=int, default=3000)
+    parser.add_argument("--seconds", type=float, default=3.0, help="Length of each fake reply clip")
+    args = parser.parse_args()
+
+    clip = fake_providers.tone_wav(args.seconds)
+    directory = tempfile.mkdtemp()
+    archive = AudioArchive(directory, segment_bytes=16 * 1024 * 1024)
+    base_anon, base_file = rss_mb()
+    start = time.perf_counter()
+    ids = [archive.append(f"conv-{i // 20}", "assistant", f"reply {i}", clip, "wav") for i in range(args.clips)]
+    append_ms = 1000 * (time.perf_counter() - start) / args.clips
+    print(f"{args.clips} clips, {archive.disk_bytes() / 1e6:.0f} MB on disk, append {append_ms:.2f} ms/clip")
+
+    latencies = []
+    for clip_id in random.sample(ids, min(2000, len(ids))):
+        start = time.perf_counter()
+        audio, _ = archive.read(clip_id)
+        bytes(audio[:44])  # touch the header like a player would
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"replay read: p50 {1e6 * latencies[len(latencies) // 2]:.0f} us, "
+          f"p99 {1e6 * latencies[int(len(latencies) * 0.99)]:.0f} us")
+    anon, file_backed = rss_mb()
+    print(f"archive RSS growth: {anon - base_anon:.1f} MB anonymous, {file_backed - base_file:.1f} MB mapped file pages")
+
+    before, _ = rss_mb()
+    in_memory = [bytes(bytearray(clip)) for _ in range(args.clips)]
+    print(f"same clips as bytes in session state: {rss_mb()[0] - before:.1f} MB anonymous RSS")
+    del in_memory
+
+    for i in range(0, args.clips // 20, 2):
+        archive.delete_conversation(f"conv-{i}")
+    start = time.perf_counter()
+    reclaimed = archive.compact()
+    print(f"compaction reclaimed {reclaimed / 1e6:.0f} MB in {time.perf_counter() - start:.2f}s")
+    export_path = archive.export("conv-1", os.path.join(directory, "conv-1.zip"))
+    print(f"exported conv-1 to {export_path} ({os.path.getsize(export_path) / 1e6:.1f} MB)")
@@ -0,0 +1,283 @@
+import hashlib
+import io
+import os
+import shutil
+import threading
+import time
+
+import soundfile as sf
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import audio_post
+import config
+
+# Delivery formats: file extension, ffmpeg container/codec, MIME type, bitrates (kbps) by network tier
+FORMATS = {
+    "opus": {"ext": "ogg", "container": "ogg", "codec": "libopus", "mime": "audio/ogg", "bitrates": (24, 32, 48)},
+    "mp3": {"ext": "mp3", "container": "mp3", "codec": "libmp3lame", "mime": "audio/mpeg", "bitrates": (48, 64, 96)},
+    "aac": {"ext": "m4a", "container": "ipod", "codec": "aac", "mime": "audio/mp4", "bitrates": (32, 48, 64)},
+    "wav": {"ext": "wav", "container": "wav", "codec": None, "mime": "audio/wav", "bitrates": (None, None, None)},
+}
+DEFAULT_FORMAT = "opus"
+# Opus only accepts a few sample rates; speech is fine at 24 kHz
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+HAVE_FFMPEG = shutil.which("ffmpeg") is not None
+# Seconds between scans of a clip directory for clips to delete
+PRUNE_INTERVAL = 60.0
+
+_stats_lock = threading.Lock()
+STATS = {
+    "transcodes": 0,
+    "cache_hits": 0,
+    "transcode_cpu_seconds": 0.0,
+    "source_bytes": 0,
+    "encoded_bytes": 0,
+    "turns": 0,
+    "bytes_sent": 0,
+    "clips_pruned": 0,
+}
+_last_prune = {}  # directory -> time.monotonic() of its last scan
+
+
+def network_tier(downlink=None, ect=None, save_data=False):
+    """Map Client Hints (Downlink in Mbps, ECT, Save-Data) to 0 (slow), 1 or 2 (fast)"""
+    if save_data or (ect or "").lower() in ("slow-2g", "2g"):
+        return 0
+    if downlink is not None:
+        try:
+            downlink = float(downlink)
+        except ValueError:
+            return 1
+        return 0 if downlink < 0.5 else 1 if downlink < 2.0 else 2
+    return 1 if (ect or "").lower() == "3g" else 2
+
+
+def choose_format(user_agent="", accept="", downlink=None, ect=None, save_data=False, preferred=None):
+    """Pick a (format, bitrate_kbps) the client can play at a bitrate suited to its network"""
+    user_agent = user_agent or ""
+    if preferred in FORMATS:
+        audio_format = preferred
+    elif "audio/ogg" in (accept or "") or "Chrome" in user_agent or "Firefox" in user_agent:
+        audio_format = "opus"
+    elif "Safari" in user_agent:
+        # Older Safari/iOS can't play Ogg Opus
+        audio_format = "aac" if HAVE_FFMPEG else "mp3"
+    else:
+        audio_format = "mp3"
+    if audio_format == "aac" and not HAVE_FFMPEG:
+        audio_format = "mp3"
+    if not HAVE_FFMPEG:
+        # The libsndfile fallback has no bitrate control
+        return audio_format, None
+    tier = network_tier(downlink, ect, save_data)
+    return audio_format, FORMATS[audio_format]["bitrates"][tier]
+
+
+def choose_format_from_headers(headers, preferred=None):
+    """choose_format() for a mapping of HTTP request headers"""
+    return choose_format(
+        user_agent=headers.get("User-Agent", ""),
+        accept=headers.get("Accept", ""),
+        downlink=headers.get("Downlink"),
+        ect=headers.get("ECT"),
+        save_data=headers.get("Save-Data", "").lower() == "on",
+        preferred=preferred,
+    )
+
+
+def _child_cpu():
+    # ffmpeg runs in a child process; this is process-wide, so a transcode finishing on
+    # another thread in the same window is counted too. Not available on Windows, where
+    # only the in-process CPU is counted
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def transcode(audio, audio_format, target_format, bitrate=None):
+    """Transcode audio bytes to target_format at bitrate kbps, returns encoded bytes"""
+    spec = FORMATS[target_format]
+    # This thread's CPU only: process_time() would add every other busy thread
+    start_cpu = time.thread_time() + _child_cpu()
+    if HAVE_FFMPEG and spec["codec"]:
+        from pydub import AudioSegment
+        segment = AudioSegment.from_file(io.BytesIO(audio), format=audio_format)
+        if target_format == "opus" and segment.frame_rate not in OPUS_SAMPLE_RATES:
+            segment = segment.set_frame_rate(24000)
+        output = io.BytesIO()
+        segment.export(
+            output,
+            format=spec["container"],
+            codec=spec["codec"],
+            bitrate=f"{bitrate}k" if bitrate else None,
+        )
+        encoded = output.getvalue()
+    else:
+        # Without ffmpeg, libsndfile can still write Opus and MP3 (at its default quality)
+        samples, sample_rate = audio_post.decode_audio(audio, audio_format)
+        if target_format == "opus" and sample_rate not in OPUS_SAMPLE_RATES:
+            samples, sample_rate = audio_post.resample(samples, sample_rate, 24000), 24000
+        subtype = {"opus": "OPUS", "mp3": "MPEG_LAYER_III", "wav": "PCM_16"}.get(target_format)
+        if subtype is None:
+            raise RuntimeError(f"Encoding to {target_format} requires ffmpeg")
+        container = {"opus": "OGG", "mp3": "MP3", "wav": "WAV"}[target_format]
+        output = io.BytesIO()
+        sf.write(output, samples, sample_rate, format=container, subtype=subtype)
+        encoded = output.getvalue()
+    with _stats_lock:
+        STATS["transcodes"] += 1
+        STATS["transcode_cpu_seconds"] += time.thread_time() + _child_cpu() - start_cpu
+        STATS["source_bytes"] += len(audio)
+        STATS["encoded_bytes"] += len(encoded)
+    return encoded
+
+
+def encoded_path(source_path, target_format, bitrate=None):
+    """Cache location next to the source, e.g. reply.wav -> reply.32k.ogg"""
+    base, _ = os.path.splitext(source_path)
+    label = f"{bitrate}k" if bitrate else "default"
+    return f"{base}.{label}.{FORMATS[target_format]['ext']}"
+
+
+def encode_cached(source_path, target_format=DEFAULT_FORMAT, bitrate=None):
+    """Transcode a stored clip once and reuse the encoded file on later requests"""
+    if target_format == "wav" and source_path.endswith(".wav"):
+        return source_path
+    if not HAVE_FFMPEG:
+        bitrate = None
+    path = encoded_path(source_path, target_format, bitrate)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source_path):
+        with _stats_lock:
+            STATS["cache_hits"] += 1
+        return path
+    with open(source_path, "rb") as f:
+        audio = f.read()
+    encoded = transcode(audio, os.path.splitext(source_path)[1].lstrip("."), target_format, bitrate)
+    # Write to a temp name first so concurrent readers never see a partial file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(encoded)
+    os.replace(temp_path, path)
+    return path
+
+
+def store_clip(audio, audio_format, directory, ttl=None, max_mb=None):
+    """Save a TTS clip under a content-addressed name, returns its path.
+
+    Every PRUNE_INTERVAL the directory is pruned to ttl seconds and max_mb (default:
+    audio_store_ttl and audio_store_max_mb from config.py).
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256(audio).hexdigest()[:16]
+    path = os.path.join(directory, f"{digest}.{audio_format}")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(audio)
+    now = time.monotonic()
+    with _stats_lock:
+        due = now - _last_prune.get(directory, -PRUNE_INTERVAL) >= PRUNE_INTERVAL
+        if due:
+            _last_prune[directory] = now
+    if due:
+        settings = config.get_settings()
+        prune_clips(directory, settings.audio_store_ttl if ttl is None else ttl,
+                    settings.audio_store_max_mb if max_mb is None else max_mb, keep=path)
+    return path
+
+
+def prune_clips(directory, ttl, max_mb, keep=None):
+    """Delete clips and encodings older than ttl seconds, then the oldest until the directory
+    holds at most max_mb; returns the number of files deleted"""
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            # Skip files still being written by encode_cached
+            if entry.is_file() and not entry.name.endswith(".tmp") and entry.path != keep:
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+    total = sum(size for _, size, _ in files)
+    if keep is not None and os.path.exists(keep):
+        total += os.path.getsize(keep)
+    oldest_kept = time.time() - ttl
+    removed = 0
+    for mtime, size, path in files:
+        if mtime >= oldest_kept and total <= max_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass  # Another worker deleted it first
+        total -= size
+    with _stats_lock:
+        STATS["clips_pruned"] += removed
+    return removed
+
+
+def touch_clip(path):
+    """Mark a stored clip as just used so prune_clips deletes it last; False if it is already gone"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def record_turn(bytes_sent):
+    """Account the audio bytes delivered for one chat turn"""
+    with _stats_lock:
+        STATS["turns"] += 1
+        STATS["bytes_sent"] += bytes_sent
+
+
+def stats():
+    with _stats_lock:
+        snapshot = dict(STATS)
+    snapshot["avg_bytes_per_turn"] = snapshot["bytes_sent"] / snapshot["turns"] if snapshot["turns"] else 0
+    snapshot["compression_ratio"] = (
+        snapshot["source_bytes"] / snapshot["encoded_bytes"] if snapshot["encoded_bytes"] else 0
+    )
+    snapshot["cpu_ms_per_transcode"] = (
+        1000 * snapshot["transcode_cpu_seconds"] / snapshot["transcodes"] if snapshot["transcodes"] else 0
+    )
+    return snapshot
+
+
+# Measure bytes per turn and transcode CPU cost for each delivery format
+if __name__ == "__main__":
+    import base64
+    import json
+    import tempfile
+
+    with open("wavoutput") as f:
+        sample = json.load(f)
+    wav_bytes = base64.b64decode(sample["audio_data"])
+    inline_bytes = len(base64.b64encode(wav_bytes))
+    print(f"ffmpeg available: {HAVE_FFMPEG}")
+    print(f"{'inline base64 WAV':24s} {inline_bytes:8d} bytes")
+
+    directory = tempfile.mkdtemp()
+    source = store_clip(wav_bytes, "wav", directory)
+    for target_format in ("opus", "mp3", "aac"):
+        bitrates = sorted(set(FORMATS[target_format]["bitrates"])) if HAVE_FFMPEG else [None]
+        for bitrate in bitrates:
+            label = f"{bitrate}k" if bitrate else "default"
+            before = stats()["transcode_cpu_seconds"]
+            try:
+                path = encode_cached(source, target_format, bitrate)
+            except RuntimeError as e:
+                print(f"{target_format:5s} {label:8s} skipped: {e}")
+                continue
+            cpu_ms = 1000 * (stats()["transcode_cpu_seconds"] - before)
+            size = os.path.getsize(path)
+            print(f"{target_format:5s} {label:8s} {size:8d} bytes  "
+                  f"{100 * size / inline_bytes:5.1f}% of inline  {cpu_ms:6.1f} ms CPU")
+            encode_cached(source, target_format, bitrate)
+    print(stats())
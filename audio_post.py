@@ -0,0 +1,257 @@
+import io
+import time
+from math import gcd
+
+import numpy as np
+import soundfile as sf
+from scipy import signal
+
+# Defaults for TTS clips played in the browser
+TARGET_SAMPLE_RATE = 24000
+TARGET_LUFS = -16.0
+PEAK_CEILING_DB = -1.0
+SILENCE_THRESHOLD_DB = -45.0
+
+
+def decode_audio(audio, audio_format=None):
+    """Decode audio bytes or a file path once into (float32 samples [frames, channels], sample_rate)"""
+    source = io.BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio
+    try:
+        samples, sample_rate = sf.read(source, dtype="float32", always_2d=True)
+    except (sf.LibsndfileError, RuntimeError):
+        # Fall back to ffmpeg through pydub for formats libsndfile can't read (e.g. AAC)
+        from pydub import AudioSegment
+        if hasattr(source, "seek"):
+            source.seek(0)
+        segment = AudioSegment.from_file(source, format=audio_format)
+        raw = np.array(segment.get_array_of_samples(), dtype=np.float32)
+        samples = raw.reshape(-1, segment.channels) / float(1 << (8 * segment.sample_width - 1))
+        sample_rate = segment.frame_rate
+    return samples, sample_rate
+
+
+def encode_wav(samples, sample_rate, subtype="PCM_16"):
+    """Encode float32 samples as WAV bytes"""
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="WAV", subtype=subtype)
+    return buffer.getvalue()
+
+
+def to_mono(samples):
+    return samples.mean(axis=1, keepdims=True, dtype=np.float32) if samples.shape[1] > 1 else samples
+
+
+def db_to_gain(db):
+    return np.float32(10.0 ** (db / 20.0))
+
+
+def k_weighting_sos(sample_rate):
+    """ITU-R BS.1770 K-weighting (high shelf + high pass) as second-order sections"""
+    # Stage 1: +4 dB high shelf at 1500 Hz
+    A = 10 ** (4.0 / 40)
+    w0 = 2 * np.pi * 1500.0 / sample_rate
+    alpha = np.sin(w0) / (2 * (1 / np.sqrt(2)))
+    cos_w0 = np.cos(w0)
+    shelf_b = [
+        A * ((A + 1) + (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha),
+        -2 * A * ((A - 1) + (A + 1) * cos_w0),
+        A * ((A + 1) + (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha),
+    ]
+    shelf_a = [
+        (A + 1) - (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha,
+        2 * ((A - 1) - (A + 1) * cos_w0),
+        (A + 1) - (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha,
+    ]
+    # Stage 2: high pass at 38 Hz
+    w0 = 2 * np.pi * 38.0 / sample_rate
+    alpha = np.sin(w0) / (2 * 0.5)
+    cos_w0 = np.cos(w0)
+    hp_b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    hp_a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    return np.vstack([
+        np.concatenate([np.divide(shelf_b, shelf_a[0]), np.divide(shelf_a, shelf_a[0])]),
+        np.concatenate([np.divide(hp_b, hp_a[0]), np.divide(hp_a, hp_a[0])]),
+    ])
+
+
+def block_mean_square(samples, block, step):
+    """Mean square per channel for overlapping blocks, via one cumulative sum"""
+    frames = samples.shape[0]
+    if frames < block:
+        return np.mean(np.square(samples, dtype=np.float64), axis=0, keepdims=True)
+    cumulative = np.zeros((frames + 1, samples.shape[1]), dtype=np.float64)
+    np.cumsum(np.square(samples, dtype=np.float64), axis=0, out=cumulative[1:])
+    starts = np.arange(0, frames - block + 1, step)
+    return (cumulative[starts + block] - cumulative[starts]) / block
+
+
+def integrated_loudness(samples, sample_rate):
+    """Gated integrated loudness in LUFS (BS.1770-4); -inf for an empty or silent clip"""
+    if samples.shape[0] == 0:
+        return -np.inf
+    weighted = signal.sosfilt(k_weighting_sos(sample_rate), samples, axis=0).astype(np.float32)
+    # A clip shorter than one 400 ms block is measured as a single block
+    block = max(1, int(0.4 * sample_rate))
+    power = block_mean_square(weighted, block, block // 4).sum(axis=1)
+    loudness = -0.691 + 10 * np.log10(np.maximum(power, 1e-12))
+    gated = power[loudness > -70.0]
+    if gated.size == 0:
+        return -np.inf
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = power[(loudness > -70.0) & (loudness > relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean())) if gated.size else -np.inf
+
+
+def normalize_loudness(samples, sample_rate, target_lufs=TARGET_LUFS, peak_db=PEAK_CEILING_DB):
+    """Apply one gain so the clip hits target_lufs without peaks above peak_db"""
+    loudness = integrated_loudness(samples, sample_rate)
+    if not np.isfinite(loudness):
+        return samples
+    gain = db_to_gain(target_lufs - loudness)
+    peak = float(np.max(np.abs(samples))) if samples.size else 0.0
+    if peak * gain > db_to_gain(peak_db):
+        gain = db_to_gain(peak_db) / np.float32(peak)
+    return samples * np.float32(gain)
+
+
+def normalize_rms(samples, target_db=-20.0, peak_db=PEAK_CEILING_DB):
+    """Cheaper alternative to LUFS: match the RMS level to target_db dBFS"""
+    rms = float(np.sqrt(np.mean(np.square(samples, dtype=np.float64)))) if samples.size else 0.0
+    if rms == 0.0:
+        return samples
+    gain = db_to_gain(target_db) / rms
+    peak = float(np.max(np.abs(samples)))
+    gain = min(gain, db_to_gain(peak_db) / peak)
+    return samples * np.float32(gain)
+
+
+def trim_silence(samples, sample_rate, threshold_db=SILENCE_THRESHOLD_DB, frame_ms=10, pad_ms=50):
+    """Cut leading and trailing frames quieter than threshold_db (relative to full scale).
+
+    A clip with no frame above the threshold is returned unchanged rather than emptied.
+    """
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    frames = samples.shape[0] // frame
+    if frames == 0:
+        return samples
+    energy = np.square(to_mono(samples)[:frames * frame, 0]).reshape(frames, frame).mean(axis=1)
+    voiced = np.flatnonzero(energy > 10.0 ** (threshold_db / 10.0))
+    if voiced.size == 0:
+        return samples
+    pad = int(sample_rate * pad_ms / 1000)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(samples.shape[0], (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def resample(samples, sample_rate, target_rate=TARGET_SAMPLE_RATE):
+    """Polyphase resampling to target_rate"""
+    if sample_rate == target_rate:
+        return samples
+    divisor = gcd(int(sample_rate), int(target_rate))
+    up, down = int(target_rate) // divisor, int(sample_rate) // divisor
+    return signal.resample_poly(samples, up, down, axis=0).astype(np.float32)
+
+
+def crossfade_concat(chunks, sample_rate, fade_ms=30):
+    """Join sentence chunks with equal-power crossfades of fade_ms"""
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    if not chunks:
+        return np.zeros((0, 1), dtype=np.float32)
+    fade = int(sample_rate * fade_ms / 1000)
+    channels = chunks[0].shape[1]
+    total = sum(len(chunk) for chunk in chunks)
+    overlaps = [0] + [min(fade, len(a), len(b)) for a, b in zip(chunks, chunks[1:])]
+    total -= sum(overlaps)
+    output = np.empty((total, channels), dtype=np.float32)
+    ramps = {}
+
+    position = 0
+    for chunk, overlap in zip(chunks, overlaps):
+        if overlap:
+            if overlap not in ramps:
+                t = np.linspace(0.0, np.pi / 2, overlap, dtype=np.float32)[:, None]
+                ramps[overlap] = (np.cos(t), np.sin(t))
+            fade_out, fade_in = ramps[overlap]
+            position -= overlap
+            region = output[position:position + overlap]
+            region *= fade_out
+            region += chunk[:overlap] * fade_in
+        output[position + overlap:position + len(chunk)] = chunk[overlap:]
+        position += len(chunk)
+    return output
+
+
+def process_clip(audio, audio_format=None, target_rate=TARGET_SAMPLE_RATE, target_lufs=TARGET_LUFS,
+                 use_rms=False, trim=True, mono=True):
+    """Decode once, then trim, resample and normalize; returns (float32 samples, sample_rate)"""
+    samples, sample_rate = decode_audio(audio, audio_format)
+    if mono:
+        samples = to_mono(samples)
+    if trim:
+        samples = trim_silence(samples, sample_rate)
+    if target_rate:
+        samples = resample(samples, sample_rate, target_rate)
+        sample_rate = target_rate
+    if use_rms:
+        samples = normalize_rms(samples)
+    else:
+        samples = normalize_loudness(samples, sample_rate, target_lufs)
+    return samples, sample_rate
+
+
+def process_to_wav(audio, audio_format=None, **kwargs):
+    """Post-process provider audio and return (wav_bytes, "wav")"""
+    samples, sample_rate = process_clip(audio, audio_format, **kwargs)
+    return encode_wav(samples, sample_rate), "wav"
+
+
+def join_clips(clips, target_rate=TARGET_SAMPLE_RATE, fade_ms=30, postprocess=True, **kwargs):
+    """Crossfade several (audio, format) clips into one WAV.
+
+    With postprocess=True each clip goes through process_clip first. Otherwise clips
+    are only decoded and brought to the first clip's sample rate, keeping the
+    provider's levels. The result is WAV either way: compressed clips can't be joined
+    without decoding them.
+    """
+    if postprocess:
+        processed = [process_clip(audio, audio_format, target_rate=target_rate, **kwargs)[0]
+                     for audio, audio_format in clips]
+    else:
+        decoded = [decode_audio(audio, audio_format) for audio, audio_format in clips]
+        target_rate = decoded[0][1] if decoded else target_rate
+        processed = [resample(to_mono(samples), sample_rate, target_rate) for samples, sample_rate in decoded]
+    return encode_wav(crossfade_concat(processed, target_rate, fade_ms), target_rate), "wav"
+
+
+# Benchmark: audio-seconds processed per CPU-second
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    sample_rate = 48000  # Speechify WAV rate
+    seconds = 60
+    t = np.arange(seconds * sample_rate, dtype=np.float32) / sample_rate
+    speech = (0.2 * np.sin(2 * np.pi * 180 * t) * (np.sin(2 * np.pi * 3 * t) > 0)).astype(np.float32)
+    speech += 0.01 * rng.standard_normal(speech.shape).astype(np.float32)
+    padded = np.concatenate([np.zeros(sample_rate, np.float32), speech, np.zeros(sample_rate, np.float32)])
+    wav_bytes = encode_wav(padded[:, None], sample_rate)
+
+    stages = {
+        "decode": lambda: decode_audio(wav_bytes),
+        "loudness": lambda: normalize_loudness(padded[:, None], sample_rate),
+        "rms": lambda: normalize_rms(padded[:, None]),
+        "trim": lambda: trim_silence(padded[:, None], sample_rate),
+        "resample 48k->24k": lambda: resample(padded[:, None], sample_rate, 24000),
+        "crossfade x20": lambda: crossfade_concat(np.array_split(padded[:, None], 20), sample_rate),
+        "full pipeline": lambda: process_to_wav(wav_bytes),
+    }
+    audio_seconds = len(padded) / sample_rate
+    for name, stage in stages.items():
+        runs = 5
+        start = time.process_time()
+        for _ in range(runs):
+            stage()
+        cpu = (time.process_time() - start) / runs
+        print(f"{name:20s} {audio_seconds / max(cpu, 1e-9):10.0f} audio-s per CPU-s")
+
+    samples, rate = process_clip(wav_bytes)
+    print(f"result: {rate} Hz, {len(samples) / rate:.2f}s, {integrated_loudness(samples, rate):.1f} LUFS")
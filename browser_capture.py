@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import time
+
+import numpy as np
+import soundfile as sf
+
+import mic_capture
+
+PCM_SAMPLE_RATE = 16000
+CHUNK_MS = 100
+# File suffix handed to transcription for each chunk format a client can stream
+FORMATS = {"wav": ".wav", "pcm16": ".wav", "ogg": ".ogg", "webm": ".webm"}
+
+# Streamlit component (plain HTML/JS, no build step) that records in the browser
+COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "browser_recorder")
+
+
+class CaptureStream:
+    """One utterance arriving from a client in chunks while the user speaks.
+
+    Compressed chunks (MediaRecorder's Ogg/WebM Opus, or a file sent in pieces) are
+    only collected: their concatenation is a valid file. Raw 16-bit PCM chunks also
+    go through mic_capture's energy VAD as they arrive, so the server can end the
+    utterance itself once the speaker stops instead of waiting for the client.
+    """
+
+    def __init__(self, fmt="wav", sample_rate=PCM_SAMPLE_RATE, channels=1, endpointing=True):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported capture format: {fmt}")
+        self.fmt = fmt
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.endpointing = endpointing and fmt == "pcm16"
+        self.chunks = []
+        self.size = 0
+        self.frames = 0
+        self.ended = False
+        self.last_chunk = None
+        self._pending = b""
+        self._speech_frames = 0
+        self._silent_frames = 0
+
+    @classmethod
+    def from_control(cls, control):
+        """From a {"type": "start", "format": ..., "sample_rate": ..., "channels": ...} message"""
+        return cls(control.get("format", "wav"), int(control.get("sample_rate", PCM_SAMPLE_RATE)),
+                   int(control.get("channels", 1)), bool(control.get("endpointing", True)))
+
+    def add(self, chunk):
+        """Append a chunk; returns True when endpointing has just detected the end of speech"""
+        if self.ended:
+            # Audio the client sent before it heard about the endpoint
+            return False
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.last_chunk = time.perf_counter()
+        if self.fmt != "pcm16":
+            return False
+        # Chunks need not end on a frame boundary; carry the remainder to the next one
+        data = self._pending + chunk
+        usable = len(data) - len(data) % (2 * self.channels)
+        self._pending = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype="<i2").reshape(-1, self.channels)
+        self.frames += len(samples)
+        if not self.endpointing or len(samples) == 0:
+            return False
+        if mic_capture.rms_db([samples.astype(np.float32) / 32768.0]) > mic_capture.SILENCE_DB:
+            self._speech_frames += len(samples)
+            self._silent_frames = 0
+        else:
+            self._silent_frames += len(samples)
+        if (self._speech_frames >= mic_capture.MIN_SPEECH_MS * self.sample_rate / 1000
+                and self._silent_frames >= mic_capture.SILENCE_MS * self.sample_rate / 1000):
+            self.ended = True
+        return self.ended
+
+    @property
+    def seconds(self):
+        """Duration of the audio received so far (PCM only; None for compressed streams)"""
+        return self.frames / self.sample_rate if self.fmt == "pcm16" else None
+
+    def audio(self):
+        """(bytes, suffix) of the whole utterance, ready for transcription"""
+        data = b"".join(self.chunks)
+        if self.fmt != "pcm16":
+            return data, FORMATS[self.fmt]
+        usable = len(data) - len(data) % (2 * self.channels)
+        samples = np.frombuffer(data[:usable], dtype="<i2").reshape(-1, self.channels)
+        buffer = io.BytesIO()
+        sf.write(buffer, samples, self.sample_rate, format="WAV", subtype="PCM_16")
+        return buffer.getvalue(), ".wav"
+
+
+_component = None
+
+
+def recorder(server_url, fmt="pcm16", max_seconds=10, key=None):
+    """Record in the browser and stream to the voice server's /ws/transcribe while the user speaks.
+
+    Returns {"id", "text", "audio_seconds", "latency_seconds"} for the latest utterance
+    (the same value again on later reruns, so compare "id"), or None before the first.
+    """
+    global _component
+    if _component is None:
+        # Only the Streamlit app needs this; server.py imports the module without Streamlit
+        import streamlit.components.v1 as components
+        _component = components.declare_component("browser_recorder", path=COMPONENT_DIR)
+    return _component(server_url=server_url, format=fmt, max_seconds=max_seconds, key=key, default=None)
+
+
+def utterance_chunks(samples, sample_rate, fmt, chunk_ms=CHUNK_MS):
+    """Split an utterance the way the recorder sends it: (chunks, seconds of audio per chunk)"""
+    if fmt == "pcm16":
+        pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+        step = 2 * int(sample_rate * chunk_ms / 1000)
+        return [pcm[i:i + step] for i in range(0, len(pcm), step)], chunk_ms / 1000
+    buffer = io.BytesIO()
+    if fmt == "ogg":
+        sf.write(buffer, samples, sample_rate, format="OGG", subtype="OPUS")
+    else:
+        sf.write(buffer, samples, sample_rate, format="WAV", subtype="PCM_16")
+    data = buffer.getvalue()
+    count = max(1, int(len(samples) / sample_rate * 1000 / chunk_ms))
+    step = -(-len(data) // count)
+    return [data[i:i + step] for i in range(0, len(data), step)], len(samples) / sample_rate / count
+
+
+async def fake_client(url, samples, sample_rate=PCM_SAMPLE_RATE, fmt="pcm16", chunk_ms=CHUNK_MS,
+                      uplink_kbps=1000.0, blob=False):
+    """Scripted browser: speaks an utterance into the transcription socket in real time.
+
+    Chunks are sent as they would be recorded, throttled to uplink_kbps. With blob=True
+    the whole recording is sent in one message after it ends, like the old upload.
+    Returns timings measured from the end of the recording.
+    """
+    import aiohttp
+
+    chunks, chunk_seconds = utterance_chunks(samples, sample_rate, fmt, chunk_ms)
+    if blob:
+        chunks = [b"".join(chunks)]
+    endpoint = asyncio.Event()
+    async with aiohttp.ClientSession() as session, session.ws_connect(url) as ws:
+        await ws.send_json({"type": "start", "format": fmt, "sample_rate": sample_rate})
+
+        async def receive():
+            async for msg in ws:
+                message = json.loads(msg.data)
+                if message["type"] == "endpoint":
+                    endpoint.set()
+                elif message["type"] in ("transcript", "error"):
+                    return message
+
+        reply = asyncio.create_task(receive())
+        start = time.perf_counter()
+        recorded = 0.0
+        sent = 0
+        for i, chunk in enumerate(chunks):
+            # A chunk exists only once its audio has been recorded
+            ready = len(samples) / sample_rate if blob else (i + 1) * chunk_seconds
+            await asyncio.sleep(max(0.0, start + ready - time.perf_counter()))
+            if endpoint.is_set():
+                break
+            # The chunk reaches the server only after it has crossed the uplink
+            await asyncio.sleep(len(chunk) * 8 / (uplink_kbps * 1000))
+            await ws.send_bytes(chunk)
+            sent += len(chunk)
+            recorded = ready
+        recording_ended = start + recorded
+        if not endpoint.is_set():
+            await ws.send_json({"type": "end"})
+        message = await reply
+        done = time.perf_counter()
+        await ws.send_json({"type": "close"})
+    return {
+        "text": message.get("text", message.get("message")),
+        "bytes": sent,
+        "recorded_seconds": round(recorded, 2),
+        "transcript_after_seconds": round(done - recording_ended, 3),
+        "endpointed": endpoint.is_set(),
+    }
+
+
+def speech_like(seconds=2.0, silence=1.5, sample_rate=PCM_SAMPLE_RATE, seed=0):
+    """Modulated noise followed by silence, like mic_capture's benchmark input"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int((seconds + silence) * sample_rate)) / sample_rate
+    return (0.2 * rng.standard_normal(len(t)) * (np.sin(2 * np.pi * 3 * t) > 0) * (t < seconds)).astype(np.float32)
+
+
+# Drive a running voice server (python server.py --fake) with scripted browser clients
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream utterances to /ws/transcribe like the browser recorder")
+    parser.add_argument("--url", default="ws://localhost:8080/ws/transcribe")
+    parser.add_argument("--file", help="Utterance to send (default: 2 s of speech-like noise, then silence)")
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent clients")
+    parser.add_argument("--uplink-kbps", type=float, default=1000.0, help="Client upload bandwidth")
+    args = parser.parse_args()
+
+    if args.file:
+        samples, sample_rate = sf.read(args.file, dtype="float32", always_2d=True)
+        import audio_post
+        samples = audio_post.resample(samples.mean(axis=1, keepdims=True), sample_rate, PCM_SAMPLE_RATE)[:, 0]
+    else:
+        samples = speech_like()
+
+    def utterance(seed):
+        # Different audio per client, mode and run, so the server's transcription cache can't answer
+        if args.file:
+            return samples + 1e-3 * np.random.default_rng(seed).standard_normal(len(samples)).astype(np.float32)
+        return speech_like(seed=seed)
+
+    run_seed = int(time.time())
+
+    async def run(fmt, blob, mode):
+        return await asyncio.gather(*[
+            fake_client(args.url, utterance(run_seed + 1000 * mode + i), PCM_SAMPLE_RATE, fmt,
+                        uplink_kbps=args.uplink_kbps, blob=blob)
+            for i in range(args.sessions)
+        ])
+
+    print(f"{len(samples) / PCM_SAMPLE_RATE:.1f}s utterance, {args.sessions} session(s), "
+          f"{args.uplink_kbps:.0f} kbps uplink")
+    # recorded_s: until the recording ended (client stop, or server endpoint for PCM);
+    # after_s: from then until the transcript arrived; total_s: from the first word
+    print(f"{'mode':<18s} {'KB sent':>8s} {'recorded_s':>10s} {'after_s':>8s} {'total_s':>8s} {'endpointed':>10s}")
+    modes = (("wav, one upload", "wav", True), ("pcm16 stream", "pcm16", False), ("ogg/opus stream", "ogg", False))
+    for mode, (label, fmt, blob) in enumerate(modes, 1):
+        results = asyncio.run(run(fmt, blob, mode))
+        recorded = np.mean([r["recorded_seconds"] for r in results])
+        after = np.mean([r["transcript_after_seconds"] for r in results])
+        print(f"{label:<18s} {np.mean([r['bytes'] for r in results]) / 1024:8.1f} {recorded:10.2f} "
+              f"{after:8.3f} {recorded + after:8.2f} {str(all(r['endpointed'] for r in results)):>10s}")
+    print(f"last transcript: {results[-1]['text']}")
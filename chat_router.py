@@ -0,0 +1,361 @@
+import abc
+import logging
+import threading
+import time
+
+import openai
+
+import config
+import fake_providers
+import model_registry
+import rate_limit
+
+# Tokens the reply needs before the first sentence can go to TTS
+FIRST_SENTENCE_TOKENS = 24
+# Never cut a spoken reply below this many tokens to meet a budget
+MIN_MAX_TOKENS = 48
+# Weight of the newest observation in the latency averages
+EWMA_ALPHA = 0.3
+# A backend that fails is skipped for this long
+FAILURE_COOLDOWN = 30.0
+# Each time a backend is passed over, its estimate drifts this much back toward the prior,
+# so a backend that was slow for a while gets tried again
+RECOVERY_RATE = 0.05
+
+# Starting estimates per backend kind, replaced by observed latency after the first calls:
+# fixed overhead per request (s), prompt tokens/s, generated tokens/s, context window
+PRIORS = {
+    "openai": {"overhead": 0.5, "prefill_tps": 4000.0, "generate_tps": 60.0, "context_tokens": 16385},
+    "groq": {"overhead": 0.25, "prefill_tps": 20000.0, "generate_tps": 400.0, "context_tokens": 8192},
+    "local": {"overhead": 0.05, "prefill_tps": 400.0, "generate_tps": 15.0, "context_tokens": 4096},
+    "fake": {"overhead": 0.05, "prefill_tps": 100000.0, "generate_tps": 200.0, "context_tokens": 16385},
+}
+
+
+def estimate_tokens(messages):
+    """Rough prompt size: about four characters per token plus per-message framing"""
+    return sum(len(m["content"]) // 4 + 4 for m in messages)
+
+
+def _chat_messages(messages):
+    return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+
+class Backend(abc.ABC):
+    """One chat model. Subclasses implement stream(); available() says whether it can be used now."""
+
+    kind = "fake"
+
+    def __init__(self, name, model, overhead=None, prefill_tps=None, generate_tps=None, context_tokens=None):
+        prior = PRIORS[self.kind]
+        self.name = name
+        self.model = model
+        self.overhead = prior["overhead"] if overhead is None else overhead
+        self.prefill_tps = prefill_tps or prior["prefill_tps"]
+        self.generate_tps = generate_tps or prior["generate_tps"]
+        self.context_tokens = context_tokens or prior["context_tokens"]
+
+    def available(self):
+        return True
+
+    @abc.abstractmethod
+    def stream(self, messages, max_tokens, model=None):
+        """Yield the reply's text chunks as they are generated"""
+
+
+class OpenAIBackend(Backend):
+    kind = "openai"
+
+    def available(self):
+        return bool(openai.api_key or config.get_settings().provider("openai").api_key)
+
+    def stream(self, messages, max_tokens, model=None):
+        stream = rate_limit.call(
+            "openai", openai.api_key, openai.chat.completions.create,
+            model=model or self.model,
+            messages=_chat_messages(messages),
+            max_tokens=max_tokens,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class GroqBackend(Backend):
+    """Groq through langchain-groq; unavailable without the package or GROQ_API_KEY."""
+
+    kind = "groq"
+
+    def __init__(self, name, model, **kwargs):
+        super().__init__(name, model, **kwargs)
+        self.provider = config.get_settings().provider("groq")
+        self._clients = {}
+
+    def available(self):
+        if not self.provider.api_key:
+            return False
+        try:
+            import langchain_groq  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _client(self, model, max_tokens):
+        key = (model, max_tokens)
+        if key not in self._clients:
+            from langchain_groq import ChatGroq
+            self._clients[key] = ChatGroq(model=model, api_key=self.provider.api_key,
+                                          max_tokens=max_tokens, timeout=self.provider.timeout)
+        return self._clients[key]
+
+    def stream(self, messages, max_tokens, model=None):
+        rate_limit.acquire("groq", self.provider.api_key)
+        for chunk in self._client(model or self.model, max_tokens).stream(_chat_messages(messages)):
+            if chunk.content:
+                yield chunk.content
+
+
+class LocalBackend(Backend):
+    """A small transformers model on this machine, loaded in the background on first use.
+
+    It only becomes available once the weights are loaded, so a cold start never
+    lands inside a turn's budget.
+    """
+
+    kind = "local"
+
+    def __init__(self, name, model, **kwargs):
+        super().__init__(name, model, **kwargs)
+        self.tokenizer = None
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def available(self):
+        if self.tokenizer is not None:
+            return True
+        with self._lock:
+            if not self._loading:
+                self._loading = True
+                threading.Thread(target=self._load, name="local-chat-load", daemon=True).start()
+        return False
+
+    def _load(self):
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(self.model)
+            self._llm()
+            self.tokenizer = tokenizer
+            logging.info(f"Local chat model {self.model} loaded")
+        except Exception as e:
+            logging.error(f"Could not load local chat model {self.model}: {str(e)}")
+
+    def _llm(self):
+        # Fetched per turn: the registry may have evicted an idle model, and reloading maps the cached weights
+        from transformers import AutoModelForCausalLM
+        return model_registry.pretrained(self.model, AutoModelForCausalLM)
+
+    def stream(self, messages, max_tokens, model=None):
+        from transformers import TextIteratorStreamer
+        inputs = self.tokenizer.apply_chat_template(_chat_messages(messages), add_generation_prompt=True,
+                                                    return_tensors="pt")
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        thread = threading.Thread(target=self._llm().generate, daemon=True,
+                                  kwargs={"input_ids": inputs, "max_new_tokens": max_tokens, "streamer": streamer})
+        thread.start()
+        for text in streamer:
+            if text:
+                yield text
+        thread.join()
+
+
+class FakeBackend(Backend):
+    """fake_providers stand-in used with VOICE_PROVIDERS=fake."""
+
+    def stream(self, messages, max_tokens, model=None):
+        yield from fake_providers.chat_reply_stream(messages, model or self.model)
+
+
+class BackendStats:
+    def __init__(self, backend):
+        self.prior_overhead = backend.overhead
+        self.overhead = backend.overhead
+        self.generate_tps = backend.generate_tps
+        self.calls = 0
+        self.failures = 0
+        self.failed_at = None
+
+    def update(self, first_token_seconds, prompt_tokens, prefill_tps, tokens, generate_seconds):
+        # Split time-to-first-token into the fixed part and the part explained by prompt size
+        overhead = max(0.0, first_token_seconds - prompt_tokens / prefill_tps)
+        self.overhead += EWMA_ALPHA * (overhead - self.overhead)
+        if tokens >= 8 and generate_seconds > 0:
+            self.generate_tps += EWMA_ALPHA * (tokens / generate_seconds - self.generate_tps)
+        self.calls += 1
+
+    def recover(self):
+        self.overhead += RECOVERY_RATE * (self.prior_overhead - self.overhead)
+
+
+class ChatRouter:
+    """Picks the chat backend for each turn from prompt size, observed latency and a time budget.
+
+    For streamed replies the budget is the time until the first sentence is ready for
+    TTS; for reply() it covers the whole reply, and max_tokens is lowered to fit it.
+    Backends are tried in preference order; the first one predicted to meet the
+    budget wins, otherwise the fastest one does. Predictions use an exponentially
+    weighted average of each backend's observed overhead and generation speed.
+    """
+
+    def __init__(self, backends, budget=1.5, reply_budget=4.0, max_tokens=160):
+        self.backends = list(backends)
+        self.budget = budget
+        self.reply_budget = reply_budget
+        self.max_tokens = max_tokens
+        self.stats = {backend.name: BackendStats(backend) for backend in self.backends}
+        self.chosen = {backend.name: 0 for backend in self.backends}
+        self.over_budget = 0
+        self.last = None
+        self._lock = threading.Lock()
+
+    def predict(self, backend, prompt_tokens, tokens=FIRST_SENTENCE_TOKENS):
+        """Predicted seconds until `tokens` reply tokens have been generated"""
+        stats = self.stats[backend.name]
+        return stats.overhead + prompt_tokens / backend.prefill_tps + tokens / stats.generate_tps
+
+    def _usable(self, backend, prompt_tokens, max_tokens):
+        stats = self.stats[backend.name]
+        if stats.failed_at is not None and time.monotonic() - stats.failed_at < FAILURE_COOLDOWN:
+            return False
+        return prompt_tokens + max_tokens <= backend.context_tokens and backend.available()
+
+    def plan(self, messages, budget=None, max_tokens=None, stream=True):
+        """Candidate backends in the order they should be tried, with the max_tokens to use"""
+        budget = (self.budget if stream else self.reply_budget) if budget is None else budget
+        max_tokens = max_tokens or self.max_tokens
+        prompt_tokens = estimate_tokens(messages)
+        with self._lock:
+            candidates = [b for b in self.backends if self._usable(b, prompt_tokens, max_tokens)]
+            if not candidates:
+                return [], max_tokens, prompt_tokens
+            if not stream:
+                # A non-streamed reply has to be complete within the budget: shorten it if needed
+                fastest = min(candidates, key=lambda b: self.predict(b, prompt_tokens, max_tokens))
+                stats = self.stats[fastest.name]
+                spare = budget - stats.overhead - prompt_tokens / fastest.prefill_tps
+                max_tokens = max(MIN_MAX_TOKENS, min(max_tokens, int(spare * stats.generate_tps)))
+            needed = FIRST_SENTENCE_TOKENS if stream else max_tokens
+            within = [b for b in candidates if self.predict(b, prompt_tokens, needed) <= budget]
+            rest = sorted((b for b in candidates if b not in within),
+                          key=lambda b: self.predict(b, prompt_tokens, needed))
+            ordered = within + rest
+            for backend in self.backends[:self.backends.index(ordered[0])]:
+                self.stats[backend.name].recover()
+        return ordered, max_tokens, prompt_tokens
+
+    def stream(self, messages, budget=None, max_tokens=None, backend=None, model=None, stream=True):
+        """Yield the reply from the chosen backend, falling back if one fails before its first token"""
+        if backend is not None:
+            candidates = [b for b in self.backends if b.name == backend]
+            max_tokens = max_tokens or self.max_tokens
+            prompt_tokens = estimate_tokens(messages)
+        else:
+            candidates, max_tokens, prompt_tokens = self.plan(messages, budget, max_tokens, stream)
+        if not candidates:
+            raise RuntimeError("No chat backend is available")
+        budget = (self.budget if stream else self.reply_budget) if budget is None else budget
+
+        error = None
+        for chosen in candidates:
+            predicted = self.predict(chosen, prompt_tokens, FIRST_SENTENCE_TOKENS if stream else max_tokens)
+            start = time.perf_counter()
+            first = None
+            chars = 0
+            try:
+                for text in chosen.stream(messages, max_tokens, model):
+                    if first is None:
+                        first = time.perf_counter()
+                    chars += len(text)
+                    yield text
+            except Exception as e:
+                if first is not None:
+                    raise
+                logging.warning(f"Chat backend {chosen.name} failed, trying the next one: {str(e)}")
+                with self._lock:
+                    self.stats[chosen.name].failures += 1
+                    self.stats[chosen.name].failed_at = time.monotonic()
+                error = e
+                continue
+            end = time.perf_counter()
+            first = first or end
+            with self._lock:
+                self.stats[chosen.name].update(first - start, prompt_tokens, chosen.prefill_tps,
+                                               chars / 4, end - first)
+                self.stats[chosen.name].failed_at = None
+                self.chosen[chosen.name] += 1
+                self.over_budget += (first - start) > budget
+                self.last = {
+                    "backend": chosen.name,
+                    "prompt_tokens": prompt_tokens,
+                    "max_tokens": max_tokens,
+                    "budget": budget,
+                    "predicted_seconds": round(predicted, 3),
+                    "first_token_seconds": round(first - start, 3),
+                    "total_seconds": round(end - start, 3),
+                }
+            return
+        raise error
+
+    def reply(self, messages, budget=None, max_tokens=None, backend=None, model=None):
+        """Complete reply text; the budget then covers the whole reply, not just its first sentence"""
+        return "".join(self.stream(messages, budget, max_tokens, backend, model, stream=False))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "budget": self.budget,
+                "reply_budget": self.reply_budget,
+                "max_tokens": self.max_tokens,
+                "over_budget": self.over_budget,
+                "last": self.last,
+                "backends": {
+                    name: {
+                        "chosen": self.chosen[name],
+                        "failures": stats.failures,
+                        "overhead": round(stats.overhead, 3),
+                        "generate_tps": round(stats.generate_tps, 1),
+                    }
+                    for name, stats in self.stats.items()
+                },
+            }
+
+
+def build_backends(settings):
+    """Backends for settings.chat_routes; "local" needs local_chat_model to be set"""
+    if settings.fake_providers:
+        return [FakeBackend("fake", settings.provider("openai").models["chat"])]
+    backends = []
+    for name in settings.chat_routes:
+        if name == "openai":
+            backends.append(OpenAIBackend("openai", settings.provider("openai").models["chat"]))
+        elif name == "groq":
+            backends.append(GroqBackend("groq", settings.provider("groq").models["chat"]))
+        elif name == "local" and settings.local_chat_model:
+            backends.append(LocalBackend("local", settings.local_chat_model))
+    return backends
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Process-wide router shared by all sessions, so latency observations are pooled"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            settings = config.get_settings()
+            _router = ChatRouter(build_backends(settings), settings.chat_budget_seconds,
+                                 settings.chat_reply_budget_seconds, settings.chat_max_tokens)
+        return _router
+
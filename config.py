@@ -0,0 +1,234 @@
+import functools
+import json
+import logging
+import os
+from dataclasses import dataclass, field, fields, replace
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Optional JSON file overriding any of the defaults below (see voice_config.example.json)
+CONFIG_PATH_ENV = "VOICE_CONFIG"
+DEFAULT_CONFIG_PATH = "voice_config.json"
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    """One remote provider: endpoints, models, limits and where its secret comes from."""
+
+    name: str
+    endpoints: Dict[str, str]
+    api_key_env: str
+    models: Dict[str, str] = field(default_factory=dict)
+    timeout: float = 60.0
+    rate: float = 2.0  # client-side requests per second
+    burst: int = 4
+    max_concurrency: int = 8
+
+    @property
+    def api_key(self) -> Optional[str]:
+        # Read on each access so keys rotated in the environment are picked up
+        return os.getenv(self.api_key_env)
+
+    def url(self, endpoint: str) -> str:
+        return self.endpoints[endpoint]
+
+
+@dataclass(frozen=True)
+class VoiceConfig:
+    id: str
+    name: str
+    provider: str = "speechify"
+    language: str = "en-US"
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Everything the entry points need, loaded once per process by get_settings()."""
+
+    providers: Dict[str, ProviderConfig]
+    voices: Tuple[VoiceConfig, ...]
+    default_voice_id: str
+    fake_providers: bool = False
+    # Thread pools
+    server_threads: int = 32
+    server_max_sessions: int = 64
+    single_flight_workers: int = 16
+    turn_workers: int = 16
+    speculative_workers: int = 2
+    narration_workers: int = 4
+    # Caches
+    transcription_cache_path: str = os.path.join("media", "transcription_cache.sqlite3")
+    transcription_cache_size: int = 2000
+    transcription_cache_fuzzy: bool = True
+    speculative_cache_size: int = 256
+    # Stored reply clips and their encodings (audio_encode.py) are deleted once older than
+    # audio_store_ttl seconds, oldest first while the directory is above audio_store_max_mb
+    audio_store_ttl: float = 24 * 3600.0
+    audio_store_max_mb: int = 512
+    # Model registry (model_registry.py): memory-mapped weights exported per precision to
+    # model_cache_dir; warm models are evicted after model_idle_seconds or past the budget
+    model_cache_dir: str = os.path.join("media", "models")
+    model_precision: str = "float32"
+    model_memory_budget_mb: int = 4096
+    model_idle_seconds: float = 900.0
+    # Browser microphone (browser_capture.py): the voice server's transcription socket and
+    # the chunk format the recorder sends ("pcm16", or "opus" through MediaRecorder)
+    capture_url: str = "ws://localhost:8080/ws/transcribe"
+    capture_format: str = "pcm16"
+    # Profiling hooks (profiling.py): "cpu", "memory" or "cpu,memory" profiles every voice turn
+    profile_mode: str = ""
+    profile_dir: str = os.path.join("media", "profiles")
+    profile_interval_ms: float = 10.0
+    # Semantic answer cache (semantic_cache.py): off by default, because the hashing embedding
+    # can't tell paraphrases from different questions reliably; cosine similarity needed for
+    # a hit, entry lifetime, size, "hashing" or "minilm" embeddings, and whether
+    # conversations share answers
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.85
+    semantic_cache_ttl: float = 24 * 3600.0
+    semantic_cache_size: int = 500
+    semantic_cache_embedding: str = "hashing"
+    semantic_cache_shared: bool = False
+    # Chat routing (chat_router.py): backends in order of preference, seconds until the
+    # first spoken sentence (streamed) or the whole reply (not streamed), reply length cap,
+    # and an optional local transformers model
+    chat_routes: Tuple[str, ...] = ("openai", "groq", "local")
+    chat_budget_seconds: float = 1.5
+    chat_reply_budget_seconds: float = 4.0
+    chat_max_tokens: int = 160
+    local_chat_model: str = ""
+    # Local STT/TTS through transformers (local_inference.py); empty model names use the remote
+    # providers. Requests from all sessions are batched onto worker processes.
+    local_stt_model: str = ""
+    local_tts_model: str = ""
+    inference_workers: int = 2
+    inference_threads_per_worker: int = 1
+    inference_max_batch: int = 8
+    inference_max_wait_ms: float = 5.0
+
+    def provider(self, name: str) -> ProviderConfig:
+        return self.providers[name]
+
+    def voices_for(self, provider: str) -> Tuple[VoiceConfig, ...]:
+        return tuple(voice for voice in self.voices if voice.provider == provider)
+
+    def voice(self, voice_id: str) -> Optional[VoiceConfig]:
+        return next((voice for voice in self.voices if voice.id == voice_id), None)
+
+
+DEFAULT_PROVIDERS = {
+    "openai": ProviderConfig(
+        name="openai",
+        endpoints={"api": "https://api.openai.com/v1"},
+        api_key_env="OPENAI_API_KEY",
+        models={"chat": "gpt-3.5-turbo", "stt": "whisper-1"},
+        timeout=60.0, rate=3.0, burst=5, max_concurrency=8,
+    ),
+    "speechify": ProviderConfig(
+        name="speechify",
+        endpoints={
+            "tts": "https://api.sws.speechify.com/v1/audio/speech",
+            "voices": "https://api.sws.speechify.com/v1/voices",
+            "clone": "https://api.speechify.com/api/tts/clone",
+            "legacy_tts": "https://api.speechify.ai/v2/tts",
+            "legacy_voices": "https://api.speechify.ai/v2/voices",
+        },
+        api_key_env="SPEECHIFY_API_KEY",
+        timeout=60.0, rate=5.0, burst=10, max_concurrency=8,
+    ),
+    "groq": ProviderConfig(
+        name="groq",
+        endpoints={"api": "https://api.groq.com/openai/v1"},
+        api_key_env="GROQ_API_KEY",
+        models={"chat": "llama-3.1-8b-instant"},
+        timeout=30.0, rate=0.5, burst=2, max_concurrency=4,
+    ),
+    "elevenlabs": ProviderConfig(
+        name="elevenlabs",
+        endpoints={"api": "https://api.elevenlabs.io/v1"},
+        api_key_env="ELEVENLABS_API_KEY",
+        models={"tts": "eleven_monolingual_v1"},
+        timeout=60.0, rate=2.0, burst=4, max_concurrency=4,
+    ),
+}
+
+DEFAULT_VOICES = (
+    VoiceConfig(id="dc1f0dc1-ff98-4086-8687-40c0bb495965", name="Default Voice"),
+)
+
+
+def _env_flag(name, default):
+    value = os.getenv(name)
+    return default if value is None else value.lower() in ("1", "true", "yes", "on")
+
+
+def _coerce(value, current):
+    if isinstance(current, bool):
+        return value if isinstance(value, bool) else str(value).lower() in ("1", "true", "yes", "on")
+    return type(current)(value) if current is not None else value
+
+
+def load_settings(path=None):
+    """Build Settings from the defaults, an optional JSON file and environment overrides"""
+    load_dotenv()
+    path = path or os.getenv(CONFIG_PATH_ENV, DEFAULT_CONFIG_PATH)
+    data = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+        logging.info(f"Loaded voice configuration from {path}")
+
+    providers = dict(DEFAULT_PROVIDERS)
+    for name, overrides in data.get("providers", {}).items():
+        base = providers.get(name) or ProviderConfig(name=name, endpoints={}, api_key_env=f"{name.upper()}_API_KEY")
+        overrides = dict(overrides)
+        if "endpoints" in overrides:
+            overrides["endpoints"] = {**base.endpoints, **overrides["endpoints"]}
+        if "models" in overrides:
+            overrides["models"] = {**base.models, **overrides["models"]}
+        providers[name] = replace(base, **overrides)
+
+    voices = tuple(VoiceConfig(**voice) for voice in data["voices"]) if "voices" in data else DEFAULT_VOICES
+    scalars = {f.name: data[f.name] for f in fields(Settings)
+               if f.name not in ("providers", "voices") and f.name in data}
+    settings = Settings(providers=providers, voices=voices,
+                        default_voice_id=scalars.pop("default_voice_id", voices[0].id), **scalars)
+
+    # Environment variables win over the file for the settings people tune per deployment
+    env_overrides = {
+        "fake_providers": os.getenv("VOICE_PROVIDERS", "").lower() == "fake" or None,
+        "transcription_cache_path": os.getenv("TRANSCRIPTION_CACHE_PATH"),
+        "transcription_cache_size": os.getenv("TRANSCRIPTION_CACHE_SIZE"),
+        "transcription_cache_fuzzy": os.getenv("TRANSCRIPTION_CACHE_FUZZY"),
+        "semantic_cache_enabled": os.getenv("SEMANTIC_CACHE"),
+        "semantic_cache_threshold": os.getenv("SEMANTIC_CACHE_THRESHOLD"),
+        "capture_url": os.getenv("CAPTURE_URL"),
+        "model_precision": os.getenv("MODEL_PRECISION"),
+        "model_memory_budget_mb": os.getenv("MODEL_MEMORY_BUDGET_MB"),
+        "profile_mode": os.getenv("VOICE_PROFILE"),
+        "profile_dir": os.getenv("PROFILE_DIR"),
+        "chat_budget_seconds": os.getenv("CHAT_BUDGET_SECONDS"),
+        "local_chat_model": os.getenv("LOCAL_CHAT_MODEL"),
+        "local_stt_model": os.getenv("LOCAL_STT_MODEL"),
+        "local_tts_model": os.getenv("LOCAL_TTS_MODEL"),
+    }
+    return replace(settings, **{name: _coerce(value, getattr(settings, name))
+                                for name, value in env_overrides.items() if value is not None})
+
+
+@functools.lru_cache(maxsize=1)
+def get_settings():
+    """Process-wide settings, loaded on first use"""
+    return load_settings()
+
+
+if __name__ == "__main__":
+    settings = get_settings()
+    for provider in settings.providers.values():
+        key_state = "set" if provider.api_key else f"missing ({provider.api_key_env})"
+        print(f"{provider.name:11s} rate {provider.rate}/s burst {provider.burst} "
+              f"timeout {provider.timeout}s concurrency {provider.max_concurrency} key {key_state}")
+    for voice in settings.voices:
+        print(f"voice {voice.id} {voice.name} ({voice.provider}, {voice.language})")
+    print({f.name: getattr(settings, f.name) for f in fields(Settings) if f.name not in ("providers", "voices")})
@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import signal
+
+import audio_post
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+ENROLL_SAMPLE_RATE = 24000
+ENROLL_LUFS = -20.0
+BEST_SECONDS = 30.0
+FRAME_MS = 30
+MIN_SEGMENT_S = 0.6
+MAX_GAP_MS = 300
+CLIP_LEVEL = 0.99
+DEFAULT_CACHE_DIR = os.path.join("media", "enrollment")
+# Bump when the processing changes so stale cached outputs are not reused
+PIPELINE_VERSION = 1
+
+
+def frame_energy_db(samples, sample_rate, frame_ms=FRAME_MS):
+    """Per-frame energy in dBFS for a mono float32 signal"""
+    frame = int(sample_rate * frame_ms / 1000)
+    frames = len(samples) // frame
+    power = np.square(samples[:frames * frame].reshape(frames, frame), dtype=np.float64).mean(axis=1)
+    return 10 * np.log10(np.maximum(power, 1e-12)), frame
+
+
+def detect_speech(samples, sample_rate, frame_ms=FRAME_MS, margin_db=10.0):
+    """Energy VAD with an adaptive noise floor, returns [(start, end)] sample ranges"""
+    energy, frame = frame_energy_db(samples, sample_rate, frame_ms)
+    if energy.size == 0:
+        return [], -120.0
+    noise_floor = float(np.percentile(energy, 10))
+    voiced = energy > max(noise_floor + margin_db, -60.0)
+    # Close short pauses between words so sentences stay in one segment
+    gap = max(1, MAX_GAP_MS // frame_ms)
+    voiced = signal.convolve(voiced.astype(np.int8), np.ones(gap, dtype=np.int8), mode="same") > 0
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]])))
+    segments = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        if (end - start) * frame >= MIN_SEGMENT_S * sample_rate:
+            segments.append((int(start * frame), int(end * frame)))
+    return segments, noise_floor
+
+
+def denoise(samples, sample_rate, segments, reduction_db=12.0):
+    """Spectral gating: attenuate bins below the noise profile learned from non-speech frames"""
+    nperseg = 512
+    _, _, spectrum = signal.stft(samples, sample_rate, nperseg=nperseg)
+    magnitude = np.abs(spectrum)
+    speech = np.zeros(magnitude.shape[1], dtype=bool)
+    hop = nperseg // 2
+    for start, end in segments:
+        speech[start // hop:end // hop + 1] = True
+    noise_frames = magnitude[:, ~speech] if (~speech).sum() >= 10 else magnitude
+    noise_profile = np.percentile(noise_frames, 50, axis=1, keepdims=True)
+    threshold = noise_profile * 1.5
+    floor = 10 ** (-reduction_db / 20)
+    mask = np.where(magnitude > threshold, 1.0, floor)
+    # Smooth the mask over time and frequency to avoid musical noise
+    mask = signal.convolve2d(mask, np.ones((3, 5)) / 15, mode="same", boundary="symm")
+    _, cleaned = signal.istft(spectrum * mask, sample_rate, nperseg=nperseg)
+    return cleaned[:len(samples)].astype(np.float32)
+
+
+def score_segment(samples, noise_floor_db, sample_rate):
+    """Quality score of a segment from its SNR, clipping and length (higher is better)"""
+    energy, _ = frame_energy_db(samples, sample_rate)
+    speech_db = float(np.percentile(energy, 90)) if energy.size else -120.0
+    snr = speech_db - noise_floor_db
+    clipping = float(np.mean(np.abs(samples) >= CLIP_LEVEL))
+    duration = len(samples) / sample_rate
+    score = min(snr, 40.0) / 40.0 - 20.0 * clipping + 0.1 * min(duration, 5.0) / 5.0
+    return {"snr_db": round(snr, 1), "clipping": round(clipping, 5), "seconds": round(duration, 2),
+            "score": round(score, 4)}
+
+
+def select_best(samples, sample_rate, segments, noise_floor, seconds=BEST_SECONDS):
+    """Highest-scoring segments up to `seconds`, kept in their original order"""
+    scored = [(score_segment(samples[start:end], noise_floor, sample_rate), start, end)
+              for start, end in segments]
+    scored.sort(key=lambda item: item[0]["score"], reverse=True)
+    chosen, total = [], 0
+    for report, start, end in scored:
+        if total >= seconds * sample_rate:
+            break
+        end = min(end, start + int(seconds * sample_rate) - total)
+        chosen.append((start, end, report))
+        total += end - start
+    chosen.sort(key=lambda item: item[0])
+    return chosen
+
+
+def process_samples(samples, sample_rate, seconds=BEST_SECONDS):
+    """Run the full pipeline on mono float32 samples, returns (cleaned samples, report)"""
+    samples = audio_post.to_mono(samples.reshape(len(samples), -1).astype(np.float32))
+    samples = audio_post.resample(samples, sample_rate, ENROLL_SAMPLE_RATE)[:, 0]
+    sample_rate = ENROLL_SAMPLE_RATE
+    samples = samples - samples.mean()
+
+    segments, noise_floor = detect_speech(samples, sample_rate)
+    if not segments:
+        return np.zeros(0, dtype=np.float32), {"segments": [], "seconds": 0.0, "score": 0.0}
+    cleaned = denoise(samples, sample_rate, segments)
+    chosen = select_best(cleaned, sample_rate, segments, noise_floor, seconds)
+    pieces = [cleaned[start:end, None] for start, end, _ in chosen]
+    joined = audio_post.crossfade_concat(pieces, sample_rate, fade_ms=20)
+    joined = audio_post.normalize_loudness(joined, sample_rate, ENROLL_LUFS)[:, 0]
+    reports = [report for _, _, report in chosen]
+    weights = np.array([report["seconds"] for report in reports])
+    report = {
+        "segments": reports,
+        "seconds": round(len(joined) / sample_rate, 2),
+        "score": round(float(np.average([r["score"] for r in reports], weights=weights)), 4),
+        "noise_floor_db": round(noise_floor, 1),
+    }
+    return joined, report
+
+
+def content_key(data, seconds):
+    digest = hashlib.sha256(data)
+    digest.update(f"v{PIPELINE_VERSION}:{seconds}".encode())
+    return digest.hexdigest()[:24]
+
+
+def _cached(key, cache_dir):
+    wav_path = os.path.join(cache_dir, f"{key}.wav")
+    report_path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(wav_path) and os.path.exists(report_path):
+        with open(report_path) as f:
+            report = json.load(f)
+        report["cached"] = True
+        return report
+    return None
+
+
+def _store(key, cleaned, report, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    wav_path = os.path.join(cache_dir, f"{key}.wav")
+    temp_path = f"{wav_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(audio_post.encode_wav(cleaned, ENROLL_SAMPLE_RATE))
+    os.replace(temp_path, wav_path)
+    report = dict(report, path=wav_path, key=key)
+    with open(os.path.join(cache_dir, f"{key}.json"), "w") as f:
+        json.dump(report, f)
+    report["cached"] = False
+    return report
+
+
+def prepare_file(audio_file, seconds=BEST_SECONDS, cache_dir=DEFAULT_CACHE_DIR):
+    """Preprocess one reference file; re-running on the same content is a cache hit"""
+    with open(audio_file, "rb") as f:
+        data = f.read()
+    key = content_key(data, seconds)
+    report = _cached(key, cache_dir)
+    if report is None:
+        samples, sample_rate = audio_post.decode_audio(data, os.path.splitext(audio_file)[1].lstrip(".") or None)
+        cleaned, report = process_samples(samples, sample_rate, seconds)
+        report = _store(key, cleaned, report, cache_dir)
+    report["source"] = audio_file
+    return report
+
+
+def prepare_recording(recording, sample_rate=44100, seconds=BEST_SECONDS, cache_dir=DEFAULT_CACHE_DIR):
+    """Preprocess the array returned by record_audio()"""
+    recording = np.ascontiguousarray(recording, dtype=np.float32)
+    key = content_key(recording.tobytes() + str(sample_rate).encode(), seconds)
+    report = _cached(key, cache_dir)
+    if report is None:
+        cleaned, report = process_samples(recording, sample_rate, seconds)
+        report = _store(key, cleaned, report, cache_dir)
+    return report
+
+
+def prepare_many(audio_files, seconds=BEST_SECONDS, cache_dir=DEFAULT_CACHE_DIR, workers=None):
+    """Bulk enrollment: preprocess files in parallel across processes"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(audio_files) == 1:
+        return [prepare_file(audio_file, seconds, cache_dir) for audio_file in audio_files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(prepare_file, audio_files, [seconds] * len(audio_files),
+                             [cache_dir] * len(audio_files)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare reference recordings for voice cloning")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--seconds", type=float, default=BEST_SECONDS, help="Best N seconds to keep per file")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--voice-id", help="Also enroll the cleaned audio into the voice-profile index")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    reports = prepare_many(args.files, args.seconds, args.cache_dir, args.workers)
+    elapsed = time.perf_counter() - start
+    for report in reports:
+        status = "cached" if report["cached"] else "processed"
+        logging.info(f"{report['source']}: {status}, {report['seconds']}s kept, score {report['score']} -> {report.get('path')}")
+    logging.info(f"{len(reports)} file(s) in {elapsed:.2f}s")
+
+    if args.voice_id:
+        import voice_profiles
+        paths = [report["path"] for report in reports if report["seconds"] > 0]
+        voice_profiles.enroll(args.voice_id, paths)
+        logging.info(f"Enrolled {len(paths)} cleaned file(s) as {args.voice_id}")
@@ -0,0 +1,69 @@
+import io
+import os
+import time
+import wave
+import numpy as np
+
+# Local stand-ins for OpenAI, Speechify and ElevenLabs, used for testing without network access.
+# Every call sleeps FAKE_PROVIDER_LATENCY seconds to mimic a remote round trip.
+FAKE_LATENCY = float(os.getenv("FAKE_PROVIDER_LATENCY", "0.05"))
+FAKE_SAMPLE_RATE = 24000
+
+FAKE_VOICES = [
+    {"id": "dc1f0dc1-ff98-4086-8687-40c0bb495965", "name": "Default Voice", "language": "en-US", "gender": "female"},
+    {"id": "fake-voice-sw", "name": "Swahili Voice", "language": "sw-KE", "gender": "male"},
+]
+
+
+def _wait():
+    if FAKE_LATENCY > 0:
+        time.sleep(FAKE_LATENCY)
+
+
+def tone_wav(duration, sample_rate=FAKE_SAMPLE_RATE, frequency=220.0):
+    """Generate a 16-bit mono WAV tone of the given duration"""
+    t = np.arange(int(duration * sample_rate), dtype=np.float32) / sample_rate
+    samples = (0.3 * np.sin(2 * np.pi * frequency * t) * 32767).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def transcribe_audio(audio_file):
+    _wait()
+    size = os.path.getsize(audio_file)
+    return f"fake transcript of {size} bytes"
+
+
+def chat_reply(messages, model="gpt-3.5-turbo"):
+    _wait()
+    last = messages[-1]["content"] if messages else ""
+    return f"You said: {last}"
+
+
+def chat_reply_stream(messages, model="gpt-3.5-turbo"):
+    reply = chat_reply(messages, model)
+    for i, word in enumerate(reply.split(" ")):
+        time.sleep(FAKE_LATENCY / 10)
+        yield word if i == 0 else " " + word
+
+
+def speechify_tts(text, voice_id=None):
+    _wait()
+    # Roughly 15 characters per second of speech
+    return tone_wav(max(0.2, len(text) / 15.0)), "wav"
+
+
+def speechify_voices():
+    _wait()
+    return [dict(voice) for voice in FAKE_VOICES]
+
+
+def elevenlabs_tts(text, voice_id=None):
+    # The stand-in returns WAV bytes even though ElevenLabs would return mp3
+    audio_data, _ = speechify_tts(text, voice_id)
+    return audio_data
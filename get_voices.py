@@ -1,42 +1,41 @@
-import requests
+import config
+import voice_pipeline
 
-# Speechify API endpoint for voices
-url = "https://api.sws.speechify.com/v1/voices"
+# API token comes from SPEECHIFY_API_KEY (see config.py)
+token = config.get_settings().provider("speechify").api_key
 
-# Your API token
-token = "9TO31l-2YltVh300iUA9pA-yLWItk8eI_NKXCJgfO6U="
+# Voice we are looking for
+target_voice_id = config.get_settings().default_voice_id
 
-# Headers for the API request
-headers = {
-    "Authorization": f"Bearer {token}"
-}
 
-try:
-    # Make the API request
-    response = requests.get(url, headers=headers)
-    
-    # Check if the request was successful
-    if response.status_code == 200:
-        voices = response.json()
-        print("\nSearching for voice ID 'dc1f0dc1-ff98-4086-8687-40c0bb495965':")
+def find_voice(voice_id, api_key=token):
+    """Look up a Speechify voice by ID, returns (voice, all_voices)"""
+    # Concurrent lookups share one voice-list request (see single_flight.py)
+    voices = voice_pipeline.speechify_voices(api_key)
+    for voice in voices:
+        if voice.get('id') == voice_id:
+            return voice, voices
+    return None, voices
+
+
+if __name__ == "__main__":
+    try:
+        print(f"\nSearching for voice ID '{target_voice_id}':")
         print("----------------")
-        found = False
-        for voice in voices:
-            if voice.get('id') == 'dc1f0dc1-ff98-4086-8687-40c0bb495965':
-                found = True
-                print(f"Name: {voice.get('name', 'N/A')}")
-                print(f"ID: {voice.get('id', 'N/A')}")
-                print(f"Language: {voice.get('language', 'N/A')}")
-                print(f"Gender: {voice.get('gender', 'N/A')}")
-                print("----------------")
-        
-        if not found:
+        voice, voices = find_voice(target_voice_id)
+        if voice:
+            print(f"Name: {voice.get('name', 'N/A')}")
+            print(f"ID: {voice.get('id', 'N/A')}")
+            print(f"Language: {voice.get('language', 'N/A')}")
+            print(f"Gender: {voice.get('gender', 'N/A')}")
+            print("----------------")
+        else:
             print("Voice ID not found in the available voices.")
             print("\nAvailable voice IDs:")
             for voice in voices:
                 print(f"ID: {voice.get('id', 'N/A')}")
-    else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-except Exception as e:
-    print(f"An error occurred: {str(e)}") 
\ No newline at end of file
+    except voice_pipeline.ProviderError as e:
+        print(f"Error: {e.status_code}")
+        print(e.message)
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
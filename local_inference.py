@@ -0,0 +1,340 @@
+import argparse
+import io
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+import audio_post
+import config
+import model_registry
+
+STT_SAMPLE_RATE = 16000
+
+# The model instance of this worker process, created by _init_worker
+_model = None
+
+
+class WhisperSTT:
+    """Whisper through transformers; a batch is padded by the feature extractor to 30 s windows."""
+
+    def __init__(self, name):
+        import torch
+        from transformers import WhisperForConditionalGeneration, WhisperProcessor
+        self.torch = torch
+        self.name = name
+        self.model_class = WhisperForConditionalGeneration
+        self.processor = WhisperProcessor.from_pretrained(name)
+        # Weights are memory-mapped, so every worker shares one copy through the page cache
+        model_registry.pretrained(name, self.model_class)
+
+    def run_batch(self, items):
+        model = model_registry.pretrained(self.name, self.model_class)
+        inputs = self.processor(items, sampling_rate=STT_SAMPLE_RATE, return_tensors="pt")
+        with self.torch.inference_mode():
+            tokens = model.generate(inputs.input_features.to(model.dtype), max_new_tokens=224)
+        return [text.strip() for text in self.processor.batch_decode(tokens, skip_special_tokens=True)]
+
+
+class VitsTTS:
+    """MMS/VITS text-to-speech through transformers; texts are padded to the longest in the batch."""
+
+    def __init__(self, name):
+        import torch
+        from transformers import AutoTokenizer, VitsModel
+        self.torch = torch
+        self.name = name
+        self.model_class = VitsModel
+        self.tokenizer = AutoTokenizer.from_pretrained(name)
+        model_registry.pretrained(name, self.model_class)
+
+    def run_batch(self, items):
+        model = model_registry.pretrained(self.name, self.model_class)
+        inputs = self.tokenizer(items, padding=True, return_tensors="pt")
+        with self.torch.inference_mode():
+            output = model(**inputs)
+        sample_rate = model.config.sampling_rate
+        clips = []
+        for waveform, length in zip(output.waveform, output.sequence_lengths):
+            buffer = io.BytesIO()
+            sf.write(buffer, waveform[:int(length)].float().numpy(), sample_rate, format="WAV", subtype="PCM_16")
+            clips.append(buffer.getvalue())
+        return clips
+
+
+class BenchModel:
+    """Stand-in for Whisper in benchmarks: conv encoder, then an autoregressive decoder loop.
+
+    As in a real decoder, each step's matmuls cost little more for a batch than for
+    a single request, which is where batching pays off on CPU.
+    """
+
+    DECODE_STEPS = 24
+    WIDTH = 768
+
+    def __init__(self, name=None):
+        import torch
+        self.torch = torch
+        torch.manual_seed(0)
+        self.encoder = torch.nn.Sequential(
+            torch.nn.Conv1d(1, 64, 400, stride=320), torch.nn.GELU(),
+            torch.nn.Conv1d(64, self.WIDTH, 3, padding=1),
+        ).eval()
+        self.decoder = torch.nn.Sequential(*[
+            layer for _ in range(4) for layer in (torch.nn.Linear(self.WIDTH, self.WIDTH), torch.nn.GELU())
+        ]).eval()
+
+    def run_batch(self, items):
+        lengths = [len(item) for item in items]
+        padded = np.zeros((len(items), max(lengths)), dtype=np.float32)
+        for i, item in enumerate(items):
+            padded[i, :len(item)] = item
+        with self.torch.inference_mode():
+            frames = self.encoder(self.torch.from_numpy(padded).unsqueeze(1))
+            valid = self.torch.tensor([(length - 400) // 320 + 1 for length in lengths])
+            mask = self.torch.arange(frames.shape[2])[None, :] < valid[:, None]
+            state = (frames * mask[:, None, :]).sum(dim=2) / valid[:, None]
+            tokens = []
+            for _ in range(self.DECODE_STEPS):
+                state = self.decoder(state)
+                tokens.append(state.argmax(dim=1))
+        return self.torch.stack(tokens, dim=1).tolist()
+
+
+MODELS = {"whisper": WhisperSTT, "vits": VitsTTS, "bench": BenchModel}
+
+
+def _init_worker(kind, name, threads):
+    global _model
+    import torch
+    # Workers share the cores: each one gets a fixed number of intra-op threads
+    torch.set_num_threads(threads)
+    _model = MODELS[kind](name)
+
+
+def _run_batch(items):
+    return _model.run_batch(items)
+
+
+def _ready():
+    return True
+
+
+class BatchScheduler:
+    """Batches requests from every session onto a pool of worker processes, one model copy each.
+
+    A request waits at most max_wait_ms for others to join its batch, and a batch holds
+    at most max_batch items. While every worker is busy, requests keep queueing and go
+    out together as soon as one frees up, so batches grow with load on their own.
+    Larger max_batch/max_wait_ms trade per-request latency for throughput.
+    """
+
+    def __init__(self, kind, name=None, workers=2, max_batch=8, max_wait_ms=5.0, threads_per_worker=1):
+        self.kind = kind
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        # spawn: forking a process that already runs torch and Streamlit threads is unsafe
+        self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_init_worker, initargs=(kind, name, threads_per_worker))
+        self._queue = queue.Queue()
+        self._free_workers = threading.Semaphore(workers)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.failures = 0
+        self._waits = deque(maxlen=2000)
+        self._service = deque(maxlen=2000)
+        self._thread = threading.Thread(target=self._loop, name=f"batch-{kind}", daemon=True)
+        self._thread.start()
+
+    def warm(self):
+        """Start every worker and load its model before the first real request"""
+        for future in [self._pool.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item, timeout=None):
+        return self.submit(item).result(timeout)
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            self._free_workers.acquire()
+            batch = [first]
+            deadline = first[2] + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    request = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._queue.put(None)
+                    break
+                batch.append(request)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        start = time.perf_counter()
+        try:
+            future = self._pool.submit(_run_batch, [item for item, _, _ in batch])
+        except Exception as e:
+            self._free_workers.release()
+            for _, request_future, _ in batch:
+                request_future.set_exception(e)
+            return
+        future.add_done_callback(lambda done: self._fan_out(done, batch, start))
+
+    def _fan_out(self, done, batch, start):
+        self._free_workers.release()
+        end = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+            self._service.append(end - start)
+            self._waits.extend(start - enqueued for _, _, enqueued in batch)
+        error = done.exception()
+        if error is not None:
+            with self._lock:
+                self.failures += 1
+            logging.error(f"{self.kind} batch of {len(batch)} failed: {str(error)}")
+            for _, request_future, _ in batch:
+                request_future.set_exception(error)
+            return
+        for (_, request_future, _), result in zip(batch, done.result()):
+            request_future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            waits = np.array(self._waits) * 1000 if self._waits else np.zeros(1)
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "failures": self.failures,
+                "mean_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "queue_wait_ms_p50": round(float(np.percentile(waits, 50)), 2),
+                "queue_wait_ms_p95": round(float(np.percentile(waits, 95)), 2),
+                "batch_ms_mean": round(1000 * float(np.mean(self._service)), 2) if self._service else 0.0,
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._pool.shutdown()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(kind):
+    """Process-wide scheduler for "stt" or "tts", shared by every session; None if not configured"""
+    settings = config.get_settings()
+    model_kind, name = {"stt": ("whisper", settings.local_stt_model),
+                        "tts": ("vits", settings.local_tts_model)}[kind]
+    if not name:
+        return None
+    with _schedulers_lock:
+        if kind not in _schedulers:
+            _schedulers[kind] = BatchScheduler(model_kind, name, settings.inference_workers,
+                                               settings.inference_max_batch, settings.inference_max_wait_ms,
+                                               settings.inference_threads_per_worker)
+        return _schedulers[kind]
+
+
+def _scheduler(kind):
+    scheduler = get_scheduler(kind)
+    if scheduler is None:
+        raise RuntimeError(f"No local {kind} model configured (set LOCAL_{kind.upper()}_MODEL)")
+    return scheduler
+
+
+def transcribe(audio_file):
+    """Transcribe with the local Whisper model, batched with other sessions' requests"""
+    samples, sample_rate = audio_post.decode_audio(audio_file)
+    samples = audio_post.resample(audio_post.to_mono(samples), sample_rate, STT_SAMPLE_RATE)[:, 0]
+    return _scheduler("stt")(samples.astype(np.float32))
+
+
+def synthesize(text):
+    """Synthesize with the local VITS model, batched with other sessions' requests; returns WAV bytes"""
+    return _scheduler("tts")(text)
+
+
+def stats():
+    with _schedulers_lock:
+        return {kind: scheduler.stats() for kind, scheduler in _schedulers.items()}
+
+
+def benchmark(sessions=16, seconds=4.0, workers=1, threads=1, settings=((1, 0.0), (4, 2.0), (8, 5.0), (16, 20.0))):
+    """Closed-loop load: `sessions` clients each send 2-6 s clips back to back"""
+    rng = np.random.default_rng(0)
+    clips = [rng.standard_normal(int(STT_SAMPLE_RATE * rng.uniform(2, 6))).astype(np.float32) * 0.1
+             for _ in range(32)]
+    results = []
+    for max_batch, max_wait_ms in settings:
+        scheduler = BatchScheduler("bench", workers=workers, max_batch=max_batch, max_wait_ms=max_wait_ms,
+                                   threads_per_worker=threads)
+        scheduler.warm()
+        latencies = []
+        stop = time.perf_counter() + seconds
+
+        def client(i):
+            n = i
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                scheduler(clips[n % len(clips)])
+                latencies.append(time.perf_counter() - start)
+                n += sessions
+
+        threads_list = [threading.Thread(target=client, args=(i,)) for i in range(sessions)]
+        start = time.perf_counter()
+        for thread in threads_list:
+            thread.start()
+        for thread in threads_list:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stats = scheduler.stats()
+        scheduler.close()
+        results.append({
+            "max_batch": max_batch,
+            "max_wait_ms": max_wait_ms,
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "latency_ms_p50": round(1000 * float(np.percentile(latencies, 50)), 1),
+            "latency_ms_p95": round(1000 * float(np.percentile(latencies, 95)), 1),
+            "mean_batch": stats["mean_batch"],
+            "queue_wait_ms_p50": stats["queue_wait_ms_p50"],
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dynamic batching for local inference workers")
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--seconds", type=float, default=4.0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per worker")
+    args = parser.parse_args()
+
+    # Heavy load shows the throughput gain, a single session the latency cost of waiting for a batch
+    for sessions in (args.sessions, 1):
+        print(f"{sessions} session(s)")
+        print(f"{'max_batch':>9s} {'wait_ms':>7s} {'req/s':>7s} {'p50_ms':>7s} {'p95_ms':>7s} "
+              f"{'batch':>6s} {'queue_ms':>8s}")
+        for row in benchmark(sessions, args.seconds, args.workers, args.threads):
+            print(f"{row['max_batch']:9d} {row['max_wait_ms']:7.1f} {row['requests_per_second']:7.1f} "
+                  f"{row['latency_ms_p50']:7.1f} {row['latency_ms_p95']:7.1f} {row['mean_batch']:6.2f} "
+                  f"{row['queue_wait_ms_p50']:8.2f}")
@@ -6,6 +6,9 @@ from pathlib import Path
 import logging
 from datetime import datetime
 
+import config
+import rate_limit
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -93,10 +96,11 @@ def main():
     output_path = output_dir / f"output_{timestamp}.mp3"
     
     # API configuration
-    url = "https://api.speechify.com/api/tts/clone"
+    speechify = config.get_settings().provider("speechify")
+    url = speechify.url("clone")
     
     # Get API key from environment variable
-    api_key = os.getenv('SPEECHIFY_API_KEY')
+    api_key = speechify.api_key
     if not api_key:
         logging.error("SPEECHIFY_API_KEY environment variable not set")
         return
@@ -106,10 +110,22 @@ def main():
         "Authorization": f"Bearer {api_key}"
     }
     
+    # Pick the enrolled voice closest to a reference recording, if one is given
+    voice_id = os.getenv("CLONE_VOICE_ID", "your_voice_id")  # Replace with actual voice ID
+    reference_audio = os.getenv("REFERENCE_AUDIO")
+    if reference_audio:
+        import voice_profiles
+        matches = voice_profiles.match(reference_audio, k=1)
+        if matches:
+            voice_id, score, _ = matches[0]
+            logging.info(f"Nearest enrolled voice: {voice_id} (similarity {score:.3f})")
+        else:
+            logging.warning("No enrolled voice profiles; run voice_profiles.py enroll first")
+
     # Example payload - adjust according to Speechify API requirements
     payload = {
         "text": "Hello, this is a test of voice cloning.",
-        "voice_id": "your_voice_id",  # Replace with actual voice ID
+        "voice_id": voice_id,
         "output_format": "mp3"
     }
     
@@ -126,7 +142,10 @@ def main():
             return
             
         logging.info("Making request to Speechify API...")
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        # Batch jobs queue behind interactive chat turns and back off on 429 Retry-After
+        with rate_limit.priority(rate_limit.BATCH):
+            response = rate_limit.request("speechify", api_key, "post", url, headers=headers, json=payload,
+                                          timeout=speechify.timeout)
         logging.info(f"Response status: {response.status_code}")
         
         if response.status_code == 200:
@@ -153,6 +172,8 @@ def main():
             logging.error("Authentication failed. Please check your API key.")
         elif response.status_code == 403:
             logging.error("Access forbidden. Please check your API permissions.")
+        elif response.status_code == 429:
+            logging.error("Rate limit still exceeded after retries. Try again later or lower the request rate.")
         else:
             logging.error(f"API request failed with status {response.status_code}")
             logging.error(f"Response: {response.text}")
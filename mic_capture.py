@@ -0,0 +1,355 @@
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+DEFAULT_SAMPLE_RATE = 44100
+BLOCK_SIZE = 1024
+RING_SECONDS = 30
+# Energy VAD used to end a recording early once the speaker stops
+SILENCE_DB = -45.0
+SILENCE_MS = 800
+MIN_SPEECH_MS = 300
+
+# Set MIC_DEVICE_FILE=path.wav to capture from a file instead of the microphone (headless runs)
+FAKE_DEVICE_FILE = os.getenv("MIC_DEVICE_FILE")
+
+
+class RingBuffer:
+    """Preallocated float32 ring buffer with one writer and any number of readers.
+
+    The writer (the audio callback) copies each block in and then publishes the new
+    total frame count; readers keep their own position and get views into the
+    buffer, so neither side takes a lock or allocates on the hot path.
+    """
+
+    def __init__(self, frames, channels=1):
+        self.capacity = frames
+        self.channels = channels
+        self.data = np.zeros((frames, channels), dtype=np.float32)
+        self.written = 0  # total frames ever written; only the writer updates it
+
+    def write(self, block):
+        end = self.written + len(block)
+        if len(block) > self.capacity:
+            # Only the newest capacity frames fit; the rest still count as written, so
+            # readers that wanted them see them as lost
+            block = block[-self.capacity:]
+        frames = len(block)
+        start = (end - frames) % self.capacity
+        first = min(frames, self.capacity - start)
+        self.data[start:start + first] = block[:first]
+        if first < frames:
+            self.data[:frames - first] = block[first:]
+        # Publish after the copy so readers never see frames that are not written yet
+        self.written = end
+
+    def views(self, start, end):
+        """Zero-copy views of absolute frames [start, end), split in two where the ring wraps"""
+        if end <= start:
+            return []
+        a, b = start % self.capacity, end % self.capacity
+        if a < b or b == 0:
+            return [self.data[a:b or self.capacity]]
+        return [self.data[a:], self.data[:b]]
+
+    def latest(self, frames):
+        end = self.written
+        return self.views(max(0, end - min(frames, self.capacity)), end)
+
+    def copy(self, start, end):
+        views = self.views(start, end)
+        return np.concatenate(views) if views else np.zeros((0, self.channels), dtype=np.float32)
+
+    def reader(self, from_start=False):
+        return RingReader(self, 0 if from_start else self.written)
+
+
+class RingReader:
+    """A consumer's position in a RingBuffer; frames it falls too far behind on are counted as lost"""
+
+    def __init__(self, ring, position):
+        self.ring = ring
+        self.position = position
+        self.lost_frames = 0
+
+    def available(self):
+        return self.ring.written - self.position
+
+    def read(self, max_frames=None):
+        """Views of the frames written since the last read"""
+        end = self.ring.written
+        oldest = end - self.ring.capacity
+        if self.position < oldest:
+            self.lost_frames += oldest - self.position
+            self.position = oldest
+        if max_frames is not None:
+            end = min(end, self.position + max_frames)
+        views = self.ring.views(self.position, end)
+        self.position = end
+        return views
+
+
+class FileDevice:
+    """Stand-in for sd.InputStream that plays a sound file into the callback.
+
+    speed=1.0 delivers blocks in real time, speed=0 as fast as possible. After the
+    file ends the device keeps delivering silence until stopped.
+    """
+
+    def __init__(self, path, samplerate, channels, callback, blocksize=BLOCK_SIZE, speed=1.0, loop=False):
+        samples, file_rate = sf.read(path, dtype="float32", always_2d=True)
+        if file_rate != samplerate:
+            import audio_post
+            samples = audio_post.resample(samples, file_rate, samplerate)
+        if samples.shape[1] != channels:
+            samples = np.repeat(samples.mean(axis=1, keepdims=True), channels, axis=1)
+        self.samples = np.ascontiguousarray(samples)
+        self.samplerate = samplerate
+        self.channels = channels
+        self.callback = callback
+        self.blocksize = blocksize
+        self.speed = speed
+        self.loop = loop
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        silence = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+        position = 0
+        started = time.perf_counter()
+        delivered = 0
+        while not self._stop.is_set():
+            if position < len(self.samples):
+                block = self.samples[position:position + self.blocksize]
+                position += len(block)
+                if self.loop and position >= len(self.samples):
+                    position = 0
+            else:
+                block = silence
+            self.callback(block, len(block), None, None)
+            delivered += len(block)
+            if self.speed > 0:
+                delay = started + delivered / (self.samplerate * self.speed) - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="file-mic", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def close(self):
+        self.stop()
+
+
+def rms_db(views):
+    """RMS level in dBFS over a list of views"""
+    frames = sum(len(view) for view in views)
+    if frames == 0:
+        return -120.0
+    power = sum(float(np.square(view, dtype=np.float64).sum()) for view in views) / (frames * views[0].shape[1])
+    return 10 * np.log10(max(power, 1e-12))
+
+
+class MicCapture:
+    """Callback-driven microphone capture into a RingBuffer.
+
+    The PortAudio callback only copies the block into the ring; recording,
+    level metering and VAD read from the ring on other threads.
+    """
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, channels=1, seconds=RING_SECONDS,
+                 device=None, blocksize=BLOCK_SIZE, fake_file=FAKE_DEVICE_FILE, fake_speed=1.0):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.ring = RingBuffer(int(seconds * sample_rate), channels)
+        self.device = device
+        self.blocksize = blocksize
+        self.fake_file = fake_file
+        self.fake_speed = fake_speed
+        self.device_overflows = 0
+        self.callbacks = 0
+        self.callback_seconds = 0.0
+        self.lost_frames = 0
+        self._stream = None
+        self._users = 0  # sessions currently recording through this capture
+        self._lock = threading.Lock()
+
+    def _callback(self, indata, frames, time_info, status):
+        start = time.perf_counter()
+        if status and status.input_overflow:
+            self.device_overflows += 1
+        self.ring.write(indata)
+        self.callbacks += 1
+        self.callback_seconds += time.perf_counter() - start
+
+    def start(self):
+        with self._lock:
+            self._users += 1
+            if self._stream is None:
+                self._open()
+        return self
+
+    def _open(self):
+        if self.fake_file:
+            self._stream = FileDevice(self.fake_file, self.sample_rate, self.channels, self._callback,
+                                      self.blocksize, self.fake_speed)
+        else:
+            import sounddevice as sd
+            self._stream = sd.InputStream(samplerate=self.sample_rate, channels=self.channels, dtype="float32",
+                                          blocksize=self.blocksize, device=self.device, callback=self._callback)
+        self._stream.start()
+
+    def stop(self):
+        # The device stays open until the last concurrent recording finishes
+        with self._lock:
+            self._users = max(0, self._users - 1)
+            if self._users == 0 and self._stream is not None:
+                self._stream.stop()
+                self._stream.close()
+                self._stream = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def wait(self, frames_written, timeout=None):
+        """Block until the ring has received frames_written frames in total.
+
+        Polls the published frame count every half block, so the audio callback never
+        has to take a lock to wake readers.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        interval = max(0.001, self.blocksize / self.sample_rate / 2)
+        while self.ring.written < frames_written:
+            if deadline is None:
+                time.sleep(interval)
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+        return True
+
+    def level(self, ms=50):
+        """Current input level in dBFS (for a level meter)"""
+        return rms_db(self.ring.latest(int(self.sample_rate * ms / 1000)))
+
+    def record(self, max_duration=5, stop_on_silence=True, on_block=None):
+        """Record up to max_duration seconds, ending early after SILENCE_MS of silence following speech.
+
+        on_block(views) is called with zero-copy views of every new chunk (e.g. for streaming STT).
+        Returns a (frames, channels) float32 array like sd.rec().
+        """
+        reader = self.ring.reader()
+        start = reader.position
+        end = start + int(max_duration * self.sample_rate)
+        speech_frames = silent_frames = 0
+        min_speech = int(MIN_SPEECH_MS * self.sample_rate / 1000)
+        max_silence = int(SILENCE_MS * self.sample_rate / 1000)
+        while reader.position < end:
+            if not self.wait(reader.position + 1, timeout=1.0):
+                break
+            views = reader.read(end - reader.position)
+            if on_block:
+                on_block(views)
+            if stop_on_silence:
+                frames = sum(len(view) for view in views)
+                if rms_db(views) > SILENCE_DB:
+                    speech_frames += frames
+                    silent_frames = 0
+                else:
+                    silent_frames += frames
+                if speech_frames >= min_speech and silent_frames >= max_silence:
+                    break
+        self.lost_frames = reader.lost_frames
+        return self.ring.copy(max(start, self.ring.written - self.ring.capacity), reader.position)
+
+    def stats(self):
+        return {
+            "callbacks": self.callbacks,
+            "device_overflows": self.device_overflows,
+            "callback_us": 1e6 * self.callback_seconds / self.callbacks if self.callbacks else 0.0,
+            "frames_written": self.ring.written,
+        }
+
+
+_captures = {}
+_captures_lock = threading.Lock()
+
+
+def get_capture(sample_rate=DEFAULT_SAMPLE_RATE, channels=1):
+    """Reuse one preallocated capture per format for the whole process"""
+    with _captures_lock:
+        capture = _captures.get((sample_rate, channels))
+        if capture is None:
+            capture = _captures[(sample_rate, channels)] = MicCapture(sample_rate, channels)
+        return capture
+
+
+def record(duration=5, sample_rate=DEFAULT_SAMPLE_RATE, stop_on_silence=True):
+    """Drop-in replacement for the apps' sd.rec()/sd.wait() recording.
+
+    Like sd.wait(), this blocks the calling thread (in the apps, the Streamlit script
+    thread) until the recording ends, up to duration seconds. app2's "Browser"
+    microphone records on the user's device and doesn't hold the script thread.
+    """
+    capture = get_capture(sample_rate)
+    with capture:
+        return capture.record(duration, stop_on_silence)
+
+
+# Benchmark the capture path headlessly with the file-backed device
+if __name__ == "__main__":
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Benchmark ring-buffer capture with a file-backed device")
+    parser.add_argument("file", nargs="?", help="WAV to play as the microphone (default: generated speech-like bursts)")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    path = args.file
+    if path is None:
+        # 2 s of modulated noise followed by silence
+        rng = np.random.default_rng(0)
+        t = np.arange(3 * DEFAULT_SAMPLE_RATE) / DEFAULT_SAMPLE_RATE
+        burst = 0.2 * rng.standard_normal(len(t)) * (np.sin(2 * np.pi * 3 * t) > 0) * (t < 2.0)
+        path = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
+        sf.write(path, burst.astype(np.float32), DEFAULT_SAMPLE_RATE)
+
+    # Throughput of the callback path, as fast as the fake device can deliver
+    capture = MicCapture(fake_file=path, fake_speed=0)
+    with capture:
+        capture.wait(int(args.seconds * DEFAULT_SAMPLE_RATE))
+    stats = capture.stats()
+    print(f"callback: {stats['callback_us']:.1f} us per {BLOCK_SIZE}-frame block "
+          f"({BLOCK_SIZE / DEFAULT_SAMPLE_RATE * 1e6:.0f} us budget), {stats['callbacks']} blocks")
+
+    # A consumer that is too slow loses frames instead of blocking the callback
+    capture = MicCapture(seconds=1.0, fake_file=path, fake_speed=0)
+    with capture:
+        reader = capture.ring.reader()
+        capture.wait(reader.position + 5 * DEFAULT_SAMPLE_RATE)
+        reader.read()
+    print(f"slow reader: lost {reader.lost_frames / DEFAULT_SAMPLE_RATE:.1f}s of audio from a 1 s ring, "
+          f"callback never blocked")
+
+    # Real-time recording ends shortly after speech stops instead of at max_duration
+    capture = MicCapture(fake_file=path)
+    with capture:
+        start = time.perf_counter()
+        recording = capture.record(max_duration=args.seconds)
+        elapsed = time.perf_counter() - start
+    print(f"record(max_duration={args.seconds:.0f}): {len(recording) / DEFAULT_SAMPLE_RATE:.2f}s captured, "
+          f"returned after {elapsed:.2f}s, lost frames {capture.lost_frames}")
@@ -0,0 +1,365 @@
+import argparse
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# safetensors dtype names; the torch dtypes are looked up when torch is imported
+DTYPES = {"F64": "float64", "F32": "float32", "F16": "float16", "BF16": "bfloat16", "I64": "int64",
+          "I32": "int32", "I16": "int16", "I8": "int8", "U8": "uint8", "BOOL": "bool"}
+
+Entry = namedtuple("Entry", "module precision bytes load_seconds path")
+
+
+def _lock_exclusive(lock_file):
+    """Block until this process holds an exclusive lock on lock_file (released on close)"""
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            # LK_LOCK retries for about 10 s before giving up
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _torch():
+    import torch
+    return torch
+
+
+def read_rss():
+    """Resident memory of this process in MB: private (anon) and file-backed pages shared through the page cache"""
+    fields = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS", "RssAnon", "RssFile")):
+                name, value = line.split(":")
+                fields[name] = int(value.split()[0]) / 1024
+    return {"rss_mb": round(fields.get("VmRSS", 0.0), 1), "anon_mb": round(fields.get("RssAnon", 0.0), 1),
+            "file_mb": round(fields.get("RssFile", 0.0), 1)}
+
+
+def mmap_safetensors(path):
+    """Tensors of a .safetensors file as zero-copy views of a private memory map, plus its metadata.
+
+    Pages are read on first touch and stay in the page cache, so every process mapping
+    the same file shares them; writes (there should be none) go to private copies.
+    """
+    torch = _torch()
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    metadata = header.pop("__metadata__", None) or {}
+    start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        dtype = getattr(torch, DTYPES[info["dtype"]])
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty(0, dtype=dtype).element_size()
+        if count == 0:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        tensors[name] = torch.frombuffer(mapped, dtype=dtype, count=count, offset=start + begin).view(info["shape"])
+    return tensors, metadata
+
+
+def export_weights(module, path, precision):
+    """Write a module's parameters and buffers to `path` as safetensors, floats cast to `precision`.
+
+    Tied weights are stored once and recorded as aliases, and buffers left out of
+    state_dict() (non-persistent) are included, so load_module needs nothing else.
+    """
+    from safetensors.torch import save_file
+    torch = _torch()
+    dtype = getattr(torch, precision)
+    tensors, aliases, owners = {}, {}, {}
+    named = list(module.named_parameters(remove_duplicate=False)) + list(module.named_buffers(remove_duplicate=False))
+    for name, tensor in named:
+        key = id(tensor)
+        if key in owners:
+            aliases[name] = owners[key]
+            continue
+        owners[key] = name
+        tensor = tensor.detach()
+        if tensor.is_floating_point():
+            tensor = tensor.to(dtype)
+        tensors[name] = tensor.contiguous().cpu()
+    # Written next to the target and renamed, so other processes never map a partial file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    save_file(tensors, temp_path, metadata={"aliases": json.dumps(aliases), "precision": precision})
+    os.replace(temp_path, path)
+
+
+def load_module(build, path):
+    """Build a module's skeleton without allocating weights and point it at the mapped file"""
+    torch = _torch()
+    tensors, metadata = mmap_safetensors(path)
+    with torch.device("meta"):
+        module = build()
+    assigned = {}
+    for name, tensor in tensors.items():
+        assigned[name] = _assign(module, name, tensor)
+    for alias, name in json.loads(metadata.get("aliases", "{}")).items():
+        _assign(module, alias, assigned[name])
+    missing = [name for name, tensor in list(module.named_parameters()) + list(module.named_buffers())
+               if tensor.is_meta]
+    if missing:
+        raise RuntimeError(f"{path} has no weights for {', '.join(missing[:5])}")
+    return module.eval()
+
+
+def _assign(module, name, tensor):
+    torch = _torch()
+    owner_name, _, leaf = name.rpartition(".")
+    owner = module.get_submodule(owner_name)
+    if leaf in owner._parameters:
+        if not isinstance(tensor, torch.nn.Parameter):
+            tensor = torch.nn.Parameter(tensor, requires_grad=False)
+        owner._parameters[leaf] = tensor
+    else:
+        owner._buffers[leaf] = tensor
+    return tensor
+
+
+class ModelRegistry:
+    """Warm model instances keyed by (name, precision), loaded from memory-mapped weights.
+
+    The first load of a model exports its weights once per precision to
+    `cache_dir/<name>-<precision>.safetensors` (source() is the slow path, e.g.
+    from_pretrained); every later load, in any process, builds the architecture on
+    the meta device and maps that file. Instances stay warm until they have been idle
+    for idle_seconds or the registry's weights exceed budget_mb, least recently used
+    first. An evicted instance lives on while callers still hold it.
+    """
+
+    def __init__(self, cache_dir, budget_mb=4096, idle_seconds=900, precision="float32"):
+        self.cache_dir = cache_dir
+        self.budget = budget_mb * 1024 * 1024
+        self.idle_seconds = idle_seconds
+        self.precision = precision
+        self._factories = {}
+        self._entries = {}
+        self._last_used = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def register(self, name, build, source):
+        """build() makes the architecture (called on the meta device); source() a fully loaded module"""
+        with self._lock:
+            self._factories[name] = (build, source)
+
+    def register_if_absent(self, name, build, source):
+        """Like register, unless name is already registered; returns True if this call registered it"""
+        with self._lock:
+            if name in self._factories:
+                return False
+            self._factories[name] = (build, source)
+            return True
+
+    def has(self, name):
+        with self._lock:
+            return name in self._factories
+
+    def path(self, name, precision):
+        return os.path.join(self.cache_dir, f"{name.replace('/', '--')}-{precision}.safetensors")
+
+    def get(self, name, precision=None):
+        """The warm instance of a registered model, loading it if needed"""
+        key = (name, precision or self.precision)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._last_used[key] = time.monotonic()
+                return entry.module
+            # One load per key; other callers wait for it instead of loading again
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                entry = self._load(*key)
+                with self._lock:
+                    self._entries[key] = entry
+                    self.loads += 1
+            with self._lock:
+                self._last_used[key] = time.monotonic()
+                self._evict(keep=key)
+        return entry.module
+
+    def _load(self, name, precision):
+        build, source = self._factories[name]
+        path = self.path(name, precision)
+        start = time.perf_counter()
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Worker processes starting together export once; the others wait and map the file
+            with open(f"{path}.lock", "w") as lock_file:
+                _lock_exclusive(lock_file)
+                if not os.path.exists(path):
+                    logging.info(f"Exporting {name} ({precision}) to {path}")
+                    export_weights(source(), path, precision)
+        module = load_module(build, path)
+        size = sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+        seconds = time.perf_counter() - start
+        logging.info(f"Loaded {name} ({precision}, {size / 1e6:.0f} MB) in {seconds:.2f}s")
+        return Entry(module, precision, size, seconds, path)
+
+    def _evict(self, keep=None):
+        now = time.monotonic()
+        for key in [key for key, used in self._last_used.items()
+                    if key != keep and now - used > self.idle_seconds]:
+            self._drop(key, "idle")
+        while sum(entry.bytes for entry in self._entries.values()) > self.budget:
+            candidates = [key for key in self._entries if key != keep]
+            if not candidates:
+                break
+            self._drop(min(candidates, key=self._last_used.get), "memory budget")
+
+    def _drop(self, key, reason):
+        self._entries.pop(key, None)
+        self._last_used.pop(key, None)
+        self.evictions += 1
+        logging.info(f"Evicted {key[0]} ({key[1]}): {reason}")
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            models = [{
+                "name": name,
+                "precision": precision,
+                "mb": round(entry.bytes / 1e6, 1),
+                "idle_seconds": round(now - self._last_used[(name, precision)], 1),
+                "load_seconds": round(entry.load_seconds, 3),
+            } for (name, precision), entry in self._entries.items()]
+            return {"models": models, "budget_mb": round(self.budget / 1024 / 1024), "hits": self.hits,
+                    "loads": self.loads, "evictions": self.evictions, **read_rss()}
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Process-wide registry; each worker process has its own and shares pages through the mapped files"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            settings = config.get_settings()
+            _registry = ModelRegistry(settings.model_cache_dir, settings.model_memory_budget_mb,
+                                      settings.model_idle_seconds, settings.model_precision)
+        return _registry
+
+
+def stats():
+    with _registry_lock:
+        return _registry.stats() if _registry is not None else {}
+
+
+def pretrained(name, model_class, precision=None):
+    """A transformers model through the registry: from_pretrained once, then memory-mapped"""
+    from transformers import AutoConfig
+    registry = get_registry()
+    if not registry.has(name):
+        model_config = AutoConfig.from_pretrained(name)
+        if hasattr(model_class, "from_config"):
+            build = lambda: model_class.from_config(model_config)
+        else:
+            build = lambda: model_class(model_config)
+        # Another thread may have registered it meanwhile; keep the first
+        registry.register_if_absent(name, build, lambda: model_class.from_pretrained(name))
+    return registry.get(name, precision)
+
+
+def _bench_model(layers=8, width=2048):
+    torch = _torch()
+    return torch.nn.Sequential(*[torch.nn.Linear(width, width) for _ in range(layers)])
+
+
+def _bench_worker(mode, cache_dir, precision, state_path):
+    """One fresh worker process: load the bench model the classic way or through the registry"""
+    torch = _torch()
+    torch.set_num_threads(1)
+    before = read_rss()
+    start = time.perf_counter()
+    if mode == "classic":
+        # What a plain load costs: random init, then a full copy of the weights from disk
+        model = _bench_model().to(getattr(torch, precision))
+        model.load_state_dict(torch.load(state_path))
+        model.eval()
+        cold = time.perf_counter() - start
+        warm = None
+    else:
+        registry = ModelRegistry(cache_dir, precision=precision)
+        registry.register("bench", _bench_model, _bench_model)
+        model = registry.get("bench")
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        registry.get("bench")
+        warm = time.perf_counter() - start
+    with torch.inference_mode():
+        model(torch.zeros(1, 2048, dtype=getattr(torch, precision)))
+    # Stay alive until every worker has loaded, so shared pages are counted while all of them map the file
+    time.sleep(1.0)
+    after = read_rss()
+    # Growth from loading the model, on top of what importing torch already costs
+    return {"cold": cold, "warm": warm, **{key: after[key] - before[key] for key in after}}
+
+
+# Cold vs warm loads and resident memory per worker, classic loading vs the registry
+if __name__ == "__main__":
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Compare model load time and RSS per worker process")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--precision", default="float32")
+    args = parser.parse_args()
+
+    torch = _torch()
+    cache_dir = tempfile.mkdtemp(prefix="model-registry-")
+    state_path = os.path.join(cache_dir, "bench.pt")
+    torch.save(_bench_model().to(getattr(torch, args.precision)).state_dict(), state_path)
+    print(f"bench model: {os.path.getsize(state_path) / 1e6:.0f} MB ({args.precision}), {args.workers} workers")
+    # RSS columns: growth per worker from loading the model; private pages are per process,
+    # file-backed ones are the page cache every worker mapping the file shares
+    print(f"{'mode':<22s} {'cold_s':>7s} {'warm_ms':>8s} {'+rss_mb':>8s} {'+private_mb':>11s} {'+file_mb':>9s}")
+    context = multiprocessing.get_context("spawn")
+    for label, mode in (("classic", "classic"), ("registry, first export", "registry"),
+                        ("registry, mapped", "registry")):
+        with ProcessPoolExecutor(args.workers, mp_context=context) as pool:
+            if label == "registry, first export":
+                # The export happens once, in whichever worker takes the file lock first
+                results = [pool.submit(_bench_worker, mode, cache_dir, args.precision, state_path).result()]
+            else:
+                futures = [pool.submit(_bench_worker, mode, cache_dir, args.precision, state_path)
+                           for _ in range(args.workers)]
+                results = [future.result() for future in futures]
+        mean = {key: sum(r[key] for r in results) / len(results) for key in ("cold", "rss_mb", "anon_mb", "file_mb")}
+        warm = f"{1000 * results[0]['warm']:8.3f}" if results[0]["warm"] is not None else f"{'-':>8s}"
+        print(f"{label:<22s} {mean['cold']:7.2f} {warm} {mean['rss_mb']:8.0f} {mean['anon_mb']:11.0f} "
+              f"{mean['file_mb']:9.0f}")
@@ -0,0 +1,230 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+import audio_post
+import config
+import rate_limit
+import tts_text
+import voice_pipeline
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Characters per request, kept below each provider's input limit
+MAX_CHARS = {"speechify": 1800, "elevenlabs": 2400}
+DEFAULT_MAX_CHARS = 1500
+CHUNK_RETRIES = 3
+FADE_MS = 40
+# Bump when chunking, text normalization (tts_text.py) or processing changes so old
+# parts are not reused on resume. 2: replies are normalized and split by language
+NARRATION_VERSION = 2
+
+SENTENCE_END = re.compile(r"(?<=[.!?…])[\"')\]]*\s+")
+CLAUSE_END = re.compile(r"(?<=[,;:])\s+")
+
+
+def _split_long(sentence, max_chars):
+    """Break a sentence longer than max_chars at clause boundaries, then at spaces"""
+    pieces = []
+    for clause in CLAUSE_END.split(sentence):
+        while len(clause) > max_chars:
+            cut = clause.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(clause[:cut])
+            clause = clause[cut:].lstrip()
+        pieces.append(clause)
+    return pieces
+
+
+def split_text(text, max_chars=DEFAULT_MAX_CHARS):
+    """Chunks of at most max_chars that end at sentence boundaries, preferring paragraph breaks"""
+    chunks = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        # Start a new chunk at a paragraph break once the current one is reasonably full
+        if current and len(current) >= max_chars // 2:
+            chunks.append(current)
+            current = ""
+        for sentence in SENTENCE_END.split(paragraph):
+            for piece in (_split_long(sentence, max_chars) if len(sentence) > max_chars else [sentence]):
+                if current and len(current) + 1 + len(piece) > max_chars:
+                    chunks.append(current)
+                    current = ""
+                current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_key(text, provider, voice_id):
+    digest = hashlib.sha256(f"v{NARRATION_VERSION}:{provider}:{voice_id}:{text}".encode())
+    return digest.hexdigest()[:16]
+
+
+class CrossfadeWriter:
+    """Append clips to an open sound file, crossfading each into the previous one.
+
+    Only the last fade_ms of audio is held back in memory, so the output is written
+    to disk as chunks arrive instead of being assembled in RAM.
+    """
+
+    def __init__(self, sound_file, sample_rate, fade_ms=FADE_MS):
+        self.file = sound_file
+        self.fade = int(sample_rate * fade_ms / 1000)
+        self._ramps = {}
+        self.tail = None
+        self.frames = 0
+
+    def _ramp(self, frames):
+        """Equal-power (fade_out, fade_in) over frames; shorter than fade_ms when a clip is"""
+        if frames not in self._ramps:
+            t = np.linspace(0.0, np.pi / 2, frames, dtype=np.float32)[:, None]
+            self._ramps[frames] = (np.cos(t), np.sin(t))
+        return self._ramps[frames]
+
+    def write(self, samples):
+        if not len(samples):
+            return
+        if self.tail is not None and len(self.tail):
+            # The end of the held tail fades into the start of the new clip
+            overlap = min(len(self.tail), len(samples))
+            split = len(self.tail) - overlap
+            fade_out, fade_in = self._ramp(overlap)
+            blended = self.tail[split:] * fade_out + samples[:overlap] * fade_in
+            self.file.write(np.concatenate([self.tail[:split], blended]))
+            self.frames += len(self.tail)
+            samples = samples[overlap:]
+        keep = min(self.fade, len(samples))
+        body, self.tail = samples[:len(samples) - keep], samples[len(samples) - keep:]
+        self.file.write(body)
+        self.frames += len(body)
+
+    def close(self):
+        if self.tail is not None and len(self.tail):
+            self.file.write(self.tail)
+            self.frames += len(self.tail)
+        self.tail = None
+
+
+def synthesize_chunk(text, path, provider, voice_id, api_key):
+    """Synthesize one chunk to a processed WAV part, retrying transient failures"""
+    for attempt in range(CHUNK_RETRIES):
+        try:
+            # Narration is batch work: interactive chat turns get the rate limit first
+            with rate_limit.priority(rate_limit.BATCH):
+                audio_data, audio_format = voice_pipeline.text_to_speech(text, provider, voice_id, api_key)
+            samples, sample_rate = audio_post.process_clip(audio_data, audio_format)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            sf.write(temp_path, samples, sample_rate, format="WAV", subtype="PCM_16")
+            os.replace(temp_path, path)
+            return path
+        except Exception as e:
+            if attempt == CHUNK_RETRIES - 1:
+                raise
+            delay = 2.0 ** attempt
+            logging.warning(f"Chunk failed ({str(e)}), retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+
+def narrate_text(text, output_path, provider="speechify", voice_id=None, api_key=None,
+                 workers=None, max_chars=None, markdown=False):
+    """Narrate long text into one audio file; re-running after a failure resumes from finished chunks"""
+    start = time.perf_counter()
+    workers = workers or config.get_settings().narration_workers
+    if markdown:
+        text = tts_text.strip_markdown(text)
+    chunks = split_text(text, max_chars or MAX_CHARS.get(provider, DEFAULT_MAX_CHARS))
+    parts_dir = f"{output_path}.parts"
+    os.makedirs(parts_dir, exist_ok=True)
+    paths = [os.path.join(parts_dir, f"{i:05d}.{chunk_key(chunk, provider, voice_id)}.wav")
+             for i, chunk in enumerate(chunks)]
+    todo = [i for i, path in enumerate(paths) if not os.path.exists(path)]
+    logging.info(f"{len(chunks)} chunks, {len(chunks) - len(todo)} already done")
+
+    with open(os.path.join(parts_dir, "manifest.json"), "w") as f:
+        json.dump({"output": output_path, "provider": provider, "voice_id": voice_id,
+                   "chunks": [os.path.basename(path) for path in paths]}, f, indent=2)
+
+    # Chunks are synthesized in parallel but written out strictly in order
+    failed = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {i: pool.submit(synthesize_chunk, chunks[i], paths[i], provider, voice_id, api_key) for i in todo}
+        temp_output = f"{output_path}.{os.getpid()}.tmp"
+        with sf.SoundFile(temp_output, "w", audio_post.TARGET_SAMPLE_RATE, 1,
+                          format="WAV", subtype="PCM_16") as output:
+            writer = CrossfadeWriter(output, audio_post.TARGET_SAMPLE_RATE)
+            for i, path in enumerate(paths):
+                try:
+                    if i in futures:
+                        futures[i].result()
+                except Exception as e:
+                    failed = (i, e)
+                    for future in futures.values():
+                        future.cancel()
+                    break
+                samples, _ = sf.read(path, dtype="float32", always_2d=True)
+                writer.write(samples)
+            writer.close()
+    if failed:
+        os.unlink(temp_output)
+        i, error = failed
+        raise RuntimeError(f"Chunk {i + 1}/{len(chunks)} failed: {error}; re-run to resume") from error
+    os.replace(temp_output, output_path)
+
+    elapsed = time.perf_counter() - start
+    synthesized = sum(len(chunks[i]) for i in todo)
+    report = {
+        "output": output_path,
+        "chunks": len(chunks),
+        "resumed_chunks": len(chunks) - len(todo),
+        "characters": sum(len(chunk) for chunk in chunks),
+        "seconds": round(elapsed, 2),
+        "chars_per_second": round(synthesized / elapsed, 1) if elapsed else 0.0,
+        "audio_seconds": round(writer.frames / audio_post.TARGET_SAMPLE_RATE, 1),
+    }
+    logging.info(f"Narrated {report['characters']} chars in {report['seconds']}s "
+                 f"({report['chars_per_second']} chars/s) -> {output_path}")
+    return report
+
+
+def narrate_file(input_path, output_path=None, **kwargs):
+    """Narrate a .txt or .md file (Markdown is stripped to plain text)"""
+    with open(input_path, encoding="utf-8") as f:
+        text = f.read()
+    output_path = output_path or os.path.join("media", "narration",
+                                              os.path.splitext(os.path.basename(input_path))[0] + ".wav")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    kwargs.setdefault("markdown", input_path.lower().endswith((".md", ".markdown")))
+    return narrate_text(text, output_path, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Narrate a text or Markdown document to one audio file")
+    parser.add_argument("file")
+    parser.add_argument("-o", "--output")
+    parser.add_argument("--provider", default="speechify", choices=["speechify", "elevenlabs"])
+    parser.add_argument("--voice-id")
+    parser.add_argument("--workers", type=int, help="Parallel TTS requests (default from config.py)")
+    parser.add_argument("--max-chars", type=int)
+    args = parser.parse_args()
+
+    report = narrate_file(args.file, args.output, provider=args.provider, voice_id=args.voice_id,
+                          api_key=config.get_settings().provider(args.provider).api_key,
+                          workers=args.workers, max_chars=args.max_chars)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,308 @@
+import argparse
+import logging
+import os
+import runpy
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import config
+
+# Frames of each allocation kept by tracemalloc; more frames cost more memory and time
+TRACE_FRAMES = 10
+TOP_ALLOCATORS = 25
+
+
+# One label per code object, built once: sampling then only walks frames and joins strings
+_labels = {}
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+def collapsed_stack(frame):
+    """'outer;...;inner' for a frame, the line format flamegraph.pl and speedscope read"""
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class _Sampler:
+    """One background thread sampling the stacks of every thread that an active Profile watches."""
+
+    def __init__(self):
+        self.profiles = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.interval = None
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.add(profile)
+            self.interval = min(p.interval for p in self.profiles)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+                self.thread.start()
+
+    def remove(self, profile):
+        with self.lock:
+            self.profiles.discard(profile)
+            if self.profiles:
+                self.interval = min(p.interval for p in self.profiles)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self.lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+                profiles = list(self.profiles)
+                interval = self.interval
+            start = time.perf_counter()
+            frames = sys._current_frames()
+            stacks = {}
+            for profile in profiles:
+                threads = frames.keys() if profile.threads is None else profile.threads
+                for ident in list(threads):
+                    frame = frames.get(ident)
+                    if frame is None or ident == own:
+                        continue
+                    if ident not in stacks:
+                        stacks[ident] = collapsed_stack(frame)
+                    profile.counts[stacks[ident]] += 1
+                profile.samples += 1
+            del frames
+            spent = time.perf_counter() - start
+            for profile in profiles:
+                profile.sampling_seconds += spent / len(profiles)
+            time.sleep(max(interval - spent, interval / 10))
+
+
+_sampler = _Sampler()
+_tracing = [0]
+_tracing_lock = threading.Lock()
+
+
+class Profile:
+    """CPU samples and/or allocation snapshots for a session, a voice turn or a script run.
+
+    CPU profiling samples the watched threads' stacks every `interval` seconds from one
+    shared background thread (no tracing hooks, so the profiled code runs at full speed)
+    and writes collapsed stacks (`.folded`, for flamegraph.pl or speedscope).
+    Memory profiling starts tracemalloc, which is process-wide and slows allocation-heavy
+    code noticeably, and writes the top allocators since start (`.memory.txt`).
+    By default only the calling thread is sampled; call attach() to add threads (e.g.
+    each Streamlit rerun) or pass threads="all".
+    """
+
+    def __init__(self, name, cpu=True, memory=False, interval=None, threads=None, output_dir=None):
+        settings = config.get_settings()
+        self.name = name
+        self.cpu = cpu
+        self.memory = memory
+        self.interval = (interval or settings.profile_interval_ms / 1000.0)
+        self.output_dir = output_dir or settings.profile_dir
+        self.threads = None if threads == "all" else set(threads or [threading.get_ident()])
+        self.counts = Counter()
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self.started = None
+        self.stopped = None
+        self.paths = {}
+        self._baseline = None
+
+    def attach(self, ident=None):
+        """Also sample this thread (the caller's by default)"""
+        if self.threads is not None:
+            self.threads.add(ident or threading.get_ident())
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.memory:
+            with _tracing_lock:
+                if _tracing[0] == 0 and not tracemalloc.is_tracing():
+                    tracemalloc.start(TRACE_FRAMES)
+                _tracing[0] += 1
+            self._baseline = tracemalloc.take_snapshot()
+        if self.cpu:
+            _sampler.add(self)
+        return self
+
+    def stop(self):
+        """Stop profiling and write the output files; returns their paths"""
+        self.stopped = time.perf_counter()
+        elapsed = self.stopped - self.started
+        if self.cpu:
+            _sampler.remove(self)
+        snapshot = None
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            with _tracing_lock:
+                _tracing[0] -= 1
+                if _tracing[0] == 0:
+                    tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.join(self.output_dir, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        if self.cpu:
+            self.paths["cpu"] = f"{stem}.folded"
+            with open(self.paths["cpu"], "w") as f:
+                for stack, count in self.counts.most_common():
+                    f.write(f"{stack} {count}\n")
+        if snapshot is not None:
+            self.paths["memory"] = f"{stem}.memory.txt"
+            self._write_memory(snapshot, current, peak)
+        logging.info(
+            f"Profile {self.name}: {elapsed:.1f}s, {self.samples} samples, "
+            f"sampler overhead {self.overhead:.2%} -> {', '.join(self.paths.values())}"
+        )
+        return self.paths
+
+    def _write_memory(self, snapshot, current, peak):
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        snapshot = snapshot.filter_traces(filters)
+        by_line = snapshot.compare_to(self._baseline.filter_traces(filters), "lineno")
+        by_trace = snapshot.compare_to(self._baseline.filter_traces(filters), "traceback")
+        with open(self.paths["memory"], "w") as f:
+            f.write(f"# {self.name}: traced {current / 1e6:.1f} MB now, peak {peak / 1e6:.1f} MB\n")
+            f.write(f"# Top {TOP_ALLOCATORS} lines by growth since start\n")
+            for stat in by_line[:TOP_ALLOCATORS]:
+                f.write(f"{stat}\n")
+            f.write("\n# Largest growth with call stacks\n")
+            for stat in by_trace[:5]:
+                f.write(f"{stat.size_diff / 1e3:+.1f} kB in {stat.count_diff:+d} blocks\n")
+                for line in stat.traceback.format():
+                    f.write(f"  {line}\n")
+
+    @property
+    def overhead(self):
+        """Share of one core spent by the sampler on this profile"""
+        if self.started is None:
+            return 0.0
+        elapsed = (self.stopped or time.perf_counter()) - self.started
+        return self.sampling_seconds / elapsed if elapsed else 0.0
+
+    def top(self, n=10):
+        """[(function, share of samples)] by self time"""
+        leaves = Counter()
+        for stack, count in self.counts.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(name, count / total) for name, count in leaves.most_common(n)]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class _Disabled:
+    paths = {}
+
+    def top(self, n=10):
+        return []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+def modes(value=None):
+    """(cpu, memory) from a mode string like "cpu", "memory" or "cpu,memory" (default: VOICE_PROFILE)"""
+    value = config.get_settings().profile_mode if value is None else value
+    parts = {part.strip().lower() for part in value.split(",")}
+    return "cpu" in parts, "memory" in parts
+
+
+def maybe_profile(name, mode=None, **kwargs):
+    """A started Profile when profiling is switched on (argument or VOICE_PROFILE), else a no-op context"""
+    cpu, memory = modes(mode)
+    if not (cpu or memory):
+        return _Disabled()
+    return Profile(name, cpu=cpu, memory=memory, **kwargs)
+
+
+def run_script(path, args, mode="cpu", interval=None):
+    """Run a Python script as __main__ under the profiler, like `python -m cProfile`"""
+    cpu, memory = modes(mode)
+    sys.argv = [path] + list(args)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    name = os.path.splitext(os.path.basename(path))[0]
+    with Profile(name, cpu=cpu, memory=memory, interval=interval, threads="all") as profile:
+        try:
+            runpy.run_path(path, run_name="__main__")
+        except SystemExit:
+            pass
+    return profile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Profile a script (profiling.py run narrate.py doc.md) or measure sampler overhead (bench)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run")
+    run.add_argument("--mode", default="cpu", help='"cpu", "memory" or "cpu,memory"')
+    run.add_argument("--interval-ms", type=float)
+    run.add_argument("script")
+    run.add_argument("args", nargs=argparse.REMAINDER)
+    bench = sub.add_parser("bench")
+    bench.add_argument("--seconds", type=float, default=1.5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "run":
+        interval = args.interval_ms / 1000.0 if args.interval_ms else None
+        profile = run_script(args.script, args.args, args.mode, interval)
+        for name, share in profile.top():
+            print(f"{share:6.1%}  {name}")
+    else:
+        import numpy as np
+
+        import audio_post
+
+        rng = np.random.default_rng(0)
+        clip = audio_post.encode_wav((0.1 * rng.standard_normal((48000 * 5, 1))).astype(np.float32), 48000)
+
+        def workload(seconds):
+            # Mixed numpy and pure-Python work, like a voice turn's post-processing
+            count = 0
+            end = time.perf_counter() + seconds
+            while time.perf_counter() < end:
+                audio_post.process_to_wav(clip)
+                sum(i * i for i in range(20000))
+                count += 1
+            return count
+
+        def compare(make_profile, rounds=3):
+            # Each profiled round runs next to an unprofiled one and the median ratio is
+            # kept: single runs vary by several percent on a busy machine
+            ratios = []
+            for _ in range(rounds):
+                baseline = workload(args.seconds)
+                with make_profile() as profile:
+                    ratios.append(workload(args.seconds) / baseline)
+            return 1 - float(np.median(ratios)), profile
+
+        output_dir = os.path.join("media", "profiles", "bench")
+        logging.getLogger().setLevel(logging.WARNING)
+        print(f"no profiling: {workload(args.seconds) / args.seconds:.1f} iterations/s")
+        for interval in (0.01, 0.005, 0.001):
+            slower, profile = compare(lambda: Profile("bench", interval=interval, output_dir=output_dir))
+            print(f"cpu, {1000 * interval:4.0f} ms interval  {slower:+6.1%} slower, "
+                  f"sampler {profile.overhead:.2%} of a core")
+        slower, profile = compare(lambda: Profile("bench", cpu=False, memory=True, output_dir=output_dir), 1)
+        print(f"memory (tracemalloc)  {slower:+6.1%} slower")
+        print(f"output: {profile.paths}")
@@ -0,0 +1,254 @@
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import hashlib
+import heapq
+import itertools
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+# Priority classes: lower value is served first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Client-side limits per provider: (requests per second, burst size), tuned in config.py
+RATE_LIMITS = {
+    name: (provider.rate, provider.burst) for name, provider in config.get_settings().providers.items()
+}
+DEFAULT_RATE_LIMIT = (2.0, 4)
+MAX_RETRIES = 3
+MAX_RETRY_AFTER = 60.0
+
+_current_priority = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+
+class TokenBucket:
+    """Token bucket that hands out tokens to waiting callers in priority order.
+
+    Callers block in acquire() until a token is available. Interactive callers are
+    always ahead of batch callers; callers of equal priority are served FIFO.
+    pause() stops all grants until a provider's Retry-After has elapsed.
+    """
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self.granted = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.max_queue_depth = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=INTERACTIVE, timeout=None):
+        """Block until a token is granted; raises TimeoutError after timeout seconds"""
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        with self._cond:
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == entry and now >= self.blocked_until and self.tokens >= 1:
+                        heapq.heappop(self._waiters)
+                        self.tokens -= 1
+                        self.granted += 1
+                        self.wait_time += now - start
+                        self._cond.notify_all()
+                        return
+                    if deadline is not None and now >= deadline:
+                        raise TimeoutError(f"Rate limiter '{self.name}' queue timeout")
+                    delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.001)
+                    if deadline is not None:
+                        delay = min(delay, deadline - now)
+                    self._cond.wait(delay)
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                raise
+
+    async def acquire_async(self, priority=INTERACTIVE, timeout=None):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.acquire, priority, timeout)
+
+    def pause(self, seconds):
+        """Stop granting tokens for the given number of seconds (e.g. from Retry-After)"""
+        with self._cond:
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiters:
+                depth[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "queue_depth": depth,
+                "max_queue_depth": self.max_queue_depth,
+                "granted": self.granted,
+                "throttled": self.throttled,
+                "avg_wait": self.wait_time / self.granted if self.granted else 0.0,
+                "paused_for": max(0.0, self.blocked_until - time.monotonic()),
+            }
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def key_id(api_key):
+    """Short, non-reversible label for an API key so metrics never contain secrets"""
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:8]
+
+
+def limiter(provider, api_key=None):
+    """Get the shared bucket for a provider and API key"""
+    name = f"{provider}:{key_id(api_key)}"
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            rate, burst = RATE_LIMITS.get(provider, DEFAULT_RATE_LIMIT)
+            bucket = _buckets[name] = TokenBucket(name, rate, burst)
+        return bucket
+
+
+@contextlib.contextmanager
+def priority(level):
+    """Run the enclosed provider calls at the given priority class"""
+    token = _current_priority.set(level)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority():
+    return _current_priority.get()
+
+
+def acquire(provider, api_key=None, timeout=None):
+    """Take one token for the provider at the current priority"""
+    limiter(provider, api_key).acquire(current_priority(), timeout)
+
+
+def parse_retry_after(value, default=1.0):
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return default
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            parsed = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return default
+        seconds = parsed.timestamp() - time.time()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def session(provider):
+    """Pooled HTTP session per provider, so calls reuse open TCP/TLS connections"""
+    with _sessions_lock:
+        if provider not in _sessions:
+            providers = config.get_settings().providers
+            pool_size = providers[provider].max_concurrency if provider in providers else 10
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            _sessions[provider] = session
+        return _sessions[provider]
+
+
+def warm(provider, url, timeout=5):
+    """Open a pooled connection to the provider ahead of the first real call (not rate limited)"""
+    try:
+        session(provider).head(url, timeout=timeout)
+    except requests.RequestException as e:
+        logging.debug(f"Warming {provider} connection failed: {str(e)}")
+
+
+def _retry_delay(status_code, headers, attempt):
+    """Seconds to pause a bucket after a throttled response, None if the response wasn't throttled"""
+    retry_after = headers.get("Retry-After") if headers is not None else None
+    if status_code == 429 or (status_code == 503 and retry_after):
+        return parse_retry_after(retry_after, default=2.0 ** attempt)
+    return None
+
+
+def request(provider, api_key, method, url, **kwargs):
+    """requests.request() behind the provider's rate limiter, on the provider's pooled session.
+
+    On 429 (and 503 with Retry-After) the whole bucket is paused for the advertised
+    delay and the call is retried up to MAX_RETRIES times. The last response is
+    returned either way, so callers keep their existing status-code handling.
+    """
+    bucket = limiter(provider, api_key)
+    level = current_priority()
+    for attempt in range(MAX_RETRIES + 1):
+        bucket.acquire(level)
+        response = session(provider).request(method, url, **kwargs)
+        delay = _retry_delay(response.status_code, response.headers, attempt)
+        if delay is not None:
+            logging.warning(f"{provider} returned {response.status_code}, retrying in {delay:.1f}s")
+            bucket.pause(delay)
+            continue
+        return response
+    return response
+
+
+def call(provider, api_key, func, *args, **kwargs):
+    """func(*args, **kwargs) behind the provider's rate limiter, for SDK clients that raise on errors.
+
+    An exception with a 429 (or 503 with Retry-After) status_code and a response, like
+    openai.RateLimitError, pauses the bucket and retries the call as request() does;
+    after MAX_RETRIES the exception is raised.
+    """
+    bucket = limiter(provider, api_key)
+    level = current_priority()
+    for attempt in range(MAX_RETRIES + 1):
+        bucket.acquire(level)
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            status_code = getattr(e, "status_code", None)
+            delay = _retry_delay(status_code, getattr(getattr(e, "response", None), "headers", None), attempt)
+            if delay is None or attempt == MAX_RETRIES:
+                raise
+            logging.warning(f"{provider} returned {status_code}, retrying in {delay:.1f}s")
+            bucket.pause(delay)
+
+
+def metrics():
+    """Snapshot of every bucket's counters and queue depth"""
+    with _buckets_lock:
+        buckets = list(_buckets.values())
+    return {bucket.name: bucket.stats() for bucket in buckets}
+
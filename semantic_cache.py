@@ -0,0 +1,377 @@
+import functools
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import config
+
+EMBEDDING_DIM = 1024
+# Weight of the previous user message in the query vector, so follow-ups like
+# "and tomorrow?" only match when they follow a similar question
+CONTEXT_WEIGHT = 0.35
+MAX_QUERY_CHARS = 500
+MIN_QUERY_CHARS = 4
+DEFAULT_THRESHOLD = 0.85
+DEFAULT_TTL = 24 * 3600.0
+DEFAULT_MAX_ENTRIES = 500
+MINILM_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Contractions and filler words that change the wording but not the question
+CONTRACTIONS = {
+    "what's": "what is", "whats": "what is", "who's": "who is", "where's": "where is", "how's": "how is",
+    "it's": "it is", "that's": "that is", "there's": "there is", "can't": "can not", "cannot": "can not",
+    "don't": "do not", "doesn't": "does not", "isn't": "is not", "i'm": "i am", "you're": "you are",
+}
+FILLER = {"um", "uh", "please", "hey", "so", "well", "like", "just", "actually", "could", "can", "you",
+          "tell", "me", "the", "a", "an"}
+WORD = re.compile(r"[a-z0-9']+")
+
+# Words that flip or pin down the answer; an embedding barely moves when they change, so a
+# cached answer is only served when the question has exactly the same ones
+NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+NUMBER_WORDS = {
+    "zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve",
+    "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen", "twenty", "thirty",
+    "forty", "fifty", "sixty", "seventy", "eighty", "ninety", "hundred", "thousand", "million", "billion",
+    "half", "quarter", "first", "second", "third", "last", "next",
+}
+NEGATIONS = {"not", "no", "never", "none", "nothing", "nobody", "nowhere", "neither", "nor", "without"}
+ENTITY = re.compile(r"\b[A-Z][A-Za-z0-9'.-]*")
+# Capitalized only because they start a sentence
+SENTENCE_STARTERS = {
+    "what", "what's", "whats", "how", "how's", "who", "who's", "where", "where's", "when", "why", "which", "is",
+    "are", "was", "were", "do", "does", "did", "can", "could", "will", "would", "should", "shall", "may", "might",
+    "tell", "please", "give", "show", "convert", "explain", "i", "i'm", "it", "it's", "the", "a", "an", "hey",
+    "hi", "hello", "so", "and", "but", "also", "ok", "okay", "um", "uh", "well", "now", "then", "let's", "there",
+    "there's", "that", "that's", "this", "my", "your", "any", "find", "set", "play", "remind", "describe",
+    "isn't", "aren't", "wasn't", "don't", "doesn't", "didn't", "can't", "won't", "wouldn't", "shouldn't",
+    "couldn't",
+}
+
+
+def normalize_query(text):
+    words = [CONTRACTIONS.get(word, word) for word in WORD.findall(text.lower()[:MAX_QUERY_CHARS])]
+    return [word for word in " ".join(words).split() if word not in FILLER]
+
+
+def key_terms(text):
+    """Numbers, negations and named entities of a question, which a cache hit must match exactly"""
+    text = text[:MAX_QUERY_CHARS]
+    words = " ".join(CONTRACTIONS.get(word, word) for word in WORD.findall(text.lower())).split()
+    terms = {f"#{number.replace(',', '')}" for number in NUMBER.findall(text)}
+    terms |= {f"#{word}" for word in words if word in NUMBER_WORDS}
+    terms |= {"not" for word in words if word in NEGATIONS or word.endswith("n't")}
+    terms |= {f"@{name.lower().rstrip('.')}" for name in ENTITY.findall(text)
+              if name.lower() not in SENTENCE_STARTERS}
+    return frozenset(terms)
+
+
+def _features(words):
+    """Word unigrams and bigrams plus character trigrams of each word (for typos and inflections)"""
+    features = [f"w:{word}" for word in words]
+    features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return features
+
+
+def hashing_embedding(text, dim=EMBEDDING_DIM):
+    """L2-normalized hashed bag of features; deterministic, no model download, ~20 us per query"""
+    hashes = np.fromiter((zlib.crc32(f.encode()) for f in _features(normalize_query(text))), dtype=np.uint32)
+    vector = np.zeros(dim, dtype=np.float32)
+    # One hash bit picks the sign so collisions cancel out instead of piling up
+    np.add.at(vector, (hashes >> 1) % dim, np.where(hashes & 1, 1.0, -1.0).astype(np.float32))
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+@functools.lru_cache(maxsize=1)
+def minilm_model():
+    # Downloads the weights on first use; needs transformers
+    from transformers import AutoModel, AutoTokenizer
+    return AutoTokenizer.from_pretrained(MINILM_MODEL), AutoModel.from_pretrained(MINILM_MODEL).eval()
+
+
+def minilm_embedding(text):
+    """Sentence embedding from MiniLM on CPU (mean-pooled, L2-normalized); catches paraphrases"""
+    import torch
+    tokenizer, model = minilm_model()
+    inputs = tokenizer(text[:MAX_QUERY_CHARS], return_tensors="pt", truncation=True)
+    with torch.inference_mode():
+        tokens = model(**inputs).last_hidden_state[0]
+    vector = tokens.mean(dim=0).numpy().astype(np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-8)
+
+
+EMBEDDINGS = {"hashing": hashing_embedding, "minilm": minilm_embedding}
+
+
+def query_text(messages):
+    """(current question, previous user message) from a chat history"""
+    user = [m["content"] for m in messages if m["role"] == "user"]
+    return (user[-1] if user else ""), (user[-2] if len(user) > 1 else "")
+
+
+class CachedAnswer:
+    def __init__(self, slot, text, similarity):
+        self.slot = slot
+        self.text = text
+        self.similarity = similarity
+
+
+class SemanticCache:
+    """Answers to earlier questions, found by embedding similarity instead of exact text.
+
+    Query vectors live in one float32 matrix of unit vectors, so a lookup is a single
+    matrix-vector product masked by scope and expiry. A match above the threshold is
+    only served when its numbers, negations and named entities equal the question's
+    ("2 plus 3" never gets the answer to "2 plus 2"). Each entry keeps the answer text
+    and the audio already synthesized for it, per voice. Entries expire after `ttl`
+    seconds; when full, the least recently used entry is replaced. A disabled cache
+    misses every lookup and stores nothing.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 embedding="hashing", enabled=True):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed = EMBEDDINGS[embedding]
+        self._matrix = None
+        self._live = np.zeros(max_entries, dtype=bool)
+        self._created = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._scopes = np.full(max_entries, -1, dtype=np.int64)
+        self._scope_ids = {None: 0}
+        self._answers = [None] * max_entries
+        self._keys = [None] * max_entries
+        self._audio = [None] * max_entries
+        self._cost = np.zeros(max_entries)  # seconds of chat a hit avoids
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.audio_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.seconds_saved = 0.0
+        self.lookup_seconds = 0.0
+
+    def vector(self, messages):
+        question, previous = query_text(messages)
+        vector = self.embed(question)
+        if previous:
+            vector = vector + CONTEXT_WEIGHT * self.embed(previous)
+            vector /= max(float(np.linalg.norm(vector)), 1e-8)
+        return vector
+
+    def _scope_id(self, scope):
+        return self._scope_ids.setdefault(scope, len(self._scope_ids))
+
+    def _valid(self, now, scope):
+        valid = self._live & (now - self._created <= self.ttl)
+        if scope is not None:
+            valid &= self._scopes == self._scope_id(scope)
+        return valid
+
+    def lookup(self, messages, scope=None):
+        """Cached answer for the last user message, or None; `scope` limits matches to one conversation"""
+        start = time.perf_counter()
+        question, _ = query_text(messages)
+        if not self.enabled or len(question.strip()) < MIN_QUERY_CHARS:
+            return None
+        vector = self.vector(messages)
+        keys = key_terms(question)
+        with self._lock:
+            now = time.time()
+            hit = None
+            if self._matrix is not None:
+                valid = self._valid(now, scope)
+                if valid.any():
+                    scores = np.where(valid, self._matrix @ vector, -1.0)
+                    candidates = np.flatnonzero(scores >= self.threshold)
+                    for slot in candidates[np.argsort(-scores[candidates])]:
+                        if self._keys[slot] == keys:
+                            slot = int(slot)
+                            self._last_used[slot] = now
+                            self.seconds_saved += self._cost[slot]
+                            hit = CachedAnswer(slot, self._answers[slot], float(scores[slot]))
+                            break
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.lookup_seconds += time.perf_counter() - start
+        return hit
+
+    def store(self, messages, answer, scope=None, seconds=0.0):
+        """Remember the answer to the last user message; returns its slot for attach_audio()"""
+        question, _ = query_text(messages)
+        if not self.enabled or len(question.strip()) < MIN_QUERY_CHARS or not answer:
+            return None
+        vector = self.vector(messages)
+        with self._lock:
+            now = time.time()
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, vector.size), dtype=np.float32)
+            expired = self._live & (now - self._created > self.ttl)
+            self._live &= ~expired
+            free = np.flatnonzero(~self._live)
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            self._matrix[slot] = vector
+            self._live[slot] = True
+            self._created[slot] = self._last_used[slot] = now
+            self._scopes[slot] = self._scope_id(scope)
+            self._answers[slot] = answer
+            self._keys[slot] = key_terms(question)
+            self._audio[slot] = {}
+            self._cost[slot] = seconds
+        return slot
+
+    def attach_audio(self, slot, voice, audio_data, audio_format, seconds=0.0):
+        """Keep the synthesized audio of an answer for `voice` (e.g. (provider, voice_id, postprocess))"""
+        if slot is None or audio_data is None:
+            return
+        with self._lock:
+            if self._live[slot]:
+                self._audio[slot][voice] = (audio_data, audio_format, seconds)
+
+    def audio(self, hit, voice):
+        """(audio_data, audio_format) stored with a hit for this voice, or (None, None)"""
+        with self._lock:
+            if self._answers[hit.slot] is not hit.text:
+                # The slot was reused since the lookup
+                return None, None
+            audio = self._audio[hit.slot].get(voice)
+            if audio is None:
+                return None, None
+            self.audio_hits += 1
+            self.seconds_saved += audio[2]
+            return audio[0], audio[1]
+
+    def answer(self, messages, chat_func, scope=None):
+        """(reply, slot, hit) for the conversation, calling chat_func(messages) on a miss"""
+        hit = self.lookup(messages, scope)
+        if hit:
+            return hit.text, hit.slot, hit
+        start = time.perf_counter()
+        reply = chat_func(messages)
+        return reply, self.store(messages, reply, scope, time.perf_counter() - start), None
+
+    def clear(self, scope=None):
+        """Drop every entry, or only those of one conversation"""
+        with self._lock:
+            if scope is None:
+                self._live[:] = False
+            else:
+                self._live &= self._scopes != self._scope_id(scope)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int(self._live.sum()),
+                "hits": self.hits,
+                "audio_hits": self.audio_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "seconds_saved": round(self.seconds_saved, 2),
+                "lookup_ms": round(1000 * self.lookup_seconds / lookups, 3) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide answer cache; entries are scoped per conversation unless configured otherwise"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            settings = config.get_settings()
+            _cache = SemanticCache(settings.semantic_cache_threshold, settings.semantic_cache_ttl,
+                                   settings.semantic_cache_size, settings.semantic_cache_embedding,
+                                   settings.semantic_cache_enabled)
+        return _cache
+
+
+def scope_for(conversation_id):
+    """Cache scope for a conversation: itself, or None when answers are shared across conversations"""
+    return None if config.get_settings().semantic_cache_shared else conversation_id
+
+
+def stats():
+    return get_cache().stats()
+
+
+# Hit rate, similarity separation and latency saved on paraphrased questions (fake providers)
+if __name__ == "__main__":
+    import json
+    import os
+
+    os.environ.setdefault("VOICE_PROVIDERS", "fake")
+    os.environ.setdefault("FAKE_PROVIDER_LATENCY", "0.4")
+    config.get_settings.cache_clear()
+
+    import voice_pipeline
+
+    paraphrases = [
+        ("What's the weather like today?", "What is the weather like today", "whats the weather today"),
+        ("How do I reset my password?", "How can I reset my password", "how do i reset the password please"),
+        ("What time does the store open?", "when does the store open", "What time does the shop open?"),
+        ("Tell me a joke", "tell me a joke please", "can you tell me a joke"),
+    ]
+    different = ["What's the weather like tomorrow in Paris?", "How do I change my username?",
+                 "What time does the store close?", "Tell me a story", "Who won the game last night?"]
+
+    cache = SemanticCache()
+    same = [float(cache.embed(a) @ cache.embed(b)) for group in paraphrases for a in group for b in group if a < b]
+    other = [float(cache.embed(group[0]) @ cache.embed(text)) for group in paraphrases for text in different]
+    print(f"similarity: paraphrases min {min(same):.2f} mean {np.mean(same):.2f}, "
+          f"different questions max {max(other):.2f} mean {np.mean(other):.2f} (threshold {cache.threshold})")
+
+    def turn(text, conversation):
+        messages = [{"role": "user", "content": text}]
+        start = time.perf_counter()
+        reply, slot, hit = cache.answer(messages, voice_pipeline.chat_reply, scope=conversation)
+        audio_data, audio_format = cache.audio(hit, "speechify") if hit else (None, None)
+        if audio_data is None:
+            tts_start = time.perf_counter()
+            audio_data, audio_format = voice_pipeline.text_to_speech(reply)
+            cache.attach_audio(slot, "speechify", audio_data, audio_format, time.perf_counter() - tts_start)
+        return time.perf_counter() - start, hit is not None
+
+    timings = {True: [], False: []}
+    for group in paraphrases:
+        for text in group:
+            seconds, hit = turn(text, "conversation-1")
+            timings[hit].append(seconds)
+    for text in different:
+        seconds, hit = turn(text, "conversation-1")
+        timings[hit].append(seconds)
+    # Scoped per conversation: the same question in another conversation misses
+    _, scoped_hit = turn(paraphrases[0][0], "conversation-2")
+
+    report = cache.stats()
+    report["miss_turn_seconds"] = round(float(np.mean(timings[False])), 3)
+    report["hit_turn_seconds"] = round(float(np.mean(timings[True])), 3) if timings[True] else None
+    report["other_conversation_hit"] = scoped_hit
+    print(json.dumps(report, indent=2))
+
+    # Lookup cost with a full cache
+    big = SemanticCache(max_entries=20000)
+    for i in range(20000):
+        big.store([{"role": "user", "content": f"question number {i} about topic {i % 97}"}], "answer", scope="c")
+    start = time.perf_counter()
+    for i in range(200):
+        big.lookup([{"role": "user", "content": f"question about topic {i}"}], scope="c")
+    print(f"lookup with 20000 entries: {1000 * (time.perf_counter() - start) / 200:.2f} ms")
@@ -0,0 +1,420 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web, WSMsgType
+
+import audio_encode
+import browser_capture
+import chat_router
+import config
+import local_inference
+import model_registry
+import rate_limit
+import semantic_cache
+import single_flight
+import transcription_cache
+import voice_pipeline
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(process)d - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+MAX_AUDIO_BYTES = 25 * 1024 * 1024  # Whisper upload limit
+# Clips whose delivery was counted in audio_encode.stats(); the oldest names are forgotten first
+MAX_COUNTED_CLIPS = 4096
+AUDIO_CONTENT_TYPES = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "ogg": "audio/ogg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+}
+
+
+async def run_blocking(request, func, *args):
+    """Run a blocking provider call on the worker thread pool"""
+    loop = asyncio.get_running_loop()
+    # In the caller's context, so a rate_limit.priority() around the await still applies
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(request.app["executor"], context.run, func, *args)
+
+
+def transcribe_bytes(audio_bytes, suffix=".wav"):
+    """Write uploaded audio to a temporary file and transcribe it"""
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    try:
+        temp_file.write(audio_bytes)
+        temp_file.close()
+        return voice_pipeline.transcribe_audio(temp_file.name)
+    finally:
+        if os.path.exists(temp_file.name):
+            os.unlink(temp_file.name)
+
+
+def transcribe_capture(capture):
+    """Transcribe an utterance streamed in chunks (browser_capture.CaptureStream)"""
+    return transcribe_bytes(*capture.audio())
+
+
+def error_response(status, message):
+    return web.json_response({"error": message}, status=status)
+
+
+@web.middleware
+async def limit_concurrency(request, handler):
+    """Backpressure: reject work instead of queueing it without bound"""
+    if request.path in ("/health", "/metrics"):
+        return await handler(request)
+    semaphore = request.app["slots"]
+    if semaphore.locked():
+        return error_response(503, "Server busy, retry later")
+    async with semaphore:
+        try:
+            return await handler(request)
+        except voice_pipeline.ProviderError as e:
+            logging.error(str(e))
+            status = 429 if e.status_code == 429 else 502
+            return error_response(status, str(e))
+
+
+async def health(request):
+    return web.json_response({"status": "ok", "pid": os.getpid()})
+
+
+async def metrics(request):
+    return web.json_response({
+        "single_flight": single_flight.metrics(),
+        "rate_limit": rate_limit.metrics(),
+        "audio_delivery": audio_encode.stats(),
+        "transcription_cache": transcription_cache.stats(),
+        "chat_router": chat_router.get_router().snapshot(),
+        "semantic_cache": semantic_cache.stats(),
+        "local_inference": local_inference.stats(),
+        "model_registry": model_registry.stats(),
+    })
+
+
+async def transcribe(request):
+    """POST raw audio bytes, returns {"text": ...}"""
+    audio_bytes = await request.read()
+    if not audio_bytes:
+        return error_response(400, "Empty audio body")
+    suffix = "." + request.query.get("format", "wav")
+    text = await run_blocking(request, transcribe_bytes, audio_bytes, suffix)
+    return web.json_response({"text": text})
+
+
+async def chat(request):
+    """POST {"messages": [...], "budget": seconds, "conversation_id": ...}, returns {"reply": ...}"""
+    try:
+        body = await request.json()
+        messages = body["messages"]
+    except (ValueError, KeyError):
+        return error_response(400, "Expected JSON body with a 'messages' list")
+    # Optional "model" pins the OpenAI model; "budget" overrides the router's default
+    model, budget = body.get("model"), body.get("budget")
+    conversation_id = body.get("conversation_id")
+    if conversation_id or config.get_settings().semantic_cache_shared:
+        # Repeated questions are answered from the semantic cache
+        reply, _, _ = await run_blocking(request, semantic_cache.get_cache().answer, messages,
+                                         lambda m: voice_pipeline.chat_reply(m, model, budget),
+                                         semantic_cache.scope_for(conversation_id))
+    else:
+        reply = await run_blocking(request, voice_pipeline.chat_reply, messages, model, budget)
+    return web.json_response({"reply": reply})
+
+
+async def tts(request):
+    """POST {"text": ..., "provider": ..., "voice_id": ..., "postprocess": bool}, returns audio bytes
+
+    With "delivery": "url" the clip is stored and {"url": "/audio/..."} is returned
+    instead; fetching that URL transcodes it for the requesting client. Provider API
+    keys come from the server's environment (config.py), never from the request.
+    """
+    try:
+        body = await request.json()
+        text = body["text"]
+    except (ValueError, KeyError):
+        return error_response(400, "Expected JSON body with a 'text' field")
+    audio_data, audio_format = await run_blocking(
+        request,
+        voice_pipeline.text_to_speech,
+        text,
+        body.get("provider", "speechify"),
+        body.get("voice_id"),
+        None,
+        bool(body.get("postprocess", False)),
+    )
+    if body.get("delivery") == "url":
+        path = await run_blocking(request, audio_encode.store_clip, audio_data, audio_format, request.app["audio_dir"])
+        return web.json_response({"url": f"/audio/{os.path.basename(path)}"})
+    content_type = AUDIO_CONTENT_TYPES.get(audio_format, "application/octet-stream")
+    return web.Response(body=audio_data, content_type=content_type)
+
+
+async def audio(request):
+    """GET a stored clip, transcoded to a format and bitrate chosen for the client"""
+    name = os.path.basename(request.match_info["name"])
+    source = os.path.join(request.app["audio_dir"], name)
+    if not os.path.isfile(source):
+        return error_response(404, "Unknown clip")
+    target_format, bitrate = audio_encode.choose_format_from_headers(request.headers, request.query.get("format"))
+    path = await run_blocking(request, audio_encode.encode_cached, source, target_format, bitrate)
+    # One turn per stored clip: cached re-fetches and range requests are not new turns
+    counted = request.app["counted_clips"]
+    if name not in counted:
+        counted[name] = True
+        if len(counted) > MAX_COUNTED_CLIPS:
+            counted.popitem(last=False)
+        audio_encode.record_turn(os.path.getsize(path))
+    return web.FileResponse(path, headers={
+        "Content-Type": audio_encode.FORMATS[target_format]["mime"],
+        "Cache-Control": "public, max-age=86400, immutable",
+        "Vary": "User-Agent, Accept, Downlink, ECT, Save-Data",
+    })
+
+
+async def receive_captures(ws, captures):
+    """Read streamed utterances from a WebSocket and put each finished one on `captures`.
+
+    An utterance may start with {"type": "start", "format": ..., "sample_rate": ...}
+    (without it, the binary frames are the bytes of one audio file), continues with
+    binary chunks and ends with {"type": "end"}. Raw "pcm16" utterances also end on
+    their own once the speaker stops; the client is told with {"type": "endpoint"}.
+    Returns when the client closes the socket or sends {"type": "close"}.
+    """
+    capture = None
+    async for msg in ws:
+        if msg.type == WSMsgType.BINARY:
+            if capture is None:
+                capture = browser_capture.CaptureStream()
+            if capture.ended:
+                continue
+            if capture.size + len(msg.data) > MAX_AUDIO_BYTES:
+                await ws.send_json({"type": "error", "message": "Turn audio too large"})
+                # Drop the rest of this utterance up to its "end"
+                capture.ended = True
+                continue
+            if capture.add(msg.data):
+                await ws.send_json({"type": "endpoint"})
+                await captures.put(capture)
+        elif msg.type == WSMsgType.TEXT:
+            try:
+                control = json.loads(msg.data)
+            except ValueError:
+                await ws.send_json({"type": "error", "message": "Invalid control message"})
+                continue
+            if control.get("type") == "start":
+                try:
+                    capture = browser_capture.CaptureStream.from_control(control)
+                except (ValueError, TypeError) as e:
+                    await ws.send_json({"type": "error", "message": str(e)})
+                    capture = None
+            elif control.get("type") == "end":
+                if capture is not None and not capture.ended and capture.size:
+                    capture.ended = True
+                    await captures.put(capture)
+                capture = None
+            elif control.get("type") == "close":
+                break
+        elif msg.type == WSMsgType.ERROR:
+            logging.error(f"WebSocket error: {ws.exception()}")
+            break
+
+
+async def serve_captures(request, ws, handle):
+    """Run handle(capture) for each streamed utterance, one at a time, until the client leaves.
+
+    A full queue stops reading from the socket, which lets TCP flow control push back
+    on the client. A failed turn is reported to the client and the next one is served;
+    once the client disconnects, turns still queued are abandoned.
+    """
+    captures = asyncio.Queue(maxsize=request.app["turn_queue_size"])
+
+    async def process():
+        while True:
+            capture = await captures.get()
+            if capture is None:
+                return
+            try:
+                await handle(capture)
+            except voice_pipeline.ProviderError as e:
+                logging.error(str(e))
+                message = str(e)
+            except Exception as e:
+                logging.exception(f"Voice turn failed: {str(e)}")
+                message = "Turn failed"
+            else:
+                continue
+            if not ws.closed:
+                await ws.send_json({"type": "error", "message": message})
+
+    worker = asyncio.create_task(process())
+    try:
+        await receive_captures(ws, captures)
+        if not ws.closed:
+            # {"type": "close"}: answer the utterances already received first
+            await captures.put(None)
+            await worker
+    finally:
+        worker.cancel()
+        await ws.close()
+
+
+async def voice_socket(request):
+    """Stream voice turns over a WebSocket.
+
+    The client streams each turn's audio as described in receive_captures. The server
+    answers with {"type": "transcript"}, {"type": "reply"} and then the reply audio
+    as one binary frame. Chat history is kept for the socket's lifetime.
+    """
+    ws = web.WebSocketResponse(max_msg_size=MAX_AUDIO_BYTES, heartbeat=30)
+    await ws.prepare(request)
+
+    messages = []
+    provider = request.query.get("provider", "speechify")
+    voice_id = request.query.get("voice_id")
+    postprocess = request.query.get("postprocess") == "1"
+    # Repeated questions on this connection are answered from the semantic cache, audio included
+    answers = semantic_cache.get_cache()
+    scope = semantic_cache.scope_for(uuid.uuid4().hex)
+    voice = (provider, voice_id, postprocess)
+
+    async def turn(capture):
+        transcript = await run_blocking(request, transcribe_capture, capture)
+        await ws.send_json({"type": "transcript", "text": transcript})
+        messages.append({"role": "user", "content": transcript})
+        reply, slot, hit = await run_blocking(request, answers.answer, list(messages),
+                                              voice_pipeline.chat_reply, scope)
+        messages.append({"role": "assistant", "content": reply})
+        await ws.send_json({"type": "reply", "text": reply})
+        audio_data, audio_format = answers.audio(hit, voice) if hit else (None, None)
+        if audio_data is None:
+            start = time.perf_counter()
+            audio_data, audio_format = await run_blocking(
+                request, voice_pipeline.text_to_speech, reply, provider, voice_id, None, postprocess
+            )
+            answers.attach_audio(slot, voice, audio_data, audio_format, time.perf_counter() - start)
+        await ws.send_json({"type": "audio", "format": audio_format, "bytes": len(audio_data)})
+        await ws.send_bytes(audio_data)
+
+    await serve_captures(request, ws, turn)
+    return ws
+
+
+async def transcribe_socket(request):
+    """Transcribe utterances streamed from the browser recorder (browser_capture.recorder).
+
+    The client streams each utterance as described in receive_captures and gets
+    {"type": "transcript", "text": ..., "audio_seconds": ..., "latency_seconds": ...}
+    back, latency counted from the last chunk received.
+    """
+    ws = web.WebSocketResponse(max_msg_size=MAX_AUDIO_BYTES, heartbeat=30)
+    await ws.prepare(request)
+
+    async def utterance(capture):
+        text = await run_blocking(request, transcribe_capture, capture)
+        await ws.send_json({
+            "type": "transcript",
+            "text": text,
+            "audio_seconds": capture.seconds,
+            "latency_seconds": round(time.perf_counter() - capture.last_chunk, 3),
+        })
+
+    await serve_captures(request, ws, utterance)
+    return ws
+
+
+def create_app(max_sessions=64, threads=32, turn_queue_size=2, audio_dir=os.path.join("media", "audio")):
+    """Build the aiohttp application for one worker process"""
+    app = web.Application(middlewares=[limit_concurrency], client_max_size=MAX_AUDIO_BYTES)
+    app["slots"] = asyncio.Semaphore(max_sessions)
+    app["executor"] = ThreadPoolExecutor(max_workers=threads)
+    app["turn_queue_size"] = turn_queue_size
+    app["audio_dir"] = audio_dir
+    app["counted_clips"] = OrderedDict()
+    os.makedirs(audio_dir, exist_ok=True)
+
+    async def shutdown_executor(app):
+        app["executor"].shutdown(wait=False, cancel_futures=True)
+
+    app.on_cleanup.append(shutdown_executor)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/transcribe", transcribe)
+    app.router.add_post("/chat", chat)
+    app.router.add_post("/tts", tts)
+    app.router.add_get("/audio/{name}", audio)
+    app.router.add_get("/ws", voice_socket)
+    app.router.add_get("/ws/transcribe", transcribe_socket)
+    return app
+
+
+def run_worker(sock, args):
+    """Serve on a socket shared with the other worker processes"""
+    if args.fake:
+        voice_pipeline.USE_FAKE_PROVIDERS = True
+        # The chat router reads the setting when it is first built
+        os.environ["VOICE_PROVIDERS"] = "fake"
+        config.get_settings.cache_clear()
+    app = create_app(args.max_sessions, args.threads, args.turn_queue_size, args.audio_dir)
+    web.run_app(app, sock=sock, print=None, handle_signals=True)
+
+
+def main():
+    settings = config.get_settings()
+    parser = argparse.ArgumentParser(description="Headless HTTP/WebSocket voice API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--threads", type=int, default=settings.server_threads, help="Blocking provider calls per worker")
+    parser.add_argument("--max-sessions", type=int, default=settings.server_max_sessions,
+                        help="Concurrent requests/sessions per worker")
+    parser.add_argument("--turn-queue-size", type=int, default=2, help="Pending voice turns per WebSocket")
+    parser.add_argument("--audio-dir", default=os.path.join("media", "audio"), help="Where /tts stores clips served by URL")
+    parser.add_argument("--fake", action="store_true", help="Use local stand-ins instead of the external providers")
+    args = parser.parse_args()
+
+    # Bind once in the parent; every worker accepts on the same listening socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    logging.info(f"Listening on {args.host}:{args.port} with {args.workers} worker(s)")
+
+    if args.workers == 1:
+        run_worker(sock, args)
+        return
+
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(sock, args), daemon=True)
+        for _ in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        logging.info("Shutting down workers")
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    main()
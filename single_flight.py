@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import config
+
+# Every SingleFlight group registers itself here so metrics() can report on all of them
+GROUPS = {}
+# Reentrant: group() holds it while SingleFlight.__init__ registers the new group
+_registry_lock = threading.RLock()
+_executor = ThreadPoolExecutor(max_workers=config.get_settings().single_flight_workers,
+                               thread_name_prefix="single-flight")
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one in-flight execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    still running wait for the same result (or exception) instead of issuing their
+    own request. Nothing is cached once the call finishes. Works from plain threads
+    (do) and from asyncio tasks (do_async), and both can share one call.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.requests = 0
+        self.executions = 0
+        self.deduplicated = 0
+        with _registry_lock:
+            GROUPS[name] = self
+
+    def _join(self, key):
+        """Return (future, is_leader) for the key, registering a new call if none is running"""
+        with self._lock:
+            self.requests += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self.deduplicated += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.executions += 1
+            return future, True
+
+    def _run(self, key, future, func, args, kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+        else:
+            self._finish(key)
+            future.set_result(result)
+
+    def _finish(self, key):
+        # Forget the key before publishing the result so later callers start a fresh call
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def do(self, key, func, *args, **kwargs):
+        """Call func(*args, **kwargs) unless an identical call is already in flight"""
+        future, is_leader = self._join(key)
+        if is_leader:
+            self._run(key, future, func, args, kwargs)
+        return future.result()
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """Asyncio variant of do(); the blocking func runs on a worker thread"""
+        future, is_leader = self._join(key)
+        if is_leader:
+            # In the leader's context, so its rate_limit.priority() applies on the worker thread
+            _executor.submit(contextvars.copy_context().run, self._run, key, future, func, args, kwargs)
+        return await asyncio.wrap_future(future)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "executions": self.executions,
+                "deduplicated": self.deduplicated,
+                "in_flight": len(self._calls),
+            }
+
+
+def group(name):
+    """Get or create the SingleFlight group with the given name"""
+    with _registry_lock:
+        existing = GROUPS.get(name)
+        return existing if existing is not None else SingleFlight(name)
+
+
+def make_key(func, args, kwargs):
+    return (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+
+
+def coalesce(name=None):
+    """Decorator that routes calls through a SingleFlight group keyed by the arguments"""
+    def decorator(func):
+        flight = group(name or func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return flight.do(make_key(func, args, kwargs), func, *args, **kwargs)
+
+        async def call_async(*args, **kwargs):
+            return await flight.do_async(make_key(func, args, kwargs), func, *args, **kwargs)
+
+        wrapper.call_async = call_async
+        wrapper.flight = flight
+        return wrapper
+    return decorator
+
+
+def metrics():
+    """Snapshot of the counters of every group"""
+    with _registry_lock:
+        groups = list(GROUPS.values())
+    return {flight.name: flight.stats() for flight in groups}
+
@@ -0,0 +1,268 @@
+import itertools
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import audio_post
+import config
+import voice_pipeline
+
+# Phrases spoken often enough to synthesize ahead of time for each voice
+STOCK_PHRASES = [
+    "Hello! How can I help you today?",
+    "Sorry, I didn't catch that. Could you say it again?",
+    "Sorry, something went wrong. Please try again.",
+    "One moment please.",
+]
+SORRY_PHRASE = STOCK_PHRASES[1]
+ERROR_PHRASE = STOCK_PHRASES[2]
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+MIN_SPECULATIVE_CHARS = 12
+# Sessions whose current turn is remembered; the least recently active are forgotten
+MAX_SESSIONS = 1024
+
+
+def split_sentences(text):
+    return [sentence for sentence in SENTENCE_END.split(text.strip()) if sentence]
+
+
+class SpeculativeSynthesizer:
+    """Synthesize likely next utterances before they are needed.
+
+    Stock phrases are synthesized once and kept; sentences of a streamed answer are
+    synthesized as soon as they are complete, while the rest is still being generated.
+    Speculative jobs only start when a TTS worker is idle. Each session passes its own
+    token; new_turn(token) cancels or discards that session's jobs from its earlier
+    turn, while other sessions' jobs (and the same sentence wanted by another session)
+    carry on.
+    """
+
+    def __init__(self, synthesize=voice_pipeline.text_to_speech, max_workers=2, max_entries=256):
+        self.synthesize = synthesize
+        self.max_workers = max_workers
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative-tts")
+        self._lock = threading.Lock()
+        self._active = 0
+        self._cache = OrderedDict()  # key -> (audio_data, audio_format)
+        self._stock = set()
+        self._pending = {}  # key -> (future, owners); owners: {token: turn} or None for stock phrases
+        self._turns = OrderedDict()  # token -> id of the session's current turn
+        self._turn_ids = itertools.count(1)
+        self.stats = {"hits": 0, "pending_hits": 0, "misses": 0, "speculated": 0,
+                      "dropped": 0, "skipped_busy": 0, "stitched": 0, "failed": 0}
+
+    @staticmethod
+    def key(text, provider, voice_id, postprocess):
+        return (provider, voice_id, bool(postprocess), " ".join(text.split()))
+
+    def _remember(self, key, result, stock):
+        self._cache[key] = result
+        self._cache.move_to_end(key)
+        if stock:
+            self._stock.add(key)
+        # Evict the oldest non-stock entries
+        for old_key in list(self._cache):
+            if len(self._cache) <= self.max_entries:
+                break
+            if old_key not in self._stock:
+                del self._cache[old_key]
+
+    def _stale(self, owners):
+        """True when every session that wanted a job has moved on to a later turn"""
+        return owners is not None and all(self._turns.get(token) != turn for token, turn in owners.items())
+
+    def _run(self, key, text, provider, voice_id, api_key, postprocess):
+        with self._lock:
+            if self._stale(self._pending[key][1]):
+                self.stats["dropped"] += 1
+                del self._pending[key]
+                return None
+            self._active += 1
+        try:
+            result = self.synthesize(text, provider, voice_id, api_key, postprocess)
+        except Exception as e:
+            logging.warning(f"Speculative synthesis failed: {str(e)}")
+            with self._lock:
+                self.stats["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._active -= 1
+                owners = self._pending.pop(key)[1]
+        with self._lock:
+            if self._stale(owners):
+                self.stats["dropped"] += 1
+            else:
+                self._remember(key, result, owners is None)
+        return result
+
+    def prefetch(self, text, provider="speechify", voice_id=None, api_key=None, postprocess=False, stock=False,
+                 token=None):
+        """Start synthesizing text in the background for session token's turn if a TTS worker is free"""
+        text = text.strip()
+        if not text:
+            return
+        key = self.key(text, provider, voice_id, postprocess)
+        with self._lock:
+            if key in self._cache:
+                return
+            if key in self._pending:
+                # Already running for another session (or as a stock phrase): share it
+                owners = self._pending[key][1]
+                if owners is not None and not stock:
+                    owners[token] = self._turns.get(token)
+                elif stock:
+                    self._pending[key] = (self._pending[key][0], None)
+                return
+            if not stock and self._active >= self.max_workers:
+                self.stats["skipped_busy"] += 1
+                return
+            self.stats["speculated"] += 1
+            owners = None if stock else {token: self._turns.get(token)}
+            # _run takes the lock first, so it sees the pending entry
+            future = self._executor.submit(self._run, key, text, provider, voice_id, api_key, postprocess)
+            self._pending[key] = (future, owners)
+
+    def warm(self, phrases=STOCK_PHRASES, provider="speechify", voice_id=None, api_key=None, postprocess=False):
+        """Precompute audio for stock phrases (call once at startup)"""
+        for phrase in phrases:
+            self.prefetch(phrase, provider, voice_id, api_key, postprocess, stock=True)
+
+    def new_turn(self, token=None):
+        """Start a new turn for session token: its speculative work for the previous turn becomes stale"""
+        with self._lock:
+            self._turns[token] = next(self._turn_ids)
+            self._turns.move_to_end(token)
+            while len(self._turns) > MAX_SESSIONS:
+                self._turns.popitem(last=False)
+            for key, (future, owners) in list(self._pending.items()):
+                if owners is not None and token in owners and self._stale(owners) and future.cancel():
+                    self.stats["dropped"] += 1
+                    del self._pending[key]
+
+    def lookup(self, text, provider="speechify", voice_id=None, postprocess=False, wait=True):
+        """Finished or in-flight speculative audio for text, or None"""
+        key = self.key(text, provider, voice_id, postprocess)
+        with self._lock:
+            if key in self._cache:
+                self.stats["hits"] += 1
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            pending = self._pending.get(key)
+        if pending is None or not wait:
+            return None
+        try:
+            result = pending[0].result()
+        except CancelledError:
+            return None
+        except Exception:
+            # A failed speculative job (counted in _run) is only a miss; the caller synthesizes it
+            return None
+        if result is not None:
+            with self._lock:
+                self.stats["pending_hits"] += 1
+        return result
+
+    def speculate_stream(self, chunks, provider="speechify", voice_id=None, api_key=None, postprocess=False,
+                         token=None):
+        """Pass streamed LLM chunks through, prefetching each sentence for session token as soon as it is complete"""
+        text = ""
+        done = 0
+        for chunk in chunks:
+            text += chunk
+            # The last piece may still be growing; everything before it is final
+            sentences = split_sentences(text)[:-1]
+            for sentence in sentences[done:]:
+                if len(sentence) >= MIN_SPECULATIVE_CHARS:
+                    self.prefetch(sentence, provider, voice_id, api_key, postprocess, token=token)
+            done = max(done, len(sentences))
+            yield chunk
+
+    def speak(self, text, provider="speechify", voice_id=None, api_key=None, postprocess=False):
+        """Synthesize text, reusing speculative audio for the whole text or any of its sentences"""
+        cached = self.lookup(text, provider, voice_id, postprocess)
+        if cached is not None:
+            return cached
+        sentences = split_sentences(text)
+        if len(sentences) > 1:
+            clips = []
+            missing = []
+            for sentence in sentences:
+                audio = self.lookup(sentence, provider, voice_id, postprocess)
+                if audio is None:
+                    missing.append(sentence)
+                    continue
+                if missing:
+                    clips.append(self.synthesize(" ".join(missing), provider, voice_id, api_key, postprocess))
+                    missing = []
+                clips.append(audio)
+            if clips:
+                if missing:
+                    clips.append(self.synthesize(" ".join(missing), provider, voice_id, api_key, postprocess))
+                with self._lock:
+                    self.stats["stitched"] += 1
+                # Each clip was already post-processed (or not) by synthesize
+                return audio_post.join_clips(clips, fade_ms=15, postprocess=False)
+        with self._lock:
+            self.stats["misses"] += 1
+        return self.synthesize(text, provider, voice_id, api_key, postprocess)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, cached=len(self._cache), pending=len(self._pending), active=self._active,
+                        sessions=len(self._turns))
+
+
+_speculator = None
+_speculator_lock = threading.Lock()
+
+
+def get_speculator():
+    """Process-wide speculator shared by all sessions"""
+    global _speculator
+    with _speculator_lock:
+        if _speculator is None:
+            settings = config.get_settings()
+            _speculator = SpeculativeSynthesizer(max_workers=settings.speculative_workers,
+                                                 max_entries=settings.speculative_cache_size)
+        return _speculator
+
+
+# Time-to-audio for a streamed reply with and without first-sentence speculation (fake providers)
+if __name__ == "__main__":
+    import time
+
+    import fake_providers
+
+    def fake_synthesize(text, provider, voice_id, api_key, postprocess):
+        time.sleep(0.3 + len(text) / 500)
+        return fake_providers.speechify_tts(text)
+
+    def stream(reply, delay=0.02):
+        for word in reply.split(" "):
+            time.sleep(delay)
+            yield word + " "
+
+    reply = ("Sure, I can help with that. " + "Here is a longer explanation of the details. " * 8).strip()
+    speculator = SpeculativeSynthesizer(fake_synthesize)
+    start = time.perf_counter()
+    speculator.warm()
+    speculator.lookup(SORRY_PHRASE)
+    print(f"warmed {len(STOCK_PHRASES)} stock phrases in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    speculator.speak(SORRY_PHRASE)
+    print(f"stock phrase: {1000 * (time.perf_counter() - start):.1f} ms")
+
+    for speculate in (False, True):
+        speculator.new_turn()
+        start = time.perf_counter()
+        chunks = speculator.speculate_stream(stream(reply)) if speculate else stream(reply)
+        text = "".join(chunks)
+        speculator.speak(text)
+        label = "with speculation" if speculate else "baseline"
+        print(f"{label:17s} reply audio ready {time.perf_counter() - start:.2f}s after first token")
+    print(speculator.snapshot())
@@ -0,0 +1,77 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+import audio_archive
+import fake_providers
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = audio_archive.AudioArchive(str(tmp_path / "archive"), segment_bytes=64 * 1024)
+    yield archive
+    archive.close()
+
+
+def test_append_and_read(archive):
+    clip = fake_providers.tone_wav(0.5)
+    user_id = archive.append("conv", "user", "hello")
+    reply_id = archive.append("conv", "assistant", "hi there", clip, "wav")
+
+    audio, audio_format = archive.read(reply_id)
+    assert isinstance(audio, memoryview) and bytes(audio) == clip and audio_format == "wav"
+    assert archive.read(user_id) == (None, None)
+    assert archive.messages("conv") == [
+        {"role": "user", "content": "hello", "clip_id": None, "audio_mime": None},
+        {"role": "assistant", "content": "hi there", "clip_id": reply_id, "audio_mime": "audio/wav"},
+    ]
+
+
+def test_clips_roll_over_into_new_segments(archive):
+    clips = [fake_providers.tone_wav(1.0, frequency=200 + 10 * i) for i in range(4)]
+    ids = [archive.append("conv", "assistant", f"reply {i}", clip, "wav") for i, clip in enumerate(clips)]
+    assert len([name for name in os.listdir(archive.directory) if name.endswith(".dat")]) > 1
+    # A clip appended after the segment was first mapped is still readable
+    for clip_id, clip in zip(ids, clips):
+        assert bytes(archive.read(clip_id)[0]) == clip
+
+
+def test_compact_reclaims_deleted_conversations(archive):
+    kept = [archive.append("keep", "assistant", f"keep {i}", fake_providers.tone_wav(1.0, frequency=300 + i), "wav")
+            for i in range(3)]
+    for i in range(3):
+        archive.append("drop", "assistant", f"drop {i}", fake_providers.tone_wav(1.0), "wav")
+    expected = [bytes(archive.read(clip_id)[0]) for clip_id in kept]
+    archive.delete_conversation("drop")
+    assert archive.messages("drop") == []
+
+    before = archive.disk_bytes()
+    reclaimed = archive.compact()
+    assert reclaimed > 0 and archive.disk_bytes() == before - reclaimed
+    assert archive.disk_bytes() == sum(len(clip) for clip in expected)
+    assert [bytes(archive.read(clip_id)[0]) for clip_id in kept] == expected
+    # New clips still append after compaction
+    clip = fake_providers.tone_wav(0.2)
+    assert bytes(archive.read(archive.append("keep", "user", "again", clip, "wav"))[0]) == clip
+
+
+def test_export(archive, tmp_path):
+    clip = fake_providers.tone_wav(0.3)
+    archive.append("conv", "user", "hello")
+    archive.append("conv", "assistant", "hi", clip, "wav")
+    path = archive.export("conv", str(tmp_path / "conv.zip"))
+
+    with zipfile.ZipFile(path) as exported:
+        messages = json.loads(exported.read("messages.json"))
+        assert [message["content"] for message in messages] == ["hello", "hi"]
+        assert "audio" not in messages[0] and "clip_id" not in messages[0]
+        assert exported.read(messages[1]["audio"]) == clip
+
+
+def test_conversations_skip_deleted(archive):
+    archive.append("first", "user", "one")
+    archive.append("second", "user", "two")
+    archive.delete_conversation("first")
+    assert [(conversation, title) for conversation, title, _ in archive.conversations()] == [("second", "two")]
@@ -0,0 +1,43 @@
+import os
+import time
+
+import audio_encode
+
+
+def make_clip(directory, name, size, age):
+    path = directory / name
+    path.write_bytes(b"\0" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_prune_deletes_expired_then_oldest_over_the_cap(tmp_path):
+    expired = make_clip(tmp_path, "expired.wav", 1000, age=7200)
+    oldest = make_clip(tmp_path, "oldest.wav", 600 * 1024, age=300)
+    newer = make_clip(tmp_path, "newer.32k.ogg", 600 * 1024, age=200)
+    newest = make_clip(tmp_path, "newest.wav", 100, age=100)
+    writing = make_clip(tmp_path, "newer.32k.ogg.1.2.tmp", 100, age=9000)
+
+    removed = audio_encode.prune_clips(str(tmp_path), ttl=3600, max_mb=1)
+
+    assert removed == 2
+    assert not expired.exists() and not oldest.exists()
+    assert newer.exists() and newest.exists() and writing.exists()
+
+
+def test_store_clip_prunes_the_directory(tmp_path, monkeypatch):
+    make_clip(tmp_path, "expired.wav", 10, age=7200)
+    monkeypatch.setattr(audio_encode, "_last_prune", {})
+    path = audio_encode.store_clip(b"RIFF", "wav", str(tmp_path), ttl=3600, max_mb=1)
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+def test_touched_clips_are_pruned_last(tmp_path):
+    in_history = make_clip(tmp_path, "history.32k.ogg", 600 * 1024, age=7200)
+    idle = make_clip(tmp_path, "idle.wav", 600 * 1024, age=300)
+
+    assert audio_encode.touch_clip(str(in_history))
+    assert audio_encode.prune_clips(str(tmp_path), ttl=3600, max_mb=1) == 1
+    assert in_history.exists() and not idle.exists()
+    assert not audio_encode.touch_clip(str(idle))
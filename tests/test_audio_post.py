@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import audio_post
+
+
+def wav(samples, sample_rate=16000):
+    return audio_post.encode_wav(np.asarray(samples, dtype=np.float32)[:, None], sample_rate)
+
+
+def tone(seconds, sample_rate=16000, amplitude=0.3):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return amplitude * np.sin(2 * np.pi * 440 * t)
+
+
+@pytest.mark.parametrize("samples", [
+    np.zeros(16000),
+    1e-4 * np.random.default_rng(0).standard_normal(16000),
+    np.zeros(0),
+], ids=["silent", "below-threshold", "empty"])
+def test_quiet_clips_pass_through(samples):
+    processed, sample_rate = audio_post.process_clip(wav(samples))
+    assert sample_rate == audio_post.TARGET_SAMPLE_RATE
+    assert len(processed) == round(len(samples) * sample_rate / 16000)
+    assert np.all(np.isfinite(processed))
+
+
+def test_clip_shorter_than_one_block_is_normalized():
+    processed, sample_rate = audio_post.process_clip(wav(tone(0.2)))
+    assert 0 < len(processed) < 0.4 * sample_rate
+    assert audio_post.integrated_loudness(processed, sample_rate) == pytest.approx(audio_post.TARGET_LUFS, abs=0.5)
+
+
+def test_integrated_loudness_of_nothing():
+    assert audio_post.integrated_loudness(np.zeros((0, 1), dtype=np.float32), 16000) == -np.inf
+
+
+def test_join_without_postprocessing_keeps_levels_and_rate():
+    quiet, loud = wav(tone(1.0, amplitude=0.05)), wav(tone(1.0, amplitude=0.5))
+    joined, audio_format = audio_post.join_clips([(quiet, "wav"), (loud, "wav")], fade_ms=0, postprocess=False)
+    samples, sample_rate = audio_post.decode_audio(joined, audio_format)
+    assert (audio_format, sample_rate, len(samples)) == ("wav", 16000, 32000)
+    assert np.max(np.abs(samples[:16000])) == pytest.approx(0.05, abs=1e-3)
+    assert np.max(np.abs(samples[16000:])) == pytest.approx(0.5, abs=1e-3)
+
+
+def test_join_with_postprocessing_matches_levels():
+    quiet, loud = wav(tone(1.0, amplitude=0.05)), wav(tone(1.0, amplitude=0.5))
+    joined, _ = audio_post.join_clips([(quiet, "wav"), (loud, "wav")], fade_ms=0)
+    samples, sample_rate = audio_post.decode_audio(joined)
+    half = len(samples) // 2
+    assert sample_rate == audio_post.TARGET_SAMPLE_RATE
+    assert np.max(np.abs(samples[:half])) == pytest.approx(np.max(np.abs(samples[half:])), rel=0.05)
@@ -0,0 +1,120 @@
+import time
+
+import pytest
+
+import chat_router
+
+
+class MockBackend(chat_router.Backend):
+    """Sleeps like a real model: fixed overhead, prompt processing, then token generation."""
+
+    def __init__(self, name, overhead, prefill_tps, generate_tps, context_tokens=16385, fail=False):
+        super().__init__(name, name, overhead=overhead, prefill_tps=prefill_tps,
+                         generate_tps=generate_tps, context_tokens=context_tokens)
+        # The router starts from these priors; the mock's real speed can differ
+        self.real_overhead = overhead
+        self.fail = fail
+        self.calls = 0
+
+    def stream(self, messages, max_tokens, model=None):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("backend unreachable")
+        time.sleep(self.real_overhead + chat_router.estimate_tokens(messages) / self.prefill_tps)
+        for _ in range(max_tokens):
+            time.sleep(1.0 / self.generate_tps)
+            yield "tok "
+
+
+SHORT = [{"role": "user", "content": "What's the weather like?"}]
+LONG = [{"role": "user", "content": "Summarize this document. " + "lorem ipsum dolor sit amet " * 900}]
+
+
+@pytest.fixture
+def backends():
+    # Quality-ordered: the big remote model is preferred whenever it fits the budget
+    return (MockBackend("remote", overhead=0.4, prefill_tps=3000, generate_tps=80),
+            MockBackend("fast", overhead=0.15, prefill_tps=30000, generate_tps=300, context_tokens=8192),
+            MockBackend("local", overhead=0.02, prefill_tps=2000, generate_tps=40, context_tokens=2048))
+
+
+def names(plan):
+    return [backend.name for backend in plan[0]]
+
+
+def test_preferred_backend_when_it_meets_the_budget(backends):
+    router = chat_router.ChatRouter(backends, budget=1.0, max_tokens=40)
+    assert names(router.plan(SHORT))[0] == "remote"
+
+
+def test_tight_budget_picks_a_faster_backend(backends):
+    router = chat_router.ChatRouter(backends, budget=1.0, max_tokens=40)
+    assert names(router.plan(SHORT, budget=0.3))[0] == "fast"
+
+
+def test_prompt_too_long_for_a_context_window_skips_that_backend(backends):
+    router = chat_router.ChatRouter(backends, budget=1.0, max_tokens=40)
+    plan = names(router.plan(LONG))
+    assert "local" not in plan
+    # The remote model would take over 2 s just to read the prompt
+    assert plan[0] == "fast"
+
+
+def test_non_streamed_reply_shrinks_max_tokens_to_fit(backends):
+    router = chat_router.ChatRouter(backends, reply_budget=0.5, max_tokens=160)
+    _, max_tokens, _ = router.plan(SHORT, stream=False)
+    assert chat_router.MIN_MAX_TOKENS <= max_tokens < 160
+    _, max_tokens, _ = router.plan(SHORT, budget=0.01, stream=False)
+    assert max_tokens == chat_router.MIN_MAX_TOKENS
+    _, max_tokens, _ = router.plan(SHORT, stream=True)
+    assert max_tokens == 160
+
+
+def test_failure_before_the_first_token_falls_back_then_cools_down(monkeypatch):
+    down = MockBackend("down", 0.01, 3000, 1000, fail=True)
+    fast = MockBackend("fast", 0.01, 30000, 1000)
+    router = chat_router.ChatRouter([down, fast], budget=1.0, max_tokens=4)
+
+    assert "".join(router.stream(SHORT)) == "tok " * 4
+    assert router.last["backend"] == "fast"
+    assert router.snapshot()["backends"]["down"]["failures"] == 1
+    # Skipped while cooling down, even though it is preferred
+    assert names(router.plan(SHORT)) == ["fast"]
+    "".join(router.stream(SHORT))
+    assert down.calls == 1
+
+    monkeypatch.setattr(chat_router, "FAILURE_COOLDOWN", 0.0)
+    assert names(router.plan(SHORT))[0] == "down"
+
+
+def test_failure_after_the_first_token_is_not_retried():
+    class Breaks(MockBackend):
+        def stream(self, messages, max_tokens, model=None):
+            yield "tok "
+            raise ConnectionError("dropped mid-reply")
+
+    fast = MockBackend("fast", 0.01, 30000, 1000)
+    router = chat_router.ChatRouter([Breaks("breaks", 0.01, 3000, 1000), fast], max_tokens=4)
+    with pytest.raises(ConnectionError):
+        "".join(router.stream(SHORT))
+    assert fast.calls == 0
+
+
+def test_slowed_backend_loses_traffic_then_recovers():
+    remote = MockBackend("remote", overhead=0.1, prefill_tps=3000, generate_tps=1000)
+    fast = MockBackend("fast", overhead=0.05, prefill_tps=30000, generate_tps=2000)
+    router = chat_router.ChatRouter([remote, fast], budget=0.2, max_tokens=4)
+    assert names(router.plan(SHORT))[0] == "remote"
+
+    # One slow first token moves the estimate past the budget
+    remote.real_overhead = 0.5
+    "".join(router.stream(SHORT))
+    assert router.last["backend"] == "remote"
+    assert router.snapshot()["backends"]["remote"]["overhead"] > 0.2
+    assert names(router.plan(SHORT))[0] == "fast"
+
+    # Each time it is passed over, the estimate drifts back toward the prior
+    for _ in range(30):
+        if names(router.plan(SHORT))[0] == "remote":
+            break
+    assert names(router.plan(SHORT))[0] == "remote"
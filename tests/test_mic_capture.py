@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+import mic_capture
+
+
+def frames(start, count, channels=1):
+    return np.arange(start, start + count, dtype=np.float32)[:, None].repeat(channels, axis=1)
+
+
+def test_ring_wraps_around():
+    ring = mic_capture.RingBuffer(10)
+    reader = ring.reader()
+    ring.write(frames(0, 7))
+    assert np.array_equal(np.concatenate(reader.read()), frames(0, 7))
+    ring.write(frames(7, 6))
+    views = reader.read()
+    # Frames 7..12 cross the end of the ring: two zero-copy views
+    assert len(views) == 2 and all(view.base is ring.data for view in views)
+    assert np.array_equal(np.concatenate(views), frames(7, 6))
+    assert np.array_equal(ring.copy(3, 13), frames(3, 10))
+    assert reader.lost_frames == 0
+
+
+def test_slow_reader_counts_lost_frames():
+    ring = mic_capture.RingBuffer(10)
+    reader = ring.reader()
+    for start in range(0, 25, 5):
+        ring.write(frames(start, 5))
+    # 25 written into a 10-frame ring: the reader can only get the newest 10
+    assert np.array_equal(np.concatenate(reader.read()), frames(15, 10))
+    assert reader.lost_frames == 15
+    assert reader.available() == 0
+
+
+def test_write_larger_than_the_ring_counts_every_frame():
+    ring = mic_capture.RingBuffer(10)
+    reader = ring.reader()
+    ring.write(frames(0, 3))
+    ring.write(frames(3, 25))
+    assert ring.written == 28
+    assert np.array_equal(np.concatenate(reader.read()), frames(18, 10))
+    assert reader.lost_frames == 18
+    assert np.array_equal(np.concatenate(ring.latest(4)), frames(24, 4))
+
+
+def test_reader_max_frames():
+    ring = mic_capture.RingBuffer(10)
+    reader = ring.reader(from_start=True)
+    ring.write(frames(0, 8))
+    assert np.array_equal(np.concatenate(reader.read(5)), frames(0, 5))
+    assert reader.available() == 3
+
+
+@pytest.fixture
+def speech_file(tmp_path):
+    """1 s of speech-like noise, then silence"""
+    rate = 16000
+    samples = np.zeros(3 * rate, dtype=np.float32)
+    samples[:rate] = 0.2 * np.random.default_rng(0).standard_normal(rate)
+    path = str(tmp_path / "speech.wav")
+    sf.write(path, samples, rate)
+    return path, rate
+
+
+def test_record_from_file_device_ends_after_silence(speech_file):
+    path, rate = speech_file
+    # 20x real time: fast, but still paced so record() sees the speech end
+    capture = mic_capture.MicCapture(rate, seconds=10, fake_file=path, fake_speed=20)
+    with capture:
+        recording = capture.record(max_duration=5)
+    seconds = len(recording) / rate
+    # The speech plus about SILENCE_MS of silence, well before max_duration (5 s)
+    assert mic_capture.SILENCE_MS / 1000 < seconds < 4
+    assert recording.shape[1] == 1 and capture.lost_frames == 0
+    assert np.abs(recording[: rate // 4]).max() > 0.1
+    assert capture.stats()["callbacks"] > 0
+
+
+def test_record_without_silence_detection_runs_to_max_duration(speech_file):
+    path, rate = speech_file
+    capture = mic_capture.MicCapture(rate, seconds=10, fake_file=path, fake_speed=0)
+    with capture:
+        recording = capture.record(max_duration=2, stop_on_silence=False)
+    assert len(recording) == 2 * rate
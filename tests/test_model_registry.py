@@ -0,0 +1,121 @@
+import os
+import time
+
+import pytest
+
+import model_registry
+
+
+def test_register_if_absent_keeps_the_first_registration(tmp_path):
+    registry = model_registry.ModelRegistry(str(tmp_path))
+    first, second = (lambda: None, lambda: "first"), (lambda: None, lambda: "second")
+    assert not registry.has("model")
+    assert registry.register_if_absent("model", *first)
+    assert not registry.register_if_absent("model", *second)
+    assert registry.has("model")
+    assert registry._factories["model"][1]() == "first"
+
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("safetensors")
+
+
+class TiedModel(torch.nn.Module):
+    """Embedding and output head sharing one weight, plus a buffer left out of state_dict()"""
+
+    def __init__(self, vocab=64, width=32):
+        super().__init__()
+        self.embed = torch.nn.Embedding(vocab, width)
+        self.head = torch.nn.Linear(width, vocab, bias=False)
+        self.head.weight = self.embed.weight
+        self.register_buffer("scale", torch.full((width,), 0.5), persistent=False)
+
+    def forward(self, tokens):
+        return self.head(self.embed(tokens) * self.scale)
+
+
+def register_tied(registry, name="tied", sources=None):
+    def source():
+        if sources is not None:
+            sources.append(name)
+        torch.manual_seed(0)
+        return TiedModel()
+
+    registry.register(name, TiedModel, source)
+
+
+def mapped_files():
+    """(start, end, path) of this process's file-backed memory mappings"""
+    with open("/proc/self/maps") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 6:
+                start, end = (int(address, 16) for address in fields[0].split("-"))
+                yield start, end, fields[5]
+
+
+def test_get_maps_exported_weights_with_ties(tmp_path):
+    sources = []
+    registry = model_registry.ModelRegistry(str(tmp_path))
+    register_tied(registry, sources=sources)
+    module = registry.get("tied")
+    torch.manual_seed(0)
+    expected = TiedModel()
+
+    assert sources == ["tied"] and os.path.exists(registry.path("tied", "float32"))
+    assert module.head.weight is module.embed.weight
+    assert torch.equal(module.embed.weight, expected.embed.weight)
+    assert torch.equal(module.scale, expected.scale)
+    tokens = torch.tensor([[1, 2, 3]])
+    with torch.no_grad():
+        assert torch.allclose(module(tokens), expected(tokens))
+
+    if os.path.exists("/proc/self/maps"):
+        pointer = module.embed.weight.data_ptr()
+        assert any(start <= pointer < end and path == registry.path("tied", "float32")
+                   for start, end, path in mapped_files())
+
+    # Another registry (e.g. another worker process) maps the same file without the slow source
+    other = model_registry.ModelRegistry(str(tmp_path))
+    register_tied(other, sources=sources)
+    assert torch.equal(other.get("tied").embed.weight, expected.embed.weight)
+    assert sources == ["tied"]
+
+
+def test_warm_hits_return_the_same_instance(tmp_path):
+    registry = model_registry.ModelRegistry(str(tmp_path))
+    register_tied(registry)
+    first = registry.get("tied")
+    assert registry.get("tied") is first
+    half = registry.get("tied", "float16")
+    assert half is not first and half.embed.weight.dtype == torch.float16
+    assert (registry.loads, registry.hits) == (2, 1)
+
+
+def test_budget_evicts_least_recently_used(tmp_path):
+    # Each model holds 64 * 32 float32 weights once (tied) plus the 32-float buffer: about 8 KB
+    registry = model_registry.ModelRegistry(str(tmp_path), budget_mb=20 / 1024)
+    for name in ("a", "b", "c"):
+        register_tied(registry, name)
+    a = registry.get("a")
+    registry.get("b")
+    assert registry.get("a") is a
+    registry.get("c")
+    assert sorted(model["name"] for model in registry.stats()["models"]) == ["a", "c"]
+    assert registry.evictions == 1
+    # An evicted model is loaded again on the next get
+    registry.get("b")
+    assert registry.loads == 4
+
+
+def test_idle_models_are_evicted(tmp_path):
+    registry = model_registry.ModelRegistry(str(tmp_path), idle_seconds=0.05)
+    register_tied(registry)
+    module = registry.get("tied")
+    registry.evict_idle()
+    assert registry.stats()["models"]
+    time.sleep(0.1)
+    registry.evict_idle()
+    assert registry.stats()["models"] == [] and registry.evictions == 1
+    # Callers still holding the evicted instance can keep using it
+    assert module(torch.tensor([[1]])).shape == (1, 1, 64)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+import audio_post
+import narrate
+import voice_pipeline
+
+
+class Recorder:
+    """Stands in for the open SoundFile: keeps what was written, in order"""
+
+    def __init__(self):
+        self.blocks = []
+
+    def write(self, block):
+        self.blocks.append(np.array(block))
+
+    @property
+    def samples(self):
+        return np.concatenate(self.blocks)[:, 0]
+
+
+def ramp(start, frames):
+    return np.arange(start, start + frames, dtype=np.float32)[:, None]
+
+
+def test_crossfade_keeps_order_and_length():
+    output = Recorder()
+    # 4-frame fades at 1 kHz
+    writer = narrate.CrossfadeWriter(output, 1000, fade_ms=4)
+    first, second = ramp(0, 10), ramp(100, 10)
+    writer.write(first)
+    writer.write(second)
+    writer.close()
+    samples = output.samples
+    assert len(samples) == writer.frames == 10 + 10 - 4
+    assert np.array_equal(samples[:6], first[:6, 0])
+    assert np.array_equal(samples[10:], second[4:, 0])
+
+
+def test_clip_shorter_than_the_fade_blends_the_end_of_the_tail():
+    output = Recorder()
+    writer = narrate.CrossfadeWriter(output, 1000, fade_ms=4)
+    first = ramp(0, 10)
+    writer.write(first)
+    writer.write(np.full((2, 1), 50.0, dtype=np.float32))
+    writer.close()
+    samples = output.samples
+    assert len(samples) == writer.frames == 10
+    # Frames 6 and 7 of the tail come out untouched, in place; 8 and 9 fade into the short clip
+    assert np.array_equal(samples[:8], first[:8, 0])
+    assert samples[8] == pytest.approx(first[8, 0])
+    assert samples[9] == pytest.approx(50.0)
+
+
+def test_narration_resumes_from_finished_parts(tmp_path, monkeypatch):
+    synthesized = []
+    failing = {"Second chunk here."}
+
+    def fake_tts(text, provider, voice_id, api_key):
+        if text in failing:
+            raise ConnectionError("provider down")
+        synthesized.append(text)
+        t = np.arange(4000) / 16000
+        return audio_post.encode_wav((0.3 * np.sin(2 * np.pi * 220 * t))[:, None].astype(np.float32), 16000), "wav"
+
+    monkeypatch.setattr(voice_pipeline, "text_to_speech", fake_tts)
+    monkeypatch.setattr(narrate, "CHUNK_RETRIES", 1)
+    text = "First chunk here.\n\nSecond chunk here.\n\nThird chunk here."
+    output = str(tmp_path / "out.wav")
+
+    with pytest.raises(RuntimeError, match="Chunk 2/3 failed"):
+        narrate.narrate_text(text, output, workers=1, max_chars=20)
+    assert not (tmp_path / "out.wav").exists()
+
+    failing.clear()
+    synthesized.clear()
+    report = narrate.narrate_text(text, output, workers=1, max_chars=20)
+    # The first run may or may not have reached the third chunk before cancelling
+    assert "First chunk here." not in synthesized and "Second chunk here." in synthesized
+    assert report["chunks"] == 3 and report["resumed_chunks"] == 3 - len(synthesized)
+    parts = sorted((tmp_path / "out.wav.parts").glob("*.wav"))
+    fade = int(audio_post.TARGET_SAMPLE_RATE * narrate.FADE_MS / 1000)
+    assert sf.info(output).frames == sum(sf.info(str(part)).frames for part in parts) - 2 * fade
@@ -0,0 +1,153 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import rate_limit
+
+SERVER_RATE = 40  # requests per second the stub accepts before answering 429
+
+
+class LimitedHandler(BaseHTTPRequestHandler):
+    """Accepts SERVER_RATE requests in any one-second window, 429 with Retry-After beyond that"""
+
+    lock = threading.Lock()
+    window = []
+    accepted = 0
+    rejected = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        now = time.monotonic()
+        cls = type(self)
+        with cls.lock:
+            cls.window = [t for t in cls.window if now - t < 1.0]
+            allowed = len(cls.window) < SERVER_RATE
+            if allowed:
+                cls.window.append(now)
+                cls.accepted += 1
+            else:
+                cls.rejected += 1
+        self.send_response(200 if allowed else 429)
+        if not allowed:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    handler = type("Handler", (LimitedHandler,), {"window": [], "accepted": 0, "rejected": 0})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/tts", handler
+    server.shutdown()
+    server.server_close()
+
+
+def test_throughput_stays_under_the_server_limit_without_429s(stub_url, monkeypatch):
+    url, handler = stub_url
+    rate = SERVER_RATE * 0.9
+    monkeypatch.setitem(rate_limit.RATE_LIMITS, "stub", (rate, 2))
+    total = 60
+
+    def call(i):
+        # Every fourth request is interactive, the rest are batch jobs
+        with rate_limit.priority(rate_limit.INTERACTIVE if i % 4 == 0 else rate_limit.BATCH):
+            return rate_limit.request("stub", "test-key", "post", url, json={"i": i}).status_code
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        statuses = list(pool.map(call, range(total)))
+    elapsed = time.monotonic() - start
+
+    assert statuses == [200] * total
+    assert handler.rejected == 0
+    # The burst goes out at once, then one request per 1/rate seconds
+    assert (total - 2) / rate * 0.9 <= elapsed <= (total - 2) / rate * 1.5
+    stats = rate_limit.limiter("stub", "test-key").stats()
+    assert stats["granted"] == total and stats["throttled"] == 0
+
+
+def test_429_pauses_the_bucket_for_retry_after():
+    bucket = rate_limit.TokenBucket("paused", rate=100, burst=1)
+    bucket.acquire()
+    bucket.pause(0.3)
+    start = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.29
+    assert bucket.stats()["throttled"] == 1
+
+
+def test_interactive_callers_go_first():
+    bucket = rate_limit.TokenBucket("ordered", rate=20, burst=1)
+    bucket.acquire()
+    order = []
+
+    def take(level, label):
+        bucket.acquire(level)
+        order.append(label)
+
+    batch = [threading.Thread(target=take, args=(rate_limit.BATCH, f"batch{i}")) for i in range(3)]
+    for thread in batch:
+        thread.start()
+    time.sleep(0.01)
+    interactive = threading.Thread(target=take, args=(rate_limit.INTERACTIVE, "interactive"))
+    interactive.start()
+    for thread in batch + [interactive]:
+        thread.join()
+    assert order[0] == "interactive"
+
+
+def test_parse_retry_after():
+    assert rate_limit.parse_retry_after("2") == 2.0
+    assert rate_limit.parse_retry_after(None, default=1.5) == 1.5
+    assert rate_limit.parse_retry_after("3600") == rate_limit.MAX_RETRY_AFTER
+
+
+class ThrottledError(Exception):
+    """Shaped like openai.RateLimitError: a status_code and an HTTP response with headers"""
+
+    def __init__(self, status_code, headers):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers})()
+
+
+def test_call_retries_sdk_errors_after_retry_after(monkeypatch):
+    monkeypatch.setitem(rate_limit.RATE_LIMITS, "sdk-stub", (100, 1))
+    attempts = []
+
+    def create(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            raise ThrottledError(429, {"Retry-After": "0.2"})
+        return "ok"
+
+    start = time.monotonic()
+    assert rate_limit.call("sdk-stub", "key", create, model="m") == "ok"
+    assert time.monotonic() - start >= 0.19
+    assert attempts == [{"model": "m"}] * 2
+    assert rate_limit.limiter("sdk-stub", "key").stats()["throttled"] == 1
+
+
+def test_call_raises_other_errors_and_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setitem(rate_limit.RATE_LIMITS, "sdk-failing", (100, 1))
+    monkeypatch.setattr(rate_limit, "MAX_RETRIES", 2)
+    attempts = []
+
+    def create(error):
+        attempts.append(error)
+        raise error
+
+    with pytest.raises(ThrottledError):
+        rate_limit.call("sdk-failing", None, create, ThrottledError(500, {"Retry-After": "0"}))
+    assert len(attempts) == 1
+    with pytest.raises(ThrottledError):
+        rate_limit.call("sdk-failing", None, create, ThrottledError(503, {"Retry-After": "0"}))
+    assert len(attempts) == 1 + 3
@@ -0,0 +1,40 @@
+import pytest
+
+import semantic_cache
+
+
+def ask(text):
+    return [{"role": "user", "content": text}]
+
+
+@pytest.fixture
+def cache():
+    return semantic_cache.SemanticCache(threshold=0.85, embedding="hashing", enabled=True)
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What is 2 plus 2", "What is 2 plus 3"),
+    ("Convert 5 dollars to euros", "Convert 50 dollars to euros"),
+    ("Is it going to rain", "Is it not going to rain"),
+    ("What's the weather in Paris", "What's the weather in London"),
+])
+def test_similar_questions_with_different_key_terms_miss(cache, cached, asked):
+    cache.store(ask(cached), "cached answer", scope="c")
+    assert cache.lookup(ask(asked), scope="c") is None
+
+
+def test_paraphrase_still_hits(cache):
+    cache.store(ask("What is 2 plus 2?"), "Four", scope="c")
+    hit = cache.lookup(ask("what's 2 plus 2"), scope="c")
+    assert hit is not None and hit.text == "Four"
+
+
+def test_disabled_cache_never_hits():
+    cache = semantic_cache.SemanticCache(enabled=False)
+    assert cache.store(ask("What is 2 plus 2"), "Four") is None
+    assert cache.lookup(ask("What is 2 plus 2")) is None
+
+
+def test_key_terms():
+    assert semantic_cache.key_terms("Isn't it 5 o'clock in Paris?") == {"not", "#5", "@paris"}
+    assert semantic_cache.key_terms("What time is it") == frozenset()
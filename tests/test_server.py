@@ -0,0 +1,127 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import audio_encode
+import fake_providers
+import rate_limit
+import server
+import voice_pipeline
+
+
+def capture_app(handle, finished, queue_size=1):
+    """App whose /ws serves captures with handle(ws, capture); finished gets set once it returns"""
+    async def socket(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await server.serve_captures(request, ws, lambda capture: handle(ws, capture))
+        finished.set()
+        return ws
+
+    app = web.Application()
+    app["turn_queue_size"] = queue_size
+    app.router.add_get("/ws", socket)
+    return app
+
+
+async def send_utterance(ws, data):
+    await ws.send_json({"type": "start", "format": "wav"})
+    await ws.send_bytes(data)
+    await ws.send_json({"type": "end"})
+
+
+def test_failed_turn_reports_error_and_keeps_serving():
+    async def handle(ws, capture):
+        if capture.audio()[0] == b"bad":
+            raise RuntimeError("decoder exploded")
+        await ws.send_json({"type": "done"})
+
+    async def run():
+        finished = asyncio.Event()
+        async with TestClient(TestServer(capture_app(handle, finished))) as client:
+            ws = await client.ws_connect("/ws")
+            await send_utterance(ws, b"bad")
+            await send_utterance(ws, b"good")
+            replies = [await ws.receive_json(timeout=5), await ws.receive_json(timeout=5)]
+            await ws.close()
+            return replies
+
+    assert asyncio.run(run()) == [{"type": "error", "message": "Turn failed"}, {"type": "done"}]
+
+
+def test_disconnect_abandons_queued_turns():
+    async def handle(ws, capture):
+        await asyncio.sleep(60)
+
+    async def run():
+        finished = asyncio.Event()
+        async with TestClient(TestServer(capture_app(handle, finished))) as client:
+            ws = await client.ws_connect("/ws")
+            # One turn running and one filling the queue
+            for data in (b"one", b"two"):
+                await send_utterance(ws, data)
+            await asyncio.sleep(0.1)
+            await ws.close()
+            await asyncio.wait_for(finished.wait(), 5)
+
+    asyncio.run(run())
+
+
+def test_audio_counts_one_turn_per_stored_clip(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_encode, "STATS", dict(audio_encode.STATS, turns=0, bytes_sent=0))
+    path = audio_encode.store_clip(fake_providers.tone_wav(0.2), "wav", str(tmp_path))
+    url = f"/audio/{os.path.basename(path)}?format=wav"
+
+    async def run():
+        client = TestClient(TestServer(server.create_app(threads=2, audio_dir=str(tmp_path))))
+        await client.start_server()
+        try:
+            for headers in ({}, {}, {"Range": "bytes=0-99"}):
+                response = await client.get(url, headers=headers)
+                assert response.status in (200, 206)
+                await response.read()
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    assert audio_encode.STATS["turns"] == 1
+    assert audio_encode.STATS["bytes_sent"] == len(open(path, "rb").read())
+
+
+def test_run_blocking_keeps_the_rate_limit_priority():
+    request = SimpleNamespace(app={"executor": ThreadPoolExecutor(max_workers=1)})
+
+    async def batch_call():
+        with rate_limit.priority(rate_limit.BATCH):
+            return await server.run_blocking(request, rate_limit.current_priority)
+
+    try:
+        assert asyncio.run(batch_call()) == rate_limit.BATCH
+    finally:
+        request.app["executor"].shutdown()
+
+
+def test_tts_ignores_an_api_key_in_the_body(tmp_path, monkeypatch):
+    calls = []
+
+    def text_to_speech(text, provider, voice_id, api_key, postprocess):
+        calls.append(api_key)
+        return b"RIFF", "wav"
+
+    monkeypatch.setattr(voice_pipeline, "text_to_speech", text_to_speech)
+
+    async def run():
+        client = TestClient(TestServer(server.create_app(threads=2, audio_dir=str(tmp_path))))
+        await client.start_server()
+        try:
+            response = await client.post("/tts", json={"text": "hi", "api_key": "someone-elses-key"})
+            assert response.status == 200 and await response.read() == b"RIFF"
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    assert calls == [None]
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import rate_limit
+import single_flight
+
+
+@pytest.fixture
+def slow_lookup():
+    """A coalesced stub that counts its upstream calls and takes 0.2 s each"""
+    calls = []
+
+    @single_flight.coalesce("counting-stub")
+    def lookup(voice_id):
+        calls.append(voice_id)
+        time.sleep(0.2)
+        return {"id": voice_id}
+
+    lookup.calls = calls
+    return lookup
+
+
+def test_concurrent_threads_make_one_upstream_call(slow_lookup):
+    barrier = threading.Barrier(100)
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(slow_lookup("dc1f0dc1"))
+
+    threads = [threading.Thread(target=worker) for _ in range(100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [{"id": "dc1f0dc1"}] * 100
+    assert slow_lookup.calls == ["dc1f0dc1"]
+
+
+def test_concurrent_tasks_make_one_upstream_call(slow_lookup):
+    async def fire():
+        return await asyncio.gather(*[slow_lookup.call_async("dc1f0dc1") for _ in range(100)])
+
+    assert asyncio.run(fire()) == [{"id": "dc1f0dc1"}] * 100
+    assert slow_lookup.calls == ["dc1f0dc1"]
+
+
+def test_different_keys_and_later_calls_are_not_coalesced(slow_lookup):
+    slow_lookup("a")
+    slow_lookup("a")
+    slow_lookup("b")
+    assert slow_lookup.calls == ["a", "a", "b"]
+
+
+def test_exception_reaches_every_waiter():
+    flight = single_flight.SingleFlight("failing-stub")
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise ConnectionError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", fail)
+        except ConnectionError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=call) for _ in range(5)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+    assert len(errors) == 6
+    assert flight.stats()["executions"] == 1 and flight.in_flight() == 0
+
+
+def test_async_leader_keeps_its_rate_limit_priority():
+    flight = single_flight.SingleFlight("priority-stub")
+
+    async def batch_call():
+        with rate_limit.priority(rate_limit.BATCH):
+            return await flight.do_async("key", rate_limit.current_priority)
+
+    assert asyncio.run(batch_call()) == rate_limit.BATCH
+
+
+def test_concurrent_group_calls_share_one_group(monkeypatch):
+    class SlowSingleFlight(single_flight.SingleFlight):
+        def __init__(self, name):
+            time.sleep(0.01)  # Widen the window between looking up and registering
+            super().__init__(name)
+
+    monkeypatch.setattr(single_flight, "SingleFlight", SlowSingleFlight)
+    monkeypatch.setattr(single_flight, "GROUPS", {})
+    barrier = threading.Barrier(20)
+    groups = []
+
+    def worker():
+        barrier.wait()
+        groups.append(single_flight.group("shared"))
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(group) for group in groups}) == 1
+    assert single_flight.GROUPS == {"shared": groups[0]}
@@ -0,0 +1,62 @@
+import threading
+
+import speculative_tts
+
+
+class GatedSynthesizer:
+    """Fake TTS that blocks until released, so jobs stay pending"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, text, provider, voice_id, api_key, postprocess):
+        self.calls.append(text)
+        self.release.wait(5)
+        return text.encode(), "mp3"
+
+
+def test_new_turn_only_cancels_that_sessions_work():
+    synthesize = GatedSynthesizer()
+    # One thread: the first job runs, the rest queue behind it and can still be cancelled
+    speculator = speculative_tts.SpeculativeSynthesizer(synthesize, max_workers=1)
+    speculator.max_workers = 8
+    speculator.new_turn("a")
+    speculator.new_turn("b")
+    speculator.prefetch("Running sentence for a.", token="a")
+    speculator.prefetch("Queued sentence for a.", token="a")
+    speculator.prefetch("Queued sentence for b.", token="b")
+    speculator.prefetch("Shared sentence for both.", token="a")
+    speculator.prefetch("Shared sentence for both.", token="b")
+
+    speculator.new_turn("a")
+    synthesize.release.set()
+
+    assert speculator.lookup("Queued sentence for a.") is None
+    assert speculator.lookup("Queued sentence for b.") == (b"Queued sentence for b.", "mp3")
+    assert speculator.lookup("Shared sentence for both.") == (b"Shared sentence for both.", "mp3")
+    assert "Queued sentence for a." not in synthesize.calls
+    # Finished after a's new turn, so discarded rather than cached
+    assert speculator.lookup("Running sentence for a.", wait=False) is None
+    assert speculator.snapshot()["dropped"] == 2
+
+
+def test_failed_speculative_job_is_synthesized_again():
+    attempts = []
+    gate = threading.Event()
+
+    def flaky(text, provider, voice_id, api_key, postprocess):
+        attempts.append(text)
+        if len(attempts) == 1:
+            # Fails while speak() is waiting on it
+            gate.wait(5)
+            raise ConnectionError("503 from provider")
+        return text.encode(), "mp3"
+
+    speculator = speculative_tts.SpeculativeSynthesizer(flaky, max_workers=1)
+    speculator.new_turn("a")
+    speculator.prefetch("A sentence worth speaking.", token="a")
+    threading.Timer(0.1, gate.set).start()
+    assert speculator.speak("A sentence worth speaking.") == (b"A sentence worth speaking.", "mp3")
+    assert len(attempts) == 2
+    assert speculator.snapshot()["failed"] == 1
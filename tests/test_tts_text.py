@@ -0,0 +1,55 @@
+import pytest
+
+import tts_text
+import voice_pipeline
+
+VOICES = [{"id": "english-voice", "language": "en-US"}, {"id": "swahili-voice", "language": "sw-KE"}]
+
+
+@pytest.mark.parametrize("text", [
+    "Analyze data, handle exceptions, ensure compliance.",
+    "We handle orders and deliver them tomorrow, please wait.",
+    "Ensure amendments, manage tasks and make data safe.",
+    "Sanitize inputs, then index the tables.",
+    "The banda is nice and I love simba and chakula.",
+])
+def test_english_stays_english(text):
+    assert [language for _, language in tts_text.segment(text)] == ["en"]
+
+
+@pytest.mark.parametrize("text", [
+    "Mimi ninapenda chakula cha nyumbani sana.",
+    "Tafadhali lipa leo, rafiki yangu.",
+    "Habari yako? Karibu sana.",
+])
+def test_swahili_is_detected(text):
+    assert [language for _, language in tts_text.segment(text)] == ["sw"]
+
+
+def test_mixed_reply_is_split_by_language():
+    segments = tts_text.segment("Thank you for waiting. Asante sana kwa kusubiri, rafiki. See you tomorrow.")
+    assert [language for _, language in segments] == ["en", "sw", "en"]
+    assert segments[1][0] == "Asante sana kwa kusubiri, rafiki."
+
+
+def test_weak_evidence_keeps_the_voices_language():
+    # Nothing here is clearly English or Swahili: a Swahili voice keeps it
+    assert tts_text.segment("Analyze data, handle exceptions.", default_language="sw") == \
+        [("Analyze data, handle exceptions.", "sw")]
+
+
+def test_route_sends_foreign_segments_to_a_catalogue_voice():
+    routed = tts_text.prepare("It costs $5. Asante sana kwa kusubiri.", "english-voice", VOICES)
+    assert [(piece.language, piece.voice_id) for piece in routed] == \
+        [("en", "english-voice"), ("sw", "swahili-voice")]
+    assert routed[0].text == "It costs five dollars."
+
+
+def test_english_reply_does_not_fetch_the_voice_list(monkeypatch):
+    def fetch(*args, **kwargs):
+        raise AssertionError("voice list fetched")
+
+    monkeypatch.setattr(voice_pipeline, "voice_catalogue", fetch)
+    segments = voice_pipeline.voice_segments("Analyze data, handle exceptions, ensure compliance.",
+                                             "speechify", "some-voice")
+    assert [(piece.language, piece.voice_id) for piece in segments] == [("en", "some-voice")]
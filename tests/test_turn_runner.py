@@ -0,0 +1,102 @@
+import logging
+import threading
+import time
+
+import pytest
+
+import turn_runner
+
+
+def fail(message, wait=None):
+    if wait is not None:
+        wait.wait(5)
+    raise ValueError(message)
+
+
+def skipped(future):
+    """A stage that never ran: cancelled itself, or failed because its dependency was cancelled"""
+    return future.cancelled() or isinstance(future.exception(5), turn_runner.TurnCancelled)
+
+
+def test_stage_runs_after_its_dependencies():
+    with turn_runner.Turn() as turn:
+        turn.submit("a", lambda: 1)
+        turn.submit("b", lambda: 2)
+        total = turn.submit("sum", lambda: turn.result("a") + turn.result("b"), after=["a", "b"])
+    assert total.result(5) == 3
+
+
+def test_two_failed_dependencies_fail_the_stage_once(caplog):
+    ran = []
+    with turn_runner.Turn() as turn:
+        turn.submit("a", fail, "a")
+        turn.submit("b", fail, "b")
+        later = turn.submit("later", ran.append, 1, after=["a", "b"])
+        with pytest.raises(turn_runner.TurnCancelled):
+            later.result(5)
+    time.sleep(0.05)
+    assert not ran
+    assert "exception calling callback" not in caplog.text
+
+
+def test_stage_never_runs_when_the_last_dependency_succeeds_after_a_failure(caplog, monkeypatch):
+    release = threading.Event()
+    ran = []
+    scheduled = []
+    submit = turn_runner._executor.submit
+
+    def recording_submit(fn, *args, **kwargs):
+        future = submit(fn, *args, **kwargs)
+        scheduled.append(future)
+        return future
+
+    monkeypatch.setattr(turn_runner._executor, "submit", recording_submit)
+    with caplog.at_level(logging.ERROR):
+        with turn_runner.Turn() as turn:
+            turn.submit("fails", fail, "early")
+            turn.submit("succeeds", release.wait, 5)
+            later = turn.submit("later", ran.append, 1, after=["fails", "succeeds"])
+            with pytest.raises(turn_runner.TurnCancelled):
+                later.result(5)
+            release.set()
+            turn.result("succeeds")
+    time.sleep(0.05)
+    assert not ran
+    # Only the two dependencies were scheduled, not the failed stage
+    assert len(scheduled) == 2 and all(future.exception(5) is None for future in scheduled)
+    assert "exception calling callback" not in caplog.text
+
+
+def test_cancel_skips_stages_that_have_not_started():
+    release = threading.Event()
+    ran = []
+    turn = turn_runner.Turn()
+    turn.submit("slow", release.wait, 5)
+    later = turn.submit("after_slow", ran.append, 1, after=["slow"])
+    turn.cancel()
+    release.set()
+    time.sleep(0.05)
+    assert skipped(later) and not ran
+    assert turn.report()["cancelled"]
+
+
+def test_exception_leaving_the_block_cancels_the_turn():
+    release = threading.Event()
+    with pytest.raises(KeyboardInterrupt):
+        with turn_runner.Turn() as turn:
+            turn.submit("slow", release.wait, 5)
+            later = turn.submit("after_slow", print, after=["slow"])
+            raise KeyboardInterrupt
+    release.set()
+    assert skipped(later)
+
+
+def test_critical_path_follows_the_latest_dependency():
+    with turn_runner.Turn() as turn:
+        turn.submit("warm", time.sleep, 0.01)
+        turn.call("record", time.sleep, 0.1)
+        turn.call("transcribe", time.sleep, 0.01, after=["warm"])
+        turn.call("chat", time.sleep, 0.01)
+    report = turn.report()
+    assert report["critical_path"] == ["record", "transcribe", "chat"]
+    assert report["overlap_seconds"] > 0
@@ -0,0 +1,232 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import audio_post
+import config
+import single_flight
+
+FINGERPRINT_SAMPLE_RATE = 16000
+FRAME = 1024  # 64 ms
+HOP = 256  # 16 ms
+BANDS = 17  # 16 bits per frame
+MIN_FINGERPRINT_FRAMES = 30
+MAX_BIT_ERROR_RATE = 0.15
+DEFAULT_PATH = os.path.join("media", "transcription_cache.sqlite3")
+DEFAULT_MAX_ENTRIES = 2000
+
+
+def normalized_pcm(audio_file):
+    """Decode to 16 kHz mono int16 so container/encoder differences don't change the key"""
+    samples, sample_rate = audio_post.decode_audio(audio_file)
+    samples = audio_post.resample(audio_post.to_mono(samples), sample_rate, FINGERPRINT_SAMPLE_RATE)[:, 0]
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def content_hash(pcm):
+    return hashlib.sha256(pcm.tobytes()).hexdigest()
+
+
+def _band_matrix():
+    # Log-spaced bands between 300 Hz and 3 kHz, where speech energy lives
+    edges = np.geomspace(300, 3000, BANDS + 1)
+    freqs = np.fft.rfftfreq(FRAME, 1 / FINGERPRINT_SAMPLE_RATE)
+    return ((freqs[:, None] >= edges[None, :-1]) & (freqs[:, None] < edges[None, 1:])).astype(np.float32)
+
+
+BAND_MATRIX = _band_matrix()
+WINDOW = np.hanning(FRAME).astype(np.float32)
+
+
+def fingerprint(pcm):
+    """Haitsma-Kalker style robust fingerprint: one 16-bit word per 16 ms frame.
+
+    Each bit is the sign of the energy difference between neighbouring bands,
+    differenced again over time, which survives re-encoding, resampling and gain changes.
+    """
+    samples = pcm.astype(np.float32) / 32768.0
+    if len(samples) < FRAME + HOP:
+        return np.zeros((0, 2), dtype=np.uint8)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME)[::HOP] * WINDOW
+    energy = np.square(np.abs(np.fft.rfft(frames, axis=1))) @ BAND_MATRIX
+    band_diff = energy[:, :-1] - energy[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    return np.packbits(bits, axis=1)
+
+
+def bit_error_rate(a, b, max_shift=3):
+    """Lowest fraction of differing bits between two fingerprints over small alignments"""
+    best = 1.0
+    for shift in range(-max_shift, max_shift + 1):
+        x = a[max(shift, 0):]
+        y = b[max(-shift, 0):]
+        n = min(len(x), len(y))
+        if n < MIN_FINGERPRINT_FRAMES:
+            continue
+        best = min(best, float(np.unpackbits(x[:n] ^ y[:n]).mean()))
+    return best
+
+
+class TranscriptionCache:
+    """LRU transcription cache keyed by normalized PCM hash, persisted in SQLite.
+
+    Exact hits match the content hash; with fuzzy=True a near-identical recording
+    (re-encoded, resampled, slightly different gain) also hits via its fingerprint.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES, fuzzy=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.fuzzy = fuzzy
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()  # key -> (text, fingerprint)
+        self._buckets = {}  # duration in seconds -> set of keys, to narrow fuzzy search
+        self._flight = single_flight.group("transcription")
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                "key TEXT PRIMARY KEY, text TEXT, fingerprint BLOB, last_used REAL)"
+            )
+            self._load()
+
+    def _load(self):
+        rows = self._db.execute(
+            "SELECT key, text, fingerprint FROM transcripts ORDER BY last_used DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        for key, text, blob in reversed(rows):
+            self._insert(key, text, np.frombuffer(blob, dtype=np.uint8).reshape(-1, 2))
+
+    def _bucket(self, fp):
+        return len(fp) * HOP // FINGERPRINT_SAMPLE_RATE
+
+    def _insert(self, key, text, fp):
+        self._entries[key] = (text, fp)
+        self._entries.move_to_end(key)
+        self._buckets.setdefault(self._bucket(fp), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            old_key, (_, old_fp) = self._entries.popitem(last=False)
+            self._buckets.get(self._bucket(old_fp), set()).discard(old_key)
+            if self._db:
+                self._db.execute("DELETE FROM transcripts WHERE key = ?", (old_key,))
+
+    def _touch(self, key):
+        self._entries.move_to_end(key)
+        if self._db:
+            self._db.execute("UPDATE transcripts SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+
+    def _find_similar(self, fp):
+        if len(fp) < MIN_FINGERPRINT_FRAMES:
+            return None
+        bucket = self._bucket(fp)
+        for candidate_bucket in (bucket, bucket - 1, bucket + 1):
+            for key in self._buckets.get(candidate_bucket, ()):
+                _, other = self._entries[key]
+                if abs(len(other) - len(fp)) <= 0.1 * len(fp) and bit_error_rate(fp, other) <= MAX_BIT_ERROR_RATE:
+                    return key
+        return None
+
+    def lookup(self, pcm):
+        """Cached transcript for the PCM (exact or near-identical), or None"""
+        key = content_hash(pcm)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._touch(key)
+                return key, self._entries[key][0]
+            fp = fingerprint(pcm) if self.fuzzy else None
+            similar = self._find_similar(fp) if self.fuzzy else None
+            if similar is not None:
+                self.fuzzy_hits += 1
+                self._touch(similar)
+                return key, self._entries[similar][0]
+            self.misses += 1
+            return key, None
+
+    def store(self, pcm, text, key=None):
+        key = key or content_hash(pcm)
+        fp = fingerprint(pcm)
+        with self._lock:
+            self._insert(key, text, fp)
+            if self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO transcripts (key, text, fingerprint, last_used) VALUES (?, ?, ?, ?)",
+                    (key, text, fp.tobytes(), time.time()),
+                )
+                self._db.commit()
+
+    def transcribe(self, audio_file, transcribe_func):
+        """Return the cached transcript for audio_file, calling transcribe_func on a miss"""
+        try:
+            pcm = normalized_pcm(audio_file)
+        except Exception:
+            # Undecodable input: skip the cache rather than fail the turn
+            return transcribe_func(audio_file)
+        key, text = self.lookup(pcm)
+        if text is not None:
+            with self._lock:
+                self.seconds_saved += len(pcm) / FINGERPRINT_SAMPLE_RATE
+            return text
+
+        def miss():
+            result = transcribe_func(audio_file)
+            self.store(pcm, result, key)
+            return result
+
+        # Identical recordings arriving together (e.g. retries) share one Whisper call
+        return self._flight.do(key, miss)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            if self._db:
+                self._db.execute("DELETE FROM transcripts")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.fuzzy_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.fuzzy_hits) / lookups if lookups else 0.0,
+                "audio_seconds_saved": round(self.seconds_saved, 1),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache shared by every STT call site"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            settings = config.get_settings()
+            _cache = TranscriptionCache(
+                settings.transcription_cache_path,
+                settings.transcription_cache_size,
+                settings.transcription_cache_fuzzy,
+            )
+        return _cache
+
+
+def stats():
+    return get_cache().stats()
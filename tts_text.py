@@ -0,0 +1,353 @@
+import functools
+import re
+from collections import namedtuple
+
+# Reply text -> speakable segments: Markdown, URLs and emoji are removed, numbers and
+# currency are spelled out, and each segment is tagged with its language so it can go
+# to a voice that speaks it. Every regex is compiled once here; sentences are memoized.
+
+Segment = namedtuple("Segment", ["text", "language", "voice_id"])
+
+MARKDOWN = [(re.compile(pattern, flags), replacement) for pattern, replacement, flags in [
+    (r"```.*?```", "", re.S),
+    (r"!\[[^\]]*\]\([^)]*\)", "", 0),
+    (r"\[([^\]]+)\]\([^)]*\)", r"\1", 0),
+    (r"`([^`]*)`", r"\1", 0),
+    (r"^\s{0,3}#{1,6}\s*(.+?)\s*#*$", r"\1.", re.M),
+    # List items become sentences so they are read with a pause between them
+    (r"^\s*(?:[-*+]|\d+[.)])\s+(.*?[^.!?:;,\s])[ \t]*$", r"\1.", re.M),
+    (r"^\s*(?:[-*+]|\d+[.)])\s+", "", re.M),
+    (r"^\s*>\s?", "", re.M),
+    (r"(\*\*|__|\*|_|~~)(\S.*?\S|\S)\1", r"\2", 0),
+    (r"^\s*(?:-{3,}|\*{3,}|_{3,})\s*$", "", re.M),
+]]
+
+URL = re.compile(r"\b(?:https?://)?(?:www\.)?((?:[a-z0-9-]+\.)+(?:com|org|net|io|ai|co|ke|tz|uk|edu|gov|dev|app))"
+                 r"(?:/[^\s)]*)?", re.I)
+EMAIL = re.compile(r"\b([\w.+-]+)@([\w-]+(?:\.[\w-]+)+)\b")
+EMOJI = re.compile("[\U0001F000-\U0001FAFF☀-➿️‍]+")
+SENTENCE_END = re.compile(r"(?<=[.!?…])[\"')\]]*\s+")
+CLAUSE_SPLIT = re.compile(r"\s*[,;:]\s+|\s+[-–—]\s+")
+WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+SPACES = re.compile(r"\s+")
+SPACE_BEFORE_PUNCT = re.compile(r"\s+([,.;:!?])")
+
+# (singular, plural, minor singular, minor plural) per currency symbol or code
+CURRENCIES = {
+    "$": ("dollar", "dollars", "cent", "cents"),
+    "€": ("euro", "euros", "cent", "cents"),
+    "£": ("pound", "pounds", "penny", "pence"),
+    "ksh": ("Kenyan shilling", "Kenyan shillings", "cent", "cents"),
+    "kes": ("Kenyan shilling", "Kenyan shillings", "cent", "cents"),
+    "tsh": ("Tanzanian shilling", "Tanzanian shillings", "cent", "cents"),
+}
+SCALES = {"k": "thousand", "thousand": "thousand", "m": "million", "million": "million",
+          "bn": "billion", "b": "billion", "billion": "billion"}
+NUMBER = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+MONEY = re.compile(rf"(?i)(\$|€|£|\b(?:ksh|kes|tsh)\.?\s?)({NUMBER})(?:\s?(k|m|bn|b|thousand|million|billion)\b)?")
+PERCENT = re.compile(rf"({NUMBER})\s?%")
+TIME = re.compile(r"(?i)\b([01]?\d|2[0-3]):([0-5]\d)\s*([ap])\.?m\.?\b|\b([01]?\d|2[0-3]):([0-5]\d)\b")
+ORDINAL = re.compile(r"(?i)\b(\d+)(st|nd|rd|th)\b")
+ISO_DATE = re.compile(r"\b(\d{4})-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])\b")
+AM_PM = re.compile(r"(?i)(?<=\d)\s?([ap])\.?m\b\.?")
+RANGE = re.compile(rf"\b({NUMBER})\s?[-–]\s?({NUMBER})\b")
+YEAR = re.compile(r"\b(1[1-9]\d{2}|20\d{2})\b(?![,.]\d)")
+PLAIN_NUMBER = re.compile(rf"(-)?\b({NUMBER})\b")
+SYMBOLS = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r"\s&\s", " and "), (r"#(?=\d)", "number "), (r"(?<=\d)\s?\+\s?(?=\d)", " plus "),
+    (r"(?<=\d)\s?=\s?(?=\d)", " equals "), (r"(?<=\d)\s?x\s?(?=\d)", " by "),
+    (r"°C\b", " degrees Celsius"), (r"°F\b", " degrees Fahrenheit"),
+]]
+
+ONES = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven",
+        "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+SCALE_WORDS = [(10 ** 12, "trillion"), (10 ** 9, "billion"), (10 ** 6, "million"), (1000, "thousand")]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September",
+          "October", "November", "December"]
+ORDINAL_WORDS = {"one": "first", "two": "second", "three": "third", "five": "fifth", "eight": "eighth",
+                 "nine": "ninth", "twelve": "twelfth"}
+
+# Word lists and morphology used to tell languages apart; add a language by adding a profile
+LANGUAGE_PROFILES = {
+    "en": {
+        "words": set("""the a an and or but is are was were be been to of in on at by for from with about as
+            it its this that these those there here you your i me my we our they them he she his her not no
+            yes do does did can will would should have has had what how why when where who which please
+            thanks thank hello hi good today tomorrow yesterday send money am if so just very""".split()),
+        "suffix": re.compile(r"(?:ing|tion|ed|ly|ness|ment|ful|less|ous|ight|th|ck)$"),
+    },
+    "sw": {
+        "words": set("""na ya wa za la cha vya kwa katika ni si hii hiyo huyo hizi mimi wewe yeye sisi ninyi
+            wao kuna sana tu pia lakini au kama nini gani wapi lini vipi ndiyo hapana asante habari jambo
+            karibu tafadhali leo kesho jana sasa pesa mtu watu kitu vitu mwenyewe yangu yako yake wangu wako
+            wake nzuri mzuri sawa rafiki nyumbani chakula maji shule kazi simba bei shilingi elfu mia""".split()),
+        "prefix": re.compile(r"^(?:ni|u|a|tu|m|mu|wa|ki|vi|ku|li)(?:ta|li|na|me|ki|nge|ka|ja)[a-z]{2,}"),
+        "cluster": re.compile(r"(?:ny|mw|ng'|mb|nd|nj|nz|mt|mk|dh|gh)"),
+    },
+}
+MIN_LANGUAGE_SCORE = 1.5
+# Morphology alone misfires on ordinary words ("handle", "ensure", "Analyze"), so a piece
+# of text only counts as a language with at least this many of its word-list words,
+# making up at least MIN_LEXICON_SHARE of the words
+MIN_LEXICON_WORDS = 2
+MIN_LEXICON_SHARE = 0.3
+
+
+def strip_markdown(text):
+    """Plain text from Markdown: drop code blocks, images, link targets, emphasis and list markers"""
+    for pattern, replacement in MARKDOWN:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+@functools.lru_cache(maxsize=4096)
+def number_words(n):
+    """English words for a non-negative integer"""
+    if n < 20:
+        return ONES[n]
+    if n < 100:
+        return TENS[n // 10] + ("-" + ONES[n % 10] if n % 10 else "")
+    if n < 1000:
+        return ONES[n // 100] + " hundred" + (" " + number_words(n % 100) if n % 100 else "")
+    for value, word in SCALE_WORDS:
+        if n >= value:
+            rest = n % value
+            return number_words(n // value) + " " + word + (" " + number_words(rest) if rest else "")
+    return str(n)
+
+
+def ordinal_words(n):
+    words = number_words(n)
+    sep = "-" if "-" in words.rsplit(" ", 1)[-1] else " "
+    head, _, last = words.rpartition(sep)
+    if last in ORDINAL_WORDS:
+        last = ORDINAL_WORDS[last]
+    elif last.endswith("y"):
+        last = last[:-1] + "ieth"
+    else:
+        last += "th"
+    return f"{head}{sep}{last}" if head else last
+
+
+def year_words(n):
+    if 2000 <= n <= 2009 or n % 1000 == 0:
+        return number_words(n)
+    high, low = divmod(n, 100)
+    if low == 0:
+        return number_words(high) + " hundred"
+    return number_words(high) + (" oh " + ONES[low] if low < 10 else " " + number_words(low))
+
+
+def decimal_words(value):
+    """'3.14' -> 'three point one four', '1,200' -> 'one thousand two hundred'"""
+    whole, _, fraction = value.replace(",", "").partition(".")
+    words = number_words(int(whole))
+    if fraction:
+        words += " point " + " ".join(ONES[int(digit)] for digit in fraction)
+    return words
+
+
+def _money(match):
+    symbol = match.group(1).strip().rstrip(".").lower()
+    singular, plural, minor_single, minor_plural = CURRENCIES[symbol]
+    amount, scale = match.group(2).replace(",", ""), match.group(3)
+    if scale:
+        return f"{decimal_words(amount)} {SCALES[scale.lower()]} {plural}"
+    whole, _, cents = amount.partition(".")
+    major = f"{number_words(int(whole))} {singular if int(whole) == 1 else plural}"
+    if cents and int(cents[:2].ljust(2, "0")):
+        cents = int(cents[:2].ljust(2, "0"))
+        return f"{major} and {number_words(cents)} {minor_single if cents == 1 else minor_plural}"
+    return major
+
+
+def _time(match):
+    hour, minute, half = (match.group(1), match.group(2), match.group(3)) if match.group(1) else \
+        (match.group(4), match.group(5), None)
+    hour, minute = int(hour), int(minute)
+    words = number_words(hour)
+    if minute:
+        words += " " + ("oh " + ONES[minute] if minute < 10 else number_words(minute))
+    elif not half:
+        words += " o'clock"
+    return words + (f" {half.lower()} m" if half else "")
+
+
+def _url(match):
+    return match.group(1).lower().replace(".", " dot ")
+
+
+def _email(match):
+    return f"{match.group(1)} at {match.group(2).replace('.', ' dot ')}"
+
+
+def _plain_number(match):
+    sign, value = match.group(1), match.group(2)
+    return ("minus " if sign else "") + decimal_words(value)
+
+
+def expand_numbers(text):
+    """Spell out currency, percentages, times, ordinals, ranges, years and plain numbers (English)"""
+    for pattern, replacement in SYMBOLS:
+        text = pattern.sub(replacement, text)
+    text = MONEY.sub(_money, text)
+    text = PERCENT.sub(lambda m: decimal_words(m.group(1)) + " percent", text)
+    text = TIME.sub(_time, text)
+    text = ISO_DATE.sub(lambda m: f"{MONTHS[int(m.group(2)) - 1]} {ordinal_words(int(m.group(3)))}, "
+                                  f"{year_words(int(m.group(1)))}", text)
+    text = AM_PM.sub(lambda m: f" {m.group(1).lower()} m", text)
+    text = ORDINAL.sub(lambda m: ordinal_words(int(m.group(1))), text)
+    text = RANGE.sub(lambda m: f"{decimal_words(m.group(1))} to {decimal_words(m.group(2))}", text)
+    text = YEAR.sub(lambda m: year_words(int(m.group(1))), text)
+    return PLAIN_NUMBER.sub(_plain_number, text)
+
+
+def clean(text):
+    """Remove what should never be read out: emoji, URL paths, Markdown leftovers, extra spaces"""
+    text = EMOJI.sub("", text)
+    text = EMAIL.sub(_email, text)
+    text = URL.sub(_url, text)
+    text = SPACE_BEFORE_PUNCT.sub(r"\1", SPACES.sub(" ", text))
+    return text.strip()
+
+
+def language_scores(text):
+    """Evidence for each language profile in a piece of text: (scores, word-list hits, word count)"""
+    scores = dict.fromkeys(LANGUAGE_PROFILES, 0.0)
+    hits = dict.fromkeys(LANGUAGE_PROFILES, 0)
+    words = WORD.findall(text)
+    for word in words:
+        # Capitalized words are often names, which say little about the language
+        weight = 0.5 if word[0].isupper() else 1.0
+        word = word.lower()
+        for language, profile in LANGUAGE_PROFILES.items():
+            if word in profile["words"]:
+                scores[language] += 2 * weight
+                hits[language] += 1
+            elif "prefix" in profile and profile["prefix"].match(word):
+                scores[language] += 1.5 * weight
+            elif "cluster" in profile and word[-1] in "aeiou" and profile["cluster"].search(word):
+                scores[language] += 1 * weight
+            elif "suffix" in profile and profile["suffix"].search(word):
+                scores[language] += 1 * weight
+    return scores, hits, len(words)
+
+
+def detect_language(text, default=None):
+    """Most likely language of a short piece of text, or `default` when the evidence is weak"""
+    scores, hits, words = language_scores(text)
+    for language in scores:
+        if hits[language] < max(MIN_LEXICON_WORDS, MIN_LEXICON_SHARE * words):
+            scores[language] = 0.0
+    best = max(scores, key=scores.get)
+    runner_up = max((score for language, score in scores.items() if language != best), default=0.0)
+    if scores[best] < MIN_LANGUAGE_SCORE or scores[best] <= runner_up * 1.2:
+        return default
+    return best
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_sentence(sentence, default_language="en"):
+    """((text, language), ...) for one sentence, split where the language changes between clauses"""
+    sentence = clean(sentence)
+    if not sentence:
+        return ()
+    clauses = CLAUSE_SPLIT.split(sentence) if "," in sentence or ";" in sentence or " - " in sentence else [sentence]
+    whole = detect_language(sentence)
+    languages = [detect_language(clause) for clause in clauses]
+    if len(set(language for language in languages if language)) <= 1:
+        # One language (or too little evidence to split): keep the sentence intact
+        language = whole or next((language for language in languages if language), None) or default_language
+        return ((_speakable(sentence, language), language),)
+    # Ambiguous clauses (names, one-word asides) join the language of the clause before them
+    resolved = []
+    for clause, language in zip(clauses, languages):
+        language = language or (resolved[-1][1] if resolved else whole or default_language)
+        if resolved and resolved[-1][1] == language:
+            resolved[-1] = (resolved[-1][0] + ", " + clause, language)
+        else:
+            resolved.append((clause, language))
+    return tuple((_speakable(text, language), language) for text, language in resolved)
+
+
+def _speakable(text, language):
+    # Digits are left to non-English voices, which read them in their own language
+    return expand_numbers(text) if language == "en" else text
+
+
+def segment(text, default_language="en"):
+    """[(text, language)] for a reply, adjacent same-language pieces merged"""
+    segments = []
+    for sentence in SENTENCE_END.split(strip_markdown(text)):
+        for piece, language in normalize_sentence(SPACES.sub(" ", sentence).strip(), default_language):
+            if segments and segments[-1][1] == language:
+                segments[-1] = (segments[-1][0] + " " + piece, language)
+            else:
+                segments.append((piece, language))
+    return segments
+
+
+def voice_language(voice):
+    language = voice.get("language") or voice.get("locale") or ""
+    return language.split("-")[0].lower()
+
+
+def route(segments, voice_id, voices, language=None):
+    """Segments with a voice each: the chosen voice where it speaks the language, else a catalogue match.
+
+    language is the chosen voice's own language when it isn't in `voices`.
+    """
+    by_language = {}
+    for voice in voices:
+        by_language.setdefault(voice_language(voice), voice["id"])
+    preferred = next((voice_language(voice) for voice in voices if voice["id"] == voice_id), language)
+    routed = []
+    for text, language in segments:
+        chosen = voice_id
+        if preferred is not None and language != preferred:
+            chosen = by_language.get(language, voice_id)
+        if routed and routed[-1].voice_id == chosen:
+            # Same voice either way: keep it as one request
+            routed[-1] = Segment(routed[-1].text + " " + text, routed[-1].language, chosen)
+        else:
+            routed.append(Segment(text, language, chosen))
+    return routed
+
+
+def prepare(text, voice_id, voices=(), default_language="en"):
+    """Normalize a reply and split it into (text, language, voice_id) segments for TTS"""
+    return route(segment(text, default_language), voice_id, voices)
+
+
+# Characters per second through the front end, cold and memoized
+if __name__ == "__main__":
+    import time
+
+    samples = [
+        "Mumtumie Andrew Pesa , Mimi Simba Mwenyewe nitaperform",
+        "**Sure!** Your order #42 ships on the 3rd. It costs $1,249.99 (about KSh 160,000) - 15% off.",
+        "The meeting is at 3:30 pm on 2024-05-01; see https://example.com/docs/meeting?id=7 for details 🎉",
+        "Habari yako? I can help with that, asante sana kwa kusubiri.",
+        "Temperatures will reach 31°C between 1-3 pm, with a 40% chance of rain in 1998 terms.",
+        "## Steps\n1. Open the app\n2. Tap *Settings*\n3. Email help@support.example.co.ke",
+    ]
+    voices = [{"id": "english-voice", "language": "en-US"}, {"id": "swahili-voice", "language": "sw-KE"}]
+    for sample in samples:
+        print(repr(sample))
+        for piece in prepare(sample, "english-voice", voices):
+            print(f"    [{piece.language} -> {piece.voice_id}] {piece.text}")
+
+    rng_text = [f"Item {i}: costs ${i * 3}.{i % 100:02d}, due on the {i % 28 + 1}th at {i % 12 + 1}:15 pm. "
+                f"Tafadhali lipa leo, rafiki {i}." for i in range(2000)]
+    chars = sum(len(text) for text in rng_text)
+    normalize_sentence.cache_clear()
+    start = time.perf_counter()
+    for text in rng_text:
+        prepare(text, "english-voice", voices)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for text in rng_text:
+        prepare(text, "english-voice", voices)
+    warm = time.perf_counter() - start
+    print(f"{chars} chars: cold {chars / cold:,.0f} chars/s, memoized {chars / warm:,.0f} chars/s")
@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import config
+
+# Shared by every turn in the process; stages are short and mostly wait on the network
+_executor = ThreadPoolExecutor(max_workers=config.get_settings().turn_workers, thread_name_prefix="voice-turn")
+
+
+class TurnCancelled(Exception):
+    """Raised for stages that never ran because the turn was cancelled."""
+
+
+class Stage:
+    def __init__(self, name, after):
+        self.name = name
+        self.after = list(after)
+        self.future = Future()
+        self.start = None
+        self.end = None
+
+    @property
+    def seconds(self):
+        return (self.end - self.start) if self.start is not None and self.end is not None else 0.0
+
+
+class Turn:
+    """Runs the stages of one voice turn, overlapping the ones that don't depend on each other.
+
+    submit() runs a stage on the shared thread pool as soon as the stages named in
+    `after` have finished; call() runs a stage on the calling thread (needed for
+    anything that touches Streamlit) after the previous call() and its `after` stages.
+    Leaving the `with` block through an exception (including Streamlit's stop/rerun)
+    cancels every stage that has not started yet.
+    """
+
+    def __init__(self, name="turn"):
+        self.name = name
+        self.stages = {}
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._last_inline = None
+        self._started = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cancel()
+
+    def _new_stage(self, name, after):
+        with self._lock:
+            if name in self.stages:
+                raise ValueError(f"Duplicate stage {name}")
+            stage = self.stages[name] = Stage(name, after)
+        return stage
+
+    def _execute(self, stage, func, args, kwargs):
+        if self.cancelled.is_set():
+            raise TurnCancelled(stage.name)
+        stage.start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stage.end = time.perf_counter()
+
+    def submit(self, name, func, *args, after=(), **kwargs):
+        """Run func(*args, **kwargs) in the background once the `after` stages are done"""
+        stage = self._new_stage(name, after)
+        deps = [self.stages[dep].future for dep in after]
+        remaining = [len(deps)]
+        failed = [False]
+
+        def run():
+            if not stage.future.set_running_or_notify_cancel():
+                return
+            try:
+                stage.future.set_result(self._execute(stage, func, args, kwargs))
+            except BaseException as e:
+                stage.future.set_exception(e)
+
+        def dep_done(dep):
+            dep_failed = dep is not None and (dep.cancelled() or dep.exception() is not None)
+            with self._lock:
+                remaining[0] -= 1
+                # Only the first failure settles the stage; once failed it never runs
+                if failed[0] or (not dep_failed and remaining[0]):
+                    return
+                failed[0] = dep_failed
+            if dep_failed:
+                # A failed dependency fails this stage too, without running it
+                if stage.future.set_running_or_notify_cancel():
+                    stage.future.set_exception(TurnCancelled(f"{name}: dependency failed"))
+                return
+            _executor.submit(run)
+
+        if not deps:
+            remaining[0] = 1
+            dep_done(None)
+        for dep in deps:
+            dep.add_done_callback(dep_done)
+        return stage.future
+
+    def call(self, name, func, *args, after=(), **kwargs):
+        """Run func on the calling thread after the previous call() and the `after` stages"""
+        inline_after = list(after) + ([self._last_inline] if self._last_inline else [])
+        stage = self._new_stage(name, inline_after)
+        self._last_inline = name
+        for dep in after:
+            self.result(dep)
+        stage.future.set_running_or_notify_cancel()
+        try:
+            result = self._execute(stage, func, args, kwargs)
+        except BaseException as e:
+            stage.future.set_exception(e)
+            raise
+        stage.future.set_result(result)
+        return result
+
+    def result(self, name, timeout=None):
+        """Wait for a stage; an interrupt while waiting cancels the rest of the turn"""
+        try:
+            return self.stages[name].future.result(timeout)
+        except BaseException:
+            self.cancel()
+            raise
+
+    def cancel(self):
+        """Stop the turn: stages that have not started are cancelled, running ones are left to finish"""
+        self.cancelled.set()
+        with self._lock:
+            stages = list(self.stages.values())
+        for stage in stages:
+            stage.future.cancel()
+
+    def critical_path(self):
+        """Chain of stages that determined the turn's wall time, from first to last"""
+        finished = [stage for stage in self.stages.values() if stage.end is not None]
+        if not finished:
+            return []
+        stage = max(finished, key=lambda s: s.end)
+        path = [stage]
+        while True:
+            deps = [self.stages[dep] for dep in stage.after if self.stages[dep].end is not None]
+            if not deps:
+                break
+            stage = max(deps, key=lambda s: s.end)
+            path.append(stage)
+        return path[::-1]
+
+    def report(self):
+        """Wall time, critical path and time saved by overlapping stages"""
+        wall = max((stage.end for stage in self.stages.values() if stage.end), default=self._started) - self._started
+        busy = sum(stage.seconds for stage in self.stages.values())
+        path = self.critical_path()
+        report = {
+            "turn": self.name,
+            "wall_seconds": round(wall, 3),
+            "stage_seconds": {stage.name: round(stage.seconds, 3) for stage in self.stages.values()},
+            "critical_path": [stage.name for stage in path],
+            "critical_seconds": round(sum(stage.seconds for stage in path), 3),
+            "overlap_seconds": round(max(0.0, busy - wall), 3),
+            "cancelled": self.cancelled.is_set(),
+        }
+        logging.info(
+            f"{self.name}: {report['wall_seconds']:.2f}s, critical path "
+            + " -> ".join(f"{stage.name} {stage.seconds:.2f}s" for stage in path)
+        )
+        return report
+
+
+# Compare a serial voice turn with an orchestrated one using fake providers
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    os.environ.setdefault("VOICE_PROVIDERS", "fake")
+    os.environ.setdefault("FAKE_PROVIDER_LATENCY", "0.3")
+    config.get_settings.cache_clear()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    import fake_providers
+    import voice_pipeline
+
+    def record():
+        time.sleep(1.0)
+        return fake_providers.tone_wav(1.0)
+
+    def save(audio):
+        path = tempfile.NamedTemporaryFile(suffix=".wav", delete=False).name
+        with open(path, "wb") as f:
+            f.write(audio)
+        return path
+
+    def warm(provider):
+        # Stands in for the TCP/TLS handshake a cold connection pays on its first call
+        time.sleep(0.25)
+
+    def tts(text, warmed=True):
+        if not warmed:
+            time.sleep(0.25)
+        return voice_pipeline.text_to_speech(text)
+
+    messages = [{"role": "user", "content": "hello"}]
+
+    start = time.perf_counter()
+    path = save(record())
+    text = voice_pipeline.transcribe_audio(path, use_cache=False)
+    reply = voice_pipeline.chat_reply(messages + [{"role": "user", "content": text}])
+    tts(reply, warmed=False)
+    os.unlink(path)
+    print(f"serial turn: {time.perf_counter() - start:.2f}s")
+
+    with Turn("voice") as turn:
+        turn.submit("warm_stt", warm, "openai")
+        turn.submit("warm_tts", warm, "speechify")
+        audio = turn.call("record", record)
+        path = turn.call("save_wav", save, audio)
+        text = turn.call("transcribe", voice_pipeline.transcribe_audio, path, use_cache=False, after=["warm_stt"])
+        turn.submit("cleanup", os.unlink, path, after=["transcribe"])
+        reply = turn.call("chat", voice_pipeline.chat_reply, messages + [{"role": "user", "content": text}])
+        turn.call("tts", tts, reply, after=["warm_tts"])
+    report = turn.report()
+    print(f"orchestrated turn: {report['wall_seconds']:.2f}s, overlap {report['overlap_seconds']:.2f}s")
+
+    # Cancelling mid-turn skips stages that have not started
+    with Turn("cancelled") as turn:
+        turn.submit("slow", time.sleep, 0.5)
+        later = turn.submit("after_slow", print, "should not run", after=["slow"])
+        turn.cancel()
+    print(f"cancelled turn: dependent stage cancelled={later.cancelled() or isinstance(later.exception(), TurnCancelled)}")
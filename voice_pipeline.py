@@ -0,0 +1,295 @@
+import base64
+import logging
+import time
+import openai
+
+import audio_post
+import chat_router
+import config
+import fake_providers
+import local_inference
+import rate_limit
+import transcription_cache
+import tts_text
+from single_flight import coalesce
+
+# Providers, endpoints, models and secrets come from config.py (loaded once per process)
+SETTINGS = config.get_settings()
+OPENAI = SETTINGS.provider("openai")
+SPEECHIFY = SETTINGS.provider("speechify")
+ELEVENLABS = SETTINGS.provider("elevenlabs")
+
+# Configure OpenAI API key
+openai.api_key = OPENAI.api_key
+
+# Set VOICE_PROVIDERS=fake to run against the local stand-ins in fake_providers.py
+USE_FAKE_PROVIDERS = SETTINGS.fake_providers
+
+# Provider endpoints
+SPEECHIFY_TTS_URL = SPEECHIFY.url("tts")
+SPEECHIFY_VOICES_URL = SPEECHIFY.url("voices")
+ELEVENLABS_API_URL = ELEVENLABS.url("api")
+
+# Lightweight URLs used to open a connection to each provider before the first real call
+WARM_URLS = {
+    "speechify": SPEECHIFY_VOICES_URL,
+    "elevenlabs": ELEVENLABS_API_URL,
+}
+
+DEFAULT_VOICE_ID = SETTINGS.default_voice_id
+# The provider's voice list is only fetched when a reply needs a language config.py has no voice for
+VOICE_LIST_TTL = 3600.0
+_remote_voices = {"voices": None, "fetched": 0.0}
+CHAT_MODEL = OPENAI.models["chat"]
+
+# Voice-list and TTS calls below are wrapped with @coalesce: concurrent identical
+# calls (e.g. several sessions loading the voice list or speaking the same
+# welcome message) share one provider request. See single_flight.metrics().
+# Every provider request also goes through the per-provider/per-key token bucket
+# in rate_limit.py; wrap batch work in rate_limit.priority(rate_limit.BATCH).
+
+
+class ProviderError(Exception):
+    """Raised when a provider answers with an error status."""
+
+    def __init__(self, provider, status_code, message):
+        super().__init__(f"{provider} error: {status_code} - {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.message = message
+
+
+def transcribe_audio(audio_file, use_cache=True):
+    """Transcribe audio using OpenAI Whisper, reusing transcripts of identical recordings"""
+    if use_cache:
+        return transcription_cache.get_cache().transcribe(audio_file, whisper_transcribe)
+    return whisper_transcribe(audio_file)
+
+
+def whisper_transcribe(audio_file):
+    """Transcribe audio using OpenAI Whisper (uncached)"""
+    if USE_FAKE_PROVIDERS:
+        return fake_providers.transcribe_audio(audio_file)
+    if SETTINGS.local_stt_model:
+        # Local Whisper, batched with other sessions' requests on the inference workers
+        return local_inference.transcribe(audio_file)
+    def create():
+        # Reopened on every attempt, so a retry after a 429 uploads the whole file again
+        with open(audio_file, 'rb') as file:
+            return openai.audio.transcriptions.create(
+                model=OPENAI.models["stt"],
+                file=file
+            )
+
+    return rate_limit.call("openai", openai.api_key, create).text
+
+
+def chat_reply(messages, model=None, budget=None):
+    """Get the assistant reply for a list of chat messages
+
+    The backend is picked by chat_router.py to finish the reply within `budget`
+    seconds; passing `model` pins the OpenAI model instead.
+    """
+    return chat_router.get_router().reply(messages, budget, backend=_pinned_backend(model), model=model)
+
+
+def chat_reply_stream(messages, model=None, budget=None):
+    """Yield the assistant reply in chunks as the model generates it
+
+    The backend is picked by chat_router.py so the first sentence is ready within
+    `budget` seconds.
+    """
+    yield from chat_router.get_router().stream(messages, budget, backend=_pinned_backend(model), model=model)
+
+
+def _pinned_backend(model):
+    if model is None:
+        return None
+    return "fake" if USE_FAKE_PROVIDERS else "openai"
+
+
+@coalesce("speechify_tts")
+def speechify_tts(text, voice_id=DEFAULT_VOICE_ID, api_key=None):
+    """Convert text to speech using Speechify, returns (audio_bytes, audio_format)"""
+    if USE_FAKE_PROVIDERS:
+        return fake_providers.speechify_tts(text, voice_id)
+    api_key = api_key or SPEECHIFY.api_key
+    if not api_key:
+        raise ProviderError("speechify", 401, "SPEECHIFY_API_KEY environment variable not set")
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+    data = {
+        "input": text,
+        "voice_id": voice_id
+    }
+    response = rate_limit.request("speechify", api_key, "post", SPEECHIFY_TTS_URL, json=data, headers=headers,
+                                  timeout=SPEECHIFY.timeout)
+    if response.status_code != 200:
+        raise ProviderError("speechify", response.status_code, response.text)
+
+    response_data = response.json()
+    if "audio_data" not in response_data:
+        raise ProviderError("speechify", response.status_code, f"No audio data in response: {response_data}")
+    audio_binary = base64.b64decode(response_data["audio_data"])
+    return audio_binary, response_data.get("audio_format", "wav")
+
+
+@coalesce("speechify_voices")
+def speechify_voices(api_key=None):
+    """Get the list of Speechify voices as returned by the API"""
+    if USE_FAKE_PROVIDERS:
+        return fake_providers.speechify_voices()
+    api_key = api_key or SPEECHIFY.api_key
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Accept": "application/json"
+    }
+    response = rate_limit.request("speechify", api_key, "get", SPEECHIFY_VOICES_URL, headers=headers,
+                                  timeout=SPEECHIFY.timeout)
+    if response.status_code != 200:
+        raise ProviderError("speechify", response.status_code, response.text)
+    return response.json()
+
+
+@coalesce("elevenlabs_tts")
+def elevenlabs_tts(text, voice_id, api_key=None):
+    """Convert text to speech using ElevenLabs, returns mp3 bytes"""
+    if USE_FAKE_PROVIDERS:
+        return fake_providers.elevenlabs_tts(text, voice_id)
+    api_key = api_key or ELEVENLABS.api_key
+    headers = {
+        "xi-api-key": api_key,
+        "Content-Type": "application/json",
+        "Accept": "audio/mpeg"
+    }
+    data = {
+        "text": text,
+        "model_id": ELEVENLABS.models["tts"],
+        "voice_settings": {
+            "stability": 0.5,
+            "similarity_boost": 0.75
+        }
+    }
+    response = rate_limit.request(
+        "elevenlabs",
+        api_key,
+        "post",
+        f"{ELEVENLABS_API_URL}/text-to-speech/{voice_id}",
+        headers=headers,
+        json=data,
+        timeout=ELEVENLABS.timeout
+    )
+    if response.status_code != 200:
+        raise ProviderError("elevenlabs", response.status_code, response.text)
+    return response.content
+
+
+@coalesce("elevenlabs_voices")
+def elevenlabs_voices(api_key=None):
+    """Get available ElevenLabs voices as a {name: voice_id} mapping"""
+    if USE_FAKE_PROVIDERS:
+        return {voice["name"]: voice["id"] for voice in fake_providers.speechify_voices()}
+    api_key = api_key or ELEVENLABS.api_key
+    headers = {
+        "xi-api-key": api_key,
+        "Accept": "application/json"
+    }
+    response = rate_limit.request("elevenlabs", api_key, "get", f"{ELEVENLABS_API_URL}/voices", headers=headers,
+                                  timeout=ELEVENLABS.timeout)
+    if response.status_code != 200:
+        raise ProviderError("elevenlabs", response.status_code, response.text)
+    voices_data = response.json()
+    return {voice["name"]: voice["voice_id"] for voice in voices_data["voices"]}
+
+
+def voice_catalogue(provider, languages=()):
+    """Voices segments can be routed to: config.py's list, plus the provider's own list for missing languages"""
+    voices = [{"id": voice.id, "language": voice.language} for voice in SETTINGS.voices_for(provider)]
+    covered = {tts_text.voice_language(voice) for voice in voices}
+    if provider == "speechify" and any(language not in covered for language in languages):
+        now = time.monotonic()
+        if _remote_voices["voices"] is None or now - _remote_voices["fetched"] > VOICE_LIST_TTL:
+            try:
+                _remote_voices.update(voices=speechify_voices(), fetched=now)
+            except Exception as e:
+                logging.warning(f"Could not load the Speechify voice list: {str(e)}")
+                _remote_voices.update(voices=[], fetched=now)
+        voices += _remote_voices["voices"]
+    return voices
+
+
+def voice_segments(text, provider, voice_id):
+    """tts_text segments of a reply, each with the voice to speak it.
+
+    Text stays in the chosen voice's own language unless tts_text finds clear evidence
+    of another one; only then is the catalogue (and possibly the provider's voice list)
+    consulted for a voice that speaks it.
+    """
+    voice = SETTINGS.voice(voice_id) if voice_id else None
+    language = tts_text.voice_language({"language": voice.language}) if voice else "en"
+    pieces = tts_text.segment(text, language)
+    other_languages = {piece_language for _, piece_language in pieces} - {language}
+    voices = voice_catalogue(provider, other_languages) if other_languages else ()
+    return tts_text.route(pieces, voice_id, voices, language)
+
+
+def _synthesize(text, provider, voice_id, api_key):
+    if provider == "elevenlabs":
+        return elevenlabs_tts(text, voice_id, api_key), "mp3"
+    if provider == "local":
+        return local_inference.synthesize(text), "wav"
+    return speechify_tts(text, voice_id or DEFAULT_VOICE_ID, api_key)
+
+
+def text_to_speech(text, provider="speechify", voice_id=None, api_key=None, postprocess=False, normalize=True):
+    """Synthesize text with the given provider, returns (audio_bytes, audio_format)
+
+    With normalize=True the text goes through tts_text.py first: Markdown, URLs and
+    emoji are dropped, numbers are spelled out, and segments in another language than
+    the voice (e.g. Swahili in an English reply) go to a catalogue voice that speaks it.
+    With postprocess=True the clip is trimmed, resampled and loudness-normalized
+    (see audio_post.py) so every provider plays at the same level and rate. A reply
+    spoken by several voices comes back as one WAV, post-processed or not.
+    """
+    if provider == "speechify":
+        voice_id = voice_id or DEFAULT_VOICE_ID
+    segments = voice_segments(text, provider, voice_id) if normalize else []
+    segments = segments or [tts_text.Segment(text, None, voice_id)]
+    if len(segments) > 1:
+        # Several voices: synthesize each segment and crossfade them into one clip
+        return audio_post.join_clips([_synthesize(segment.text, provider, segment.voice_id, api_key)
+                                      for segment in segments], postprocess=postprocess)
+    audio_data, audio_format = _synthesize(segments[0].text, provider, segments[0].voice_id, api_key)
+    if postprocess:
+        return audio_post.process_to_wav(audio_data, audio_format)
+    return audio_data, audio_format
+
+
+def warm_connections(provider):
+    """Open the provider's HTTP connection (DNS, TCP, TLS) so the next call skips the handshake"""
+    if USE_FAKE_PROVIDERS:
+        return
+    if provider == "openai":
+        # The OpenAI client keeps its own connection pool; a model lookup opens it
+        try:
+            openai.models.retrieve(CHAT_MODEL)
+        except Exception as e:
+            logging.debug(f"Warming openai connection failed: {str(e)}")
+        return
+    rate_limit.warm(provider, WARM_URLS[provider])
+
+
+def voice_turn(audio_file, messages, provider="speechify", voice_id=None, api_key=None):
+    """Run one full voice turn: transcribe, chat and synthesize the reply"""
+    transcript = transcribe_audio(audio_file)
+    messages = list(messages) + [{"role": "user", "content": transcript}]
+    reply = chat_reply(messages)
+    try:
+        audio_data, audio_format = text_to_speech(reply, provider, voice_id, api_key)
+    except ProviderError as e:
+        logging.error(f"Error generating speech: {str(e)}")
+        audio_data, audio_format = None, None
+    return transcript, reply, audio_data, audio_format
@@ -0,0 +1,258 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+
+EMBEDDING_SAMPLE_RATE = 16000
+N_MFCC = 40
+EMBEDDING_DIM = 4 * N_MFCC  # mean and std of MFCCs and their deltas
+DEFAULT_INDEX_PATH = os.path.join("media", "voice_profiles", "index.npz")
+DEFAULT_CACHE_DIR = os.path.join("media", "voice_profiles", "embeddings")
+
+# Keep torch from spawning one thread per core inside Streamlit/server worker threads
+torch.set_num_threads(max(1, min(4, os.cpu_count() or 1)))
+
+
+@functools.lru_cache(maxsize=1)
+def mfcc_transform():
+    return torchaudio.transforms.MFCC(
+        sample_rate=EMBEDDING_SAMPLE_RATE,
+        n_mfcc=N_MFCC,
+        melkwargs={"n_fft": 400, "hop_length": 160, "n_mels": 64},
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def wav2vec2_model():
+    # Downloads the torchaudio bundle weights on first use
+    bundle = torchaudio.pipelines.WAV2VEC2_BASE
+    return bundle.get_model().eval(), bundle.sample_rate
+
+
+def load_waveform(audio_file, sample_rate=EMBEDDING_SAMPLE_RATE):
+    """Load a reference file as a mono float32 tensor at sample_rate"""
+    samples, file_rate = sf.read(audio_file, dtype="float32", always_2d=True)
+    waveform = torch.from_numpy(samples.mean(axis=1))
+    if file_rate != sample_rate:
+        waveform = torchaudio.functional.resample(waveform, file_rate, sample_rate)
+    return waveform
+
+
+def compute_embedding(waveform, backend="mfcc"):
+    """Fixed-size, L2-normalized speaker embedding for a mono waveform at 16 kHz"""
+    with torch.inference_mode():
+        if backend == "wav2vec2":
+            model, _ = wav2vec2_model()
+            features, _ = model.extract_features(waveform.unsqueeze(0))
+            frames = features[-1][0]
+            embedding = torch.cat([frames.mean(dim=0), frames.std(dim=0)])
+        else:
+            mfcc = mfcc_transform()(waveform)  # [n_mfcc, frames]
+            deltas = torchaudio.functional.compute_deltas(mfcc)
+            embedding = torch.cat([mfcc.mean(dim=1), mfcc.std(dim=1), deltas.mean(dim=1), deltas.std(dim=1)])
+        embedding = embedding / embedding.norm().clamp_min(1e-8)
+    return embedding.numpy().astype(np.float32)
+
+
+def file_digest(audio_file):
+    digest = hashlib.sha256()
+    with open(audio_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def embed_file(audio_file, backend="mfcc", cache_dir=DEFAULT_CACHE_DIR):
+    """Embedding for a reference file, computed once and cached by content hash"""
+    path = os.path.join(cache_dir, f"{file_digest(audio_file)}.{backend}.npy")
+    if os.path.exists(path):
+        return np.load(path)
+    embedding = compute_embedding(load_waveform(audio_file), backend)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(temp_path, embedding)
+    os.replace(temp_path, path)
+    return embedding
+
+
+class VoiceIndex:
+    """Voice profiles as one contiguous float32 matrix of unit vectors.
+
+    Lookups are a single matrix-vector product (cosine similarity, since rows are
+    normalized) followed by argpartition, so 10k profiles take well under a millisecond.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM, capacity=1024):
+        self.dim = dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.ids = []
+        self.meta = []
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def matrix(self):
+        return self._matrix[:len(self.ids)]
+
+    def add(self, voice_id, embedding, meta=None):
+        """Add or replace the profile for voice_id"""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-8)
+        with self._lock:
+            if not self.ids and vector.size != self.dim:
+                # An empty index takes the dimension of its first profile (e.g. wav2vec2 features)
+                self.dim = vector.size
+                self._matrix = np.zeros((len(self._matrix), self.dim), dtype=np.float32)
+            position = self._positions.get(voice_id)
+            if position is None:
+                position = len(self.ids)
+                if position == len(self._matrix):
+                    grown = np.zeros((2 * len(self._matrix), self.dim), dtype=np.float32)
+                    grown[:position] = self._matrix[:position]
+                    self._matrix = grown
+                self.ids.append(voice_id)
+                self.meta.append(meta or {})
+                self._positions[voice_id] = position
+            else:
+                self.meta[position] = meta or self.meta[position]
+            self._matrix[position] = vector
+
+    def add_many(self, voice_ids, embeddings, metas=None):
+        for i, (voice_id, embedding) in enumerate(zip(voice_ids, embeddings)):
+            self.add(voice_id, embedding, metas[i] if metas else None)
+
+    def nearest(self, embedding, k=1):
+        """Top-k (voice_id, similarity, meta) by cosine similarity"""
+        if not self.ids:
+            return []
+        query = np.asarray(embedding, dtype=np.float32).reshape(self.dim)
+        query = query / max(float(np.linalg.norm(query)), 1e-8)
+        scores = self.matrix @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i]), self.meta[i]) for i in top]
+
+    def nearest_batch(self, embeddings, k=1):
+        """Top-k ids and similarities for several queries in one matrix product"""
+        queries = np.asarray(embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-8)
+        scores = queries @ self.matrix.T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        return [[(self.ids[i], float(scores[row, i])) for i in top[row]] for row in range(len(top))]
+
+    def save(self, path=DEFAULT_INDEX_PATH):
+        """Store as one .npz: float16 matrix (half the size, ample precision for cosine) plus ids/meta"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temp_path,
+            matrix=self.matrix.astype(np.float16),
+            ids=np.array(self.ids, dtype=object).astype(str),
+            meta=np.array(json.dumps(self.meta)),
+        )
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_INDEX_PATH):
+        with np.load(path) as data:
+            matrix = data["matrix"].astype(np.float32)
+            index = cls(dim=matrix.shape[1], capacity=max(1024, len(matrix)))
+            index._matrix[:len(matrix)] = matrix
+            index.ids = [str(voice_id) for voice_id in data["ids"]]
+            index.meta = json.loads(str(data["meta"]))
+        index._positions = {voice_id: i for i, voice_id in enumerate(index.ids)}
+        return index
+
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def get_index(path=DEFAULT_INDEX_PATH):
+    """Load the on-disk index once per process"""
+    with _index_lock:
+        index = _index_cache.get(path)
+        if index is None:
+            index = VoiceIndex.load(path) if os.path.exists(path) else VoiceIndex()
+            _index_cache[path] = index
+        return index
+
+
+def enroll(voice_id, audio_files, name=None, path=DEFAULT_INDEX_PATH, backend="mfcc"):
+    """Average the embeddings of one or more reference files into a voice profile"""
+    embeddings = np.stack([embed_file(audio_file, backend) for audio_file in audio_files])
+    index = get_index(path)
+    index.add(voice_id, embeddings.mean(axis=0), {"name": name or voice_id, "files": len(audio_files)})
+    index.save(path)
+    return index
+
+
+def match(audio_file, k=3, path=DEFAULT_INDEX_PATH, backend="mfcc"):
+    """Nearest enrolled voices for a reference recording"""
+    return get_index(path).nearest(embed_file(audio_file, backend), k)
+
+
+def benchmark(profiles=10000, queries=1000):
+    rng = np.random.default_rng(0)
+    index = VoiceIndex(capacity=profiles)
+    index.add_many([f"voice-{i}" for i in range(profiles)], rng.standard_normal((profiles, EMBEDDING_DIM)))
+    query_vectors = rng.standard_normal((queries, EMBEDDING_DIM)).astype(np.float32)
+
+    start = time.perf_counter()
+    for query in query_vectors:
+        index.nearest(query, k=5)
+    single_ms = 1000 * (time.perf_counter() - start) / queries
+
+    start = time.perf_counter()
+    index.nearest_batch(query_vectors, k=5)
+    batch_ms = 1000 * (time.perf_counter() - start) / queries
+
+    waveform = torch.randn(EMBEDDING_SAMPLE_RATE * 10) * 0.1
+    compute_embedding(waveform)
+    start = time.perf_counter()
+    compute_embedding(waveform)
+    embed_ms = 1000 * (time.perf_counter() - start)
+
+    size_kb = index.matrix.astype(np.float16).nbytes / 1024
+    print(f"{profiles} profiles ({size_kb:.0f} KB as float16 on disk)")
+    print(f"single lookup: {single_ms:.3f} ms, batched lookup: {batch_ms:.4f} ms/query")
+    print(f"embedding 10 s of audio: {embed_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speaker embeddings and voice-profile index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    enroll_parser = sub.add_parser("enroll", help="Add reference WAVs as a voice profile")
+    enroll_parser.add_argument("voice_id")
+    enroll_parser.add_argument("files", nargs="+")
+    enroll_parser.add_argument("--name")
+    match_parser = sub.add_parser("match", help="Find the nearest enrolled voices")
+    match_parser.add_argument("file")
+    match_parser.add_argument("-k", type=int, default=3)
+    bench_parser = sub.add_parser("bench", help="Benchmark lookups across many profiles")
+    bench_parser.add_argument("--profiles", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.command == "enroll":
+        index = enroll(args.voice_id, args.files, args.name)
+        print(f"Enrolled {args.voice_id}; index has {len(index)} profiles")
+    elif args.command == "match":
+        for voice_id, score, meta in match(args.file, args.k):
+            print(f"{score:.3f}  {voice_id}  {meta.get('name', '')}")
+    else:
+        benchmark(args.profiles)